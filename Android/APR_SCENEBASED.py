@@ -5,220 +5,154 @@ import os
 import time
 import glob
 import datetime
-from utils.command import call_program
-from utils.command import retry_call_program
+from utils.adb_client import AdbStreamError
+from utils.adb_client import call_adb
+from utils.adb_client import retry_call_adb
+from utils.adb_client import set_client_enabled
+from utils.devices import resolve_devices, default_serial, remaining_tasks, make_task_queue, next_task, run_on_devices
+from utils.resume import new_session_id, load_session, ResumeError
+from utils.schedule import ORDERS, order_tasks, estimate_run, format_estimate
+from utils.adaptive import AdaptiveTasks
+from utils.logcat import LogcatFollower, LogcatParser, LogcatReader, LOGCAT_FILTERS
+from utils.install_cache import InstallCache
+from utils.thermal import wait_for_device
+from utils.profile import get_profile
+from utils.frames import FrameCollector, FRAME_MODES, format_frame_summary
+from utils.screenshots import ScreenshotStore, TestScreenshots, parse_points, SCREENSHOT_DIR, DEFAULT_WIDTH
+from utils.trace import get_tracer, span
+from utils.kibana import BulkSink
+from utils.results_db import ResultsDB
+from utils.stats import format_summary
+from utils.snipeit import SnipeItCache, CACHE_NAME, load_config
+from utils.metrics import is_structured, parse_records, parse_metric_scenes
+from utils.spool import Spool, spool_path, replay_spools
 import traceback
 import json
 import requests
 import datetime
 import six
-import base64
 
 def get_logcat(adb_cmd, filters=[]):
     if len(filters) > 0:
         # ignore others
         filters = ['-s'] + filters
 
-    ret = call_program(adb_cmd + ['logcat', '-d'] + filters)
+    ret = call_adb(adb_cmd, ['logcat', '-d'] + filters)
     return ret.decode('utf-8', errors='ignore')
 
 
 def get_results_from_logcat(adb_cmd):
-    filters = ['Unity', 'ActivityManager', 'PackageManager',
-               'dalvikvm', 'DEBUG']
-    out = get_logcat(adb_cmd, filters)
-    lines = out.splitlines()
-    results = []
-    ident = 'ZZRES>>'
-    for l in lines:
-        idx = l.find(ident)
-        if idx == -1:
-            continue
-        results.append(l[idx + len(ident):])
-    if len(results) == 0:
-        return None
-    return results[0]
+    parser = LogcatParser()
+    parser.feed_dump(get_logcat(adb_cmd, LOGCAT_FILTERS))
+    return parser.result()
 
-def get_attributes_from_logcat(adb_cmd):
-    filters = ['Unity', 'ActivityManager', 'PackageManager',
-                'dalvikvm', 'DEBUG']
-    out = get_logcat(adb_cmd, filters)
-    lines = out.splitlines()
-    identArch = 'CPU ='
-    identScript = 'Scripting Backend'
-    identInfo = 'Built from'
-    identUnity = 'Version'
-    identBuildType = 'Build type'
-    identVulkan = 'Vulkan API version'
-    identGLES = 'OpenGL ES'
-    identGraphics = 'Graphics API = '
-    identStop = 'APP_STARTED'
-    
-    architecture = 'UNKNOWN'
-    scriptingBackend = 'UNKNOWN'
-    buildType = 'UNKNOWN'
-    version = 'UNKNOWN'
-    changeset = 'UNKNOWN'
-    graphics_API = 'UNKNOWN'
-    stop = False
+def find_attributes(adb_cmd, timeout, follower=None):
+    if follower is not None:
+        # the stream is already being parsed, just wait for APP_STARTED
+        follower.parser.started.wait(timeout)
+        return follower.parser.attributes()
+    reader = LogcatReader(adb_cmd)
+    end = time.time() + timeout
+    reader.poll()
+    while time.time() < end and not reader.parser.started.is_set():
+        time.sleep(0.2)
+        reader.poll()
+    return reader.parser.attributes()
     
-    for l in lines:
-        idxA = l.find(identArch)
-        idxI = l.find(identInfo)
-        idxV = l.find(identVulkan)
-        idxG = l.find(identGLES)
-        idxGfx = l.find(identGraphics)
-        idxBt = l.find(identBuildType)
-        
-        if idxA > -1:
-            architecture =  l[idxA:].split(identArch)[1].split(' ')[1]
-        if idxI > -1:
-            idxS = l.find(identScript)
-            idxU = l.find(identUnity)
-
-            if idxS > -1:
-                scriptingBackend = l[idxS:].split('\'')[1]
-            if idxU > -1:
-                combined = l[idxU + len(identUnity):].split('\'')[1]
-                version = combined.split('(')[0]
-                changeset = combined.split('(')[1].split(')')[0]
-        if idxV > -1:
-            graphics_API = 'Vulkan'
-        if idxG > -1:
-            idxContext = l.find('Context level')
-            if (idxContext > -1):
-                graphics_API = l[idxContext + len('Context level'):].split('<')[1].split('>')[0]
-        if idxBt > -1:
-            buildType = l[idxBt + len(identBuildType):].split('\'')[1].split('\'')[0]
-        if idxGfx > -1:
-            graphics_API = l[idxGfx + len(identGraphics):]
-        if l.find(identStop) > -1:
-            stop = True
-    return architecture, scriptingBackend, buildType, version, changeset, graphics_API.strip(), stop
-    
-def find_attributes(adb_cmd, timeout):
-    ret = None
-    stop = False
+def wait_for_results(adb_cmd, follower, sleep_s):
     start = time.time()
-    ticker = start
-    end = start + timeout
-    while ticker < end and not stop:
-        ticker = time.time()
-        ret = get_attributes_from_logcat(adb_cmd)
-        stop = ret[len(ret)-1]
+    with span('wait for result'):
+        ret = follower.wait(sleep_s)
+        follower.stop()
+    if ret is None:
+        # stream may have dropped before the test reported, wait out the
+        # rest of the window and check the whole buffer once more
+        with span('wait out sleep'):
+            time.sleep(max(start + sleep_s - time.time(), 0))
+        with span('parse logcat'):
+            ret = get_results_from_logcat(adb_cmd)
     return ret
-    
+
 def measure_startup(adb_cmd, sleep):
     ret = None
     launchTime = None
     start = time.time()
     ticker = start
     end = start + sleep
+    # only fetches what was logged since the previous poll
+    reader = LogcatReader(adb_cmd)
     while ticker < end and ret is None:
         ticker = time.time()
-        ret = get_results_from_logcat(adb_cmd)
+        reader.poll()
+        ret = reader.parser.first_result()
     if ret is not None:
         launchTime = ticker - start
     time.sleep(max(start + sleep - ticker, 0))
     print(launchTime)
     return launchTime
     
-def write_to_file(path,content):
-    try:
-        if (os.path.isfile(path)):
-            file = open(path,'a')
-        else:
-            file = open(path, 'w')
-        file.write(content)
-        file.close()
-    except EnvironmentError: 
-        print ('Error writing to file', EnvironmentError) 
-
-def run_single_app(adb_cmd, app_name, apk_path, measure_start, sleep_s):
+def run_single_app(adb_cmd, app_name, apk_path, measure_start, sleep_s, follower=None, install_cache=None, frames=None, screenshots=None):
     #counter = retry_amount + 1
     #while True and counter > 0:
     ret = ''
-    #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '26']) #Unlock phone before test run
-    #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '82'])
-    #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '82'])
-    #retry_call_program(adb_cmd + ['uninstall', app_name], retry_count = 3,
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '26']) #Unlock phone before test run
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '82'])
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '82'])
+    #retry_call_adb(adb_cmd, ['uninstall', app_name], retry_count = 3,
                  #check_returncode=False)  # check if app is installed at all
-    retry_call_program(adb_cmd + ['shell', 'pm', 'clear', app_name], retry_count = 3,
-                 check_returncode=False)  # app might have never existed
-    time.sleep(5)
-    retry_call_program(adb_cmd + ['install', '-r', '-d', apk_path], retry_count = 3)
-    retry_call_program(adb_cmd + ['shell', 'sync'], retry_count = 3)
-    retry_call_program(adb_cmd + ['logcat', '-c'], retry_count = 3)
-    time.sleep(5)
+    with span('pm clear'):
+        retry_call_adb(adb_cmd, ['shell', 'pm', 'clear', app_name], retry_count = 3,
+                     check_returncode=False)  # app might have never existed
+    with span('sleep after clear'):
+        time.sleep(5)
+    with span('install'):
+        if install_cache is not None:
+            install_cache.install(adb_cmd, app_name, apk_path)
+        else:
+            retry_call_adb(adb_cmd, ['install', '-r', '-d', apk_path], retry_count = 3)
+    with span('sync'):
+        retry_call_adb(adb_cmd, ['shell', 'sync'], retry_count = 3)
+    with span('logcat -c'):
+        retry_call_adb(adb_cmd, ['logcat', '-c'], retry_count = 3)
+    if follower is not None:
+        follower.start()
+    with span('sleep before start'):
+        time.sleep(5)
     activity_name = '{}/com.unity3d.player.UnityPlayerActivity'.format(
         app_name)
-    retry_call_program(adb_cmd + ['shell', 'am', 'start', '-n', activity_name], retry_count = 3)
+    with span('am start'):
+        retry_call_adb(adb_cmd, ['shell', 'am', 'start', '-n', activity_name], retry_count = 3)
+    if frames is not None:
+        frames.start()
+    if screenshots is not None:
+        screenshots.start()
     if measure_start is not False:
             print('Measuring startup time')
-            ret = measure_startup(adb_cmd, sleep_s)
+            with span('measure startup'):
+                ret = measure_startup(adb_cmd, sleep_s)
             time.sleep(5)
     return ret
-    #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '26'])
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '26'])
 
     
-def get_results(adb_cmd, sleep_s, retry_amount):
-    print('waiting the remainder')
-    time.sleep(sleep_s)
-    ret = get_results_from_logcat(adb_cmd)
+def get_results(adb_cmd, follower, sleep_s, retry_amount):
+    print('waiting for the result')
+    ret = wait_for_results(adb_cmd, follower, sleep_s)
     if ret is not None:
         return ret
     return None
     
-def send_to_Kibana(url, device_id, payload, headers, id):
-    kibana_send_url = url + '/_update/' + str(id)
-    try:
-        float(payload)
-        build_json = {
-            'script' : {
-            'source' : 'ctx._source.data.add(' + payload + ');'  
-            }
-        }
-    except ValueError:
-        build_json = {
-            'script' : {
-            'source' : 'ctx._source.error_log.add(\"' + payload + '\");'  
-            }
-        }
-        
-    if build_json:
-        print("Sending to Kibana with id(" + id + ") -> "  , build_json)
-        r = requests.post(kibana_send_url, data = json.dumps(build_json), headers = headers, timeout = 5)
-        #print (r.text)
-    
-def get_device_Snipeit(adb_cmd, device_id):
-    snipeItKey = ""
-    name, tag = 'Unknown' , 'Unknown'
-    with open('config.json') as json_file:
-        config_data = json.load(json_file)
-        snipeItKey = config_data['snipeItKey']
-    headers = {'Accept-Language':'en,en-US;q=0.9','Accept-Encoding':'gzip,deflate,br','accept':'application/json', 'content-type':'application/json' , 'Authorization': snipeItKey}
-    url = 'https://snipe-it.hq.unity3d.com/api/v1/hardware?search=' + device_id
-    try:
-        r = requests.get(url, headers = headers, timeout = 5)
-    except:
-        print('Failed to connect to Snipe-it')
-        name, tag = 'Unknown', 'Unknown'
-    else:
-        data = json.loads(r.text)
-        try:
-            name = data['rows'][0]['name']
-            tag = data['rows'][0]['asset_tag']
-        except:
-            return name,tag
-    return name,tag
-
-def output_parse(result, device_id, info, headers, start_time_kibana, kibana_url, test_template, apk_name, encoded_image):
+def parse_scene_results(result):
+    # "Scene name: A | Frame time: 16.5 ---- Scene name: B | ..." -> [(A, 16.5), (B, ...)]
+    if is_structured(result):
+        return parse_metric_scenes(result)
+    result = str(result)
     lines = result.split('----')
     lines = filter(None, lines)
-    scene_name = 'UNKNOWN'
+    scenes = []
     try:
         idx = result.index('Skipped')
-        print('Skipped sending to Kibana, because Error')
+        print('Skipped parsing scenes, because Error')
         return None
     except:
         if lines is None:
@@ -235,72 +169,38 @@ def output_parse(result, device_id, info, headers, start_time_kibana, kibana_url
             except:
                 print('Unable to parse separate entries by delimiter(:)')
                 return None
-            check_id = {
-                "query" : {
-                    "bool" : {
-                        "must":[
-                            {"match_phrase": {"scene_name" : scene_name}},
-                            {"match_phrase": {"date_of_test" : start_time_kibana}},
-                            {"match_phrase": {"apk_name" : apk_name}}
-                        ]
-                    }
-                }
-            }
-            headers = {"Content-Type" : "application/json"}
-            r = requests.get(kibana_url + '/_search', data = json.dumps(check_id), headers=headers, timeout = 5)
-            if (not r.ok):
-                print('Failed to check for existing data')
-                return None
-            json_r = json.loads(r.text)
-            if (len(json_r['hits']['hits']) == 0):
-                test = test_template
-                test['target_architecture'] = info[0] 
-                test['scripting_backend'] = info[1] 
-                test['build_Type'] = info[2]
-                test['unity_version'] = info[3] 
-                test['changeset'] = info[4] 
-                test['graphics_API'] = info[5] 
-                test['scene_name'] = scene_name
-                test['apk_name'] = apk_name
-                #test['image'] = encoded_image.decode("utf-8")
-                r = requests.post(kibana_url + '/_doc', data = json.dumps(test), headers = headers, timeout = 5)
-                json_r = json.loads(r.text)
-                id = json_r['_id']
-                if (r.ok):
-                    print('Created new test entry in kibana with id = ' + str(id))
-                    send_to_Kibana(kibana_url, device_id, data, headers, id)
-                else:
-                    print('Unable to create new test entry')
-                    return None
-                #Send Request and get ID
-            elif (len(json_r['hits']['hits']) == 1):
-                id = json_r['hits']['hits'][0]['_id']
-                send_to_Kibana(kibana_url, device_id, data, headers, id)
-                #Get ID of existing entry and add to it
-            else:
-                print('Too many entries match the query')
+            scenes.append((scene_name, data))
+    return scenes
+
+def output_parse(scenes, device_id, info, sink, test_template, apk_name, screenshots, records=None):
+    if records is not None:
+        # structured results, every metric keeps its own name and type
+        scenes = [(scene_name if scene_name is not None else 'UNKNOWN', (metric, value))
+                  for scene_name, metric, value in records]
+    if scenes is None:
+        print('Skipped sending to Kibana, because Error')
+        return None
+    for scene_name, data in scenes:
+        test = dict(test_template)
+        test['target_architecture'] = info[0] 
+        test['scripting_backend'] = info[1] 
+        test['build_Type'] = info[2]
+        test['unity_version'] = info[3] 
+        test['changeset'] = info[4] 
+        test['graphics_API'] = info[5] 
+        test['scene_name'] = scene_name
+        test['apk_name'] = apk_name
+        # references into results/screenshots, not the images themselves
+        test['screenshots'] = screenshots
+        if records is not None:
+            sink.add_metric_result(scene_name, apk_name, data[0], data[1], test)
+        else:
+            sink.add_scene_result(scene_name, apk_name, data, test)
 
-def get_picture(adb_cmd, device_id, device_name, start_time_file, time_to_sleep, output_dir, apk_name, cycle):
-    time.sleep(time_to_sleep)
-    picture_name =  str(apk_name) + '_Cycle-' + str(cycle) + '_' + str(device_name.replace(' ','_')) + '_' + str(device_id) + '_' + str(start_time_file) + '.png'
-    call_program(adb_cmd + ['shell', 'screencap', '/sdcard/' + picture_name])
-    picture_dir = os.path.join(output_dir, 'pictures')
-    if (os.path.isdir(picture_dir)) is False:
-        os.makedirs(picture_dir)
-    ret = call_program(adb_cmd + ['pull', '/sdcard/' + picture_name, picture_dir])
-    call_program(adb_cmd + ['shell', 'rm', '-f', '/sdcard/' + picture_name])
-    try:
-        with open(os.path.join(picture_dir, picture_name), "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-    except FileNotFoundError:
-        return 'Image unavailable'
-    #print(encoded_string)
-    return encoded_string
-                
 def main():
     parser = argparse.ArgumentParser(prog='adb_perf_runner')
     parser.add_argument(
-        'app_name', type=str,
+        'app_name', type=str, nargs='?', default=None,
         help="App name")
     parser.add_argument(
         'apks', type=str, nargs='*', default=None,
@@ -311,18 +211,75 @@ def main():
     parser.add_argument(
         '--run', type=int, default=1,
         help='Number of times to run app')
+    parser.add_argument(
+        '--adaptive', type=float, default=None,
+        help='Keep running each apk until the confidence interval of its result is narrower than this fraction of the mean (f.e. 0.02 for 2%%). --run becomes the minimum amount of runs')
+    parser.add_argument(
+        '--max-run', type=int, default=30,
+        help='Maximum amount of runs per apk in --adaptive mode')
+    parser.add_argument(
+        '--order', type=str, choices=ORDERS, default='interleaved',
+        help='interleaved runs every apk once per cycle, blocked runs all cycles of an apk before the next one (one install per apk), randomized-balanced shuffles the apks within every cycle so each apk is equally often first, second, ...')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for --order randomized-balanced, the same seed gives the same order')
+    parser.add_argument(
+        '--resume', type=str, default=None,
+        help='Session id printed at the start of an interrupted run. Run the same command with this added to run only the tests that did not finish')
     parser.add_argument(
         '--device', type=str, default=None,
         help='Device identifier (use `adb devices` to find that)')
+    parser.add_argument(
+        '--devices', type=str, default=None,
+        help='Run on several devices in parallel: "all" for every device in `adb devices` or a comma separated list of serials. Overrides --device')
     parser.add_argument(
         '--sleep', type=int, default=60*5,
-        help='Time to sleep before fetching results')
+        help='Maximum time to wait for the ZZRES>> result of a test, the test ends as soon as the result is logged')
     parser.add_argument(
         '--retry', type=int, default=2,
         help='Amount of times to retry before skipping a test. Test will be run (1 + retry) amount of times')
+    parser.add_argument(
+        '--max-temp', type=float, default=None,
+        help='Wait before every test until the battery temperature (in C) is at or below this')
+    parser.add_argument(
+        '--max-thermal-status', type=int, default=None,
+        help='Wait before every test until the thermal status from `dumpsys thermalservice` (0 none - 6 shutdown) is at or below this')
+    parser.add_argument(
+        '--min-battery', type=int, default=None,
+        help='Wait before every test until a charging device has at least this battery level')
+    parser.add_argument(
+        '--gate-timeout', type=int, default=30*60,
+        help='Start the test anyway after waiting this many seconds for the device')
     parser.add_argument(
         '--startup', action='store_true',
         help='Add this keyword to measure startup time. It will not collect the data, just measure time until data was output')
+    parser.add_argument(
+        '--frames', type=str, choices=FRAME_MODES, default=None,
+        help='Collect frame times from the host while the test runs: surfaceflinger (works for any Unity build) or gfxinfo (HWUI rendered views only)')
+    parser.add_argument(
+        '--screenshots', type=parse_points, default=None,
+        help='Take screenshots at these points of every test, seconds after the app started and/or "result" for when the result came in (f.e. 5,result). They are kept once per distinct frame in results/screenshots and the result only refers to them')
+    parser.add_argument(
+        '--screenshot-width', type=int, default=DEFAULT_WIDTH,
+        help='Shrink the screenshots to this width (needs Pillow, without it they are kept as full size png)')
+    parser.add_argument(
+        '--trace', action='store_true',
+        help='Record how long every phase of the runner takes, writes a Chrome trace (results/trace_{time}.json, open it in ui.perfetto.dev) and prints the time per phase at the end')
+    parser.add_argument(
+        '--adb', type=str, default=None,
+        help='Path of the adb executable to use instead of the one in the Android SDK (f.e. fake_adb.py)')
+    parser.add_argument(
+        '--results', type=str, default=None,
+        help='Directory to keep the results in instead of results next to this script')
+    parser.add_argument(
+        '--replay-spool', action='store_true',
+        help='Send the Kibana results that are still waiting in results/spool (f.e. because the server was down) and exit')
+    parser.add_argument(
+        '--spawn-adb', action='store_true',
+        help='Start a new adb process for every adb command instead of talking to the adb server directly')
+    parser.add_argument(
+        '--reinstall', action='store_true',
+        help='Always reinstall the apk before a test, even if the exact same apk is already installed on the device')
     parser.add_argument(
         '--kibana', type=str,
         help='Define the project name that will be the index for sending info to Kibana')
@@ -330,31 +287,27 @@ def main():
 
     sdk_root = 'C:/Android_stuff/SDK'
     adb_path = os.path.join(sdk_root, 'platform-tools/adb')
-    
-    adb_cmd = [adb_path]
-    device_name, device_tag = get_device_Snipeit(adb_cmd, args.device)
-    result_sets = []
+    if args.adb is not None:
+        adb_path = args.adb
     
     start_time_kibana = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
     start_time_file = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     
     dir_path = os.path.dirname(os.path.realpath(__file__))
     results_path = os.path.join(dir_path,'results')
+    if args.results is not None:
+        results_path = args.results
     if (os.path.isdir(results_path)) is False:
         os.makedirs(results_path)
-    if args.device is not None:
-        adb_cmd += ['-s', args.device]
-        device_id = args.device
-    else:
-        device_id = call_program(adb_cmd + ['shell','getprop','ro.boot.serialno']).strip()
-        device_id = device_id.decode('ascii')
-    output_dir = os.path.join(results_path, device_id)    
-    if (os.path.isdir(output_dir)) is False:
-        os.makedirs(output_dir)
-    results_in_folder = glob.glob(os.path.join(output_dir,'*.txt'))
-    result_file_name = str((len(results_in_folder) + 1)) + '_Test_run_' + str(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")) + '.txt'
-    result_file_path = os.path.join(output_dir, result_file_name)
-    write_to_file(result_file_path, 'BEGIN\n')
+    spool_dir = os.path.join(results_path, 'spool')
+    if args.replay_spool:
+        replay_spools(spool_dir)
+        return None
+    if args.app_name is None:
+        parser.error('the following arguments are required: app_name')
+    if args.trace:
+        get_tracer().enable()
+        trace_path = os.path.join(results_path, 'trace_' + start_time_file + '.json')
     if args.folder is not None:
         fullpath = os.path.join(args.folder, '*.apk')
         apks = glob.glob(fullpath)
@@ -369,88 +322,228 @@ def main():
         measure = True
     else:
         measure = False
-        
-    for i in range(len(apks)):
-            result_sets.append([])
-    call_program(adb_cmd + ['logcat', '-G', '10M'])
-    level1 =  call_program(adb_cmd + ['shell', 'dumpsys', 'battery', '|', 'grep', 'level']).strip()
+    set_client_enabled(not args.spawn_adb)
+    install_cache = None if args.reinstall else InstallCache()
+    if args.devices is not None:
+        devices = resolve_devices(adb_path, args.devices)
+        print('Running on devices:', ', '.join(devices))
+    else:
+        devices = [args.device]
+    # without -s adb picks the only device, its transport serial only names
+    # the results, adb commands still go without -s
+    label = default_serial(adb_path) if args.device is None and args.devices is None else None
     if (args.kibana is not None):
         kibana_url = "http://10.37.34.49:9200/" + args.kibana.lower()
-        r = requests.put(kibana_url, timeout=5)
-        if r.ok:
-            print('Index pattern created')
+        try:
+            r = requests.put(kibana_url, timeout=5)
+        except requests.exceptions.RequestException as e:
+            # the first bulk request creates the index once the server is back
+            print('Unable to reach Kibana, results will be spooled. REASON = ', e)
         else:
-            json_r = json.loads(r.text)
-            print('Unable to create index. REASON =  ',json_r['error']['type'])
+            if r.ok:
+                print('Index pattern created')
+            else:
+                json_r = json.loads(r.text)
+                print('Unable to create index. REASON =  ',json_r['error']['type'])
         print(kibana_url)        
-        headers = {"Content-Type" : "application/json"}
-        test_template = {
-            'device_serial' : args.device,
-            'device_name' : device_name,
-            'date_of_test' : start_time_kibana,
-            'apk_name' : 'UNKNOWN',
-            'scene_name' : 'UNKNOWN',
-            'target_architecture' : 'UNKNOWN',
-            'scripting_backend' : 'UNKNOWN',
-            'build_Type' : 'UNKNOWN',
-            'unity_version' : 'UNKNOWN',
-            'changeset' : 'UNKNOWN',
-            'graphics_API' : 'UNKNOWN',
-            'image' : 'Image unavailable',
-            'data' : [],
-            'error_log' : []
-            }
-    
-    for i in range(args.run):
-        print('Cycle ', i , '\n')
-        write_to_file(result_file_path, 'Cycle ' + str(i) + '\n')
-        for i_apk, apk in enumerate(apks):
-            tempBatLevel = call_program(adb_cmd + ['shell', 'dumpsys', 'battery', '|', 'grep', 'level']).strip()
-            print('Battery level before test # ' + str(i_apk) + ' is ' + str(tempBatLevel.decode('utf-8')) + '\n')
-            write_to_file(result_file_path, 'Battery level before test # ' + str(i_apk) + ' is ' + str(tempBatLevel.decode('utf-8')) + '\n')
+        sink = BulkSink(kibana_url, Spool(spool_path(spool_dir, 'scenes_' + start_time_file)))
+
+    store = None
+    if args.screenshots is not None:
+        store = ScreenshotStore(os.path.join(results_path, SCREENSHOT_DIR), args.screenshot_width)
+
+    # device names come from a cache, only new serials wait for Snipe-it
+    snipeit_key, snipeit_url = load_config()
+    snipeit = SnipeItCache(os.path.join(results_path, CACHE_NAME), snipeit_key, snipeit_url)
+    snipeit.prefetch(devices if label is None else [label])
+
+    def worker(device, task_queue):
+        adb_cmd = [adb_path]
+        if device is not None:
+            adb_cmd += ['-s', device]
+        # props, battery and display in one call, also tells the serial
+        profile = get_profile(adb_cmd, device)
+        device_id = device if device is not None else (label or profile.serial)
+        print(device_id, 'Device:', profile)
+        device_name, device_tag = snipeit.lookup(device_id)
+        print(device_id, 'is', device_name, device_tag)
+        output_dir = os.path.join(results_path, device_id)    
+        if (os.path.isdir(output_dir)) is False:
+            os.makedirs(output_dir, exist_ok=True)
+        results_in_folder = glob.glob(os.path.join(output_dir,'*.txt'))
+        result_file_name = str((len(results_in_folder) + 1)) + '_Test_run_' + str(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")) + '.txt'
+        result_file_path = os.path.join(output_dir, result_file_name)
+
+        result_sets = []
+        for i in range(len(apks)):
+                result_sets.append([])
+        call_adb(adb_cmd, ['logcat', '-G', '10M'])
+        battery_start = profile.state.level_line()
+        resumed = previous.get(device_id)
+        if resumed is not None:
+            # carry on with the run this device had started in the session
+            run_id = resumed['run_id']
+            result_file_path = resumed['result_file']
+            result_sets = resumed['result_sets']
+            battery_start = resumed['battery_start']
+            print(device_id, 'Resuming run', run_id, 'with', sum(len(r) for r in result_sets), 'finished tests')
+            if adaptive is not None:
+                # the device converges on what it had finished as well
+                for i_apk, result_set in enumerate(result_sets):
+                    for result in result_set:
+                        adaptive.add_completed(i_apk, result, device)
+        else:
+            run_id = db.start_run('APR_SCENEBASED', args.app_name, device_id, result_file_path, battery_start, session,
+                                  profile.to_json())
+        # kept by run_on_devices if the device fails halfway
+        task_queue.results = result_sets
+        frames = FrameCollector(adb_cmd, args.app_name, args.frames) if args.frames is not None else None
+        shots = TestScreenshots(adb_cmd, store, args.screenshots) if store is not None else None
+        if (args.kibana is not None):
+            test_template = {
+                'device_serial' : device_id,
+                'device_name' : device_name,
+                'device_profile' : profile.to_dict(),
+                'date_of_test' : start_time_kibana,
+                'apk_name' : 'UNKNOWN',
+                'scene_name' : 'UNKNOWN',
+                'target_architecture' : 'UNKNOWN',
+                'scripting_backend' : 'UNKNOWN',
+                'build_Type' : 'UNKNOWN',
+                'unity_version' : 'UNKNOWN',
+                'changeset' : 'UNKNOWN',
+                'graphics_API' : 'UNKNOWN',
+                'screenshots' : [],
+                'data' : [],
+                'error_log' : []
+                }
+
+        cycle = None
+        task = next_task(task_queue)
+        while task is not None:
+            i, i_apk = task
+            apk = apks[i_apk]
+            if i != cycle:
+                cycle = i
+                print(device_id, 'Cycle ', i , '\n')
+            with span('device gate'):
+                state = wait_for_device(adb_cmd, args.max_temp, args.max_thermal_status, args.min_battery, args.gate_timeout)
+            profile.state = state
+            print(device_id, 'Battery level before test # ' + str(i_apk) + ' is ' + state.level_line() + '\n')
+            print(device_id, 'Device state:', state)
             apk_name = os.path.basename(apk) 
-            print('Running APK:' + str(apk_name)) 
+            print(device_id, 'Running APK:' + str(apk_name)) 
             counter = args.retry + 1
             result = None
             info = None
             while (result is None and counter > 0):
-                result = run_single_app(adb_cmd, args.app_name, apk, measure, args.sleep)
-                info = find_attributes(adb_cmd, 5)
-                #encoded_image = get_picture(adb_cmd, device_id, device_name, start_time_file, 1, output_dir, apk_name, i)
-                encoded_image = ''
-                if (not measure):
-                    result = get_results(adb_cmd, args.sleep,  args.retry)
+                with span('attempt', attempt=args.retry + 2 - counter, cycle=i, apk=apk_name):
+                    follower = None if measure else LogcatFollower(adb_cmd)
+                    try:
+                        result = run_single_app(adb_cmd, args.app_name, apk, measure, args.sleep, follower, install_cache, frames, shots)
+                        with span('attributes'):
+                            info = find_attributes(adb_cmd, 5, follower)
+                        if (not measure):
+                            result = get_results(adb_cmd, follower, args.sleep,  args.retry)
+                    except AdbStreamError as e:
+                        # am start lost its connection, the next attempt
+                        # clears the app before it starts it again
+                        print(device_id, 'Lost the connection to the device during the attempt:', e)
+                        result = None
+                    finally:
+                        # am start may fail after the stream was opened, neither
+                        # it nor the collectors must outlive the attempt
+                        if follower is not None:
+                            follower.stop()
+                        if frames is not None:
+                            frames.stop()
+                        if shots is not None:
+                            shots.finish(result is not None)
                 counter -= 1
                 if (result is None):
-                    print('Did not get result, retrying',counter,'more times')
+                    print(device_id, 'Did not get result, retrying',counter,'more times')
             if result is None and counter == 0:
                 result = 'Test #' + str(i + 1) + ' Skipped after ' + str(args.retry + 1) + ' attempts'
+            scenes = parse_scene_results(result)
+            records = parse_records(result) if is_structured(result) else None
+            screenshots = shots.collect() if shots is not None else []
             if(args.kibana is not None):
-                output_parse(result, device_id, info, headers, start_time_kibana, kibana_url, test_template, apk_name, encoded_image)
-            print('Result set {0}: {1}'.format(i_apk, result))
-            write_to_file(result_file_path, 'Result set {0}: {1}'.format(i_apk, result) + '\n') 
+                test_template['device_state'] = state.to_dict()
+                output_parse(scenes, device_id, info, sink, test_template, apk_name, screenshots, records)
+            print(device_id, 'Result set {0}: {1}'.format(i_apk, result))
+            if shots is not None:
+                print(device_id, 'Screenshots {0}: {1}'.format(i_apk, ', '.join(
+                    shot['point'] + ' ' + shot['path'] for shot in screenshots)))
+            frame_summary = frames.summary() if frames is not None else None
+            if frames is not None:
+                print(device_id, 'Frames {0}: {1}'.format(i_apk, format_frame_summary(frame_summary)))
+            db.add_test(run_id, i, i_apk, apk, state.level_line(), result,
+                        scenes if records is None else None, info, state.to_json(),
+                        json.dumps(frame_summary) if frame_summary is not None else None,
+                        metrics=records, screenshots=json.dumps(screenshots) if shots is not None else None)
             result_sets[i_apk].append(result)
-    level2 = call_program(adb_cmd + ['shell', 'dumpsys', 'battery', '|', 'grep', 'level']).strip()
-    print(result_sets)
-    for set in result_sets:
-            for string in set:
-                write_to_file(result_file_path, str(string) + '\n')
-    print('--------------------------------')
-    write_payload = '--------------------------------' + '\n' + 'Battery on start ' + level1.decode('utf-8') + '\n' + 'Battery on finish ' + level2.decode('utf-8') + '\n'
-    write_to_file(result_file_path, write_payload)
-    print('Battery on start ' + level1.decode('utf-8'))
-    print('Battery on finish ' + level2.decode('utf-8'))
-    for i, result_set in enumerate(result_sets):
-        print('Result set {0}'.format(i))
-        write_to_file(result_file_path,'Result set {0}'.format(i) + '\n')	
-        print('APK Name:',os.path.basename(apks[i]))
-        write_to_file(result_file_path, 'APK Name:' + os.path.basename(apks[i]) + '\n')
-        write_payload = ""
-        for r in result_set:
-            print(r)
-            write_payload += str(r) + '\n'
-        write_to_file(result_file_path, write_payload)
+            if adaptive is not None:
+                adaptive.add_result(i_apk, result, device)
+            task = next_task(task_queue)
+        battery_end = profile.refresh(adb_cmd).level_line()
+        print(device_id, result_sets)
+        db.finish_run(run_id, battery_end)
+        apk_names = [os.path.basename(apk) for apk in apks]
+        db.write_report(run_id, result_file_path, apk_names)
+        summary = format_summary(apk_names, result_sets, parse_scene_results)
+        with open(result_file_path, 'a') as out_f:
+            out_f.write(summary)
+        print(device_id, 'Battery on start ' + battery_start)
+        print(device_id, 'Battery on finish ' + battery_end)
+        return result_sets
+
+    db = ResultsDB(results_path)
+    completed = set()
+    previous = {}
+    if args.resume is not None:
+        session = args.resume
+        try:
+            completed, previous = load_session(db, session, apks)
+        except ResumeError as e:
+            db.close()
+            parser.error(str(e))
+    else:
+        session = new_session_id()
+    print('Session', session, '(if the run gets interrupted, add --resume', session, 'to the same command to finish it)')
+    if args.adaptive is not None:
+        adaptive = AdaptiveTasks(len(apks), args.run, args.max_run, args.adaptive, parse_scene_results,
+                                 args.order, args.seed)
+        task_queue = adaptive
+        tasks = order_tasks(adaptive.max_runs, len(apks), args.order, args.seed)
+    else:
+        adaptive = None
+        tasks = remaining_tasks(order_tasks(args.run, len(apks), args.order, args.seed), completed)
+        task_queue = make_task_queue(tasks)
+    # in --adaptive mode every device runs all of its own cells side by side
+    print(format_estimate(estimate_run(tasks, apks, len(devices) if adaptive is None else 1, args.sleep,
+                                       args.reinstall, db.get_test_durations(args.app_name)), args.order))
+    device_results = run_on_devices(devices, task_queue, worker)
+    db.close()
+    snipeit.close()
+    if store is not None:
+        store.close()
+        print('Screenshots: {0} taken, {1} new in {2}'.format(store.captured, store.stored, store.root))
+    if (args.kibana is not None):
+        sink.close()
 
+    for device_id, result_sets in device_results.items():
+        print('--------------------------------')
+        print('Device', device_id if device_id is not None else label)
+        for i, result_set in enumerate(result_sets):
+            print('Result set {0}'.format(i))
+            print('APK Name:',os.path.basename(apks[i]))
+            for r in result_set:
+                print(r)
+        print(format_summary([os.path.basename(apk) for apk in apks], result_sets, parse_scene_results), end='')
+    if args.trace:
+        get_tracer().write(trace_path)
+        print(get_tracer().format_summary(), end='')
+        print('Trace written to', trace_path)
 
 if __name__ == '__main__':
     main()
@@ -5,11 +5,28 @@ import os
 import time
 import glob
 import datetime
-from utils.command import call_program
-from utils.command import retry_call_program
+from utils.adb_client import AdbStreamError
+from utils.adb_client import call_adb
+from utils.adb_client import retry_call_adb
+from utils.adb_client import set_client_enabled
+from utils.devices import resolve_devices, default_serial, remaining_tasks, make_task_queue, next_task, run_on_devices
+from utils.resume import new_session_id, load_session, ResumeError
+from utils.schedule import ORDERS, order_tasks, estimate_run, format_estimate
+from utils.adaptive import AdaptiveTasks
+from utils.logcat import LogcatFollower, LogcatParser, LogcatReader, LOGCAT_FILTERS
+from utils.install_cache import InstallCache
+from utils.thermal import wait_for_device
+from utils.profile import get_profile
+from utils.frames import FrameCollector, FRAME_MODES, format_frame_summary
+from utils.sampler import SystemSampler, format_system_summary
+from utils.trace import get_tracer, span
+from utils.results_db import ResultsDB
+from utils.stats import format_summary
+from utils.metrics import is_structured, parse_records, parse_result_scenes, parse_text_scenes, metric_label
+from utils.spool import Spool, SpoolSender, make_record, spool_path, replay_spools
 import traceback
 import json
-import requests
+import uuid
 import datetime
 
 def get_logcat(adb_cmd, filters=[]):
@@ -17,87 +34,130 @@ def get_logcat(adb_cmd, filters=[]):
         # ignore others
         filters = ['-s'] + filters
 
-    ret = call_program(adb_cmd + ['logcat', '-d'] + filters)
-    #call_program(adb_cmd + ['logcat', '-c'])
+    ret = call_adb(adb_cmd, ['logcat', '-d'] + filters)
+    #call_adb(adb_cmd, ['logcat', '-c'])
     return ret.decode('utf-8', errors='ignore')
 
 
 def get_results_from_logcat(adb_cmd):
-    filters = ['Unity', 'ActivityManager', 'PackageManager',
-               'dalvikvm', 'DEBUG']
-    out = get_logcat(adb_cmd, filters)
-    lines = out.splitlines()
-    results = []
-    ident = 'ZZRES>>'
-    for l in lines:
-        idx = l.find(ident)
-        if idx == -1:
-            continue
-        results.append(l[idx + len(ident):])
-    if len(results) == 0:
-        return None
-    return results[0]
+    parser = LogcatParser()
+    parser.feed_dump(get_logcat(adb_cmd, LOGCAT_FILTERS))
+    return parser.result()
 
 
+def wait_for_results(adb_cmd, follower, sleep_s):
+    start = time.time()
+    with span('wait for result'):
+        ret = follower.wait(sleep_s)
+        follower.stop()
+    if ret is None:
+        # stream may have dropped before the test reported, wait out the
+        # rest of the window and check the whole buffer once more
+        with span('wait out sleep'):
+            time.sleep(max(start + sleep_s - time.time(), 0))
+        with span('parse logcat'):
+            ret = get_results_from_logcat(adb_cmd)
+    return ret
+
 def measure_startup(adb_cmd, sleep):
     ret = None
     launchTime = None
     start = time.time()
     ticker = start
     end = start + sleep
+    # only fetches what was logged since the previous poll
+    reader = LogcatReader(adb_cmd)
     while ticker < end and ret is None:
         ticker = time.time()
-        ret = get_results_from_logcat(adb_cmd)
+        reader.poll()
+        ret = reader.parser.first_result()
     if ret is not None:
         launchTime = ticker - start
     time.sleep(max(start + sleep - ticker, 0))
     return launchTime
     
-def write_to_file(path,content):
-    try:
-        if (os.path.isfile(path)):
-            file = open(path,'a')
-        else:
-            file = open(path, 'w')
-        file.write(content)
-        file.close()
-    except EnvironmentError: 
-        print ('Error writing to file', EnvironmentError)
-    
-def run_single_app(adb_cmd, app_name, apk_path, sleep_s, retry_amount, measure_start = False):
+def run_single_app(adb_cmd, app_name, apk_path, sleep_s, retry_amount, measure_start = False, install_cache = None, frames = None, sampler = None):
     counter = retry_amount + 1
     while True and counter > 0:
-        #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '26']) #Unlock phone before test run
-        #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '82'])
-        #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '82'])
-        #retry_call_program(adb_cmd + ['uninstall', app_name], retry_count = 3,
-					 #check_returncode=False)  # check if app is installed at all
-        retry_call_program(adb_cmd + ['shell', 'pm', 'clear', app_name], retry_count = 3,
+        with span('attempt', attempt=retry_amount + 2 - counter, apk=os.path.basename(apk_path)):
+            try:
+                ret = run_attempt(adb_cmd, app_name, apk_path, sleep_s, measure_start, install_cache, frames, sampler)
+            except AdbStreamError as e:
+                # am start lost its connection, the next attempt clears the
+                # app before it starts it again
+                print('Lost the connection to the device during the attempt:', e)
+                ret = None
+        if ret is not None:
+            return ret
+        counter -= 1
+        print('Did not get result, retrying',counter,'more times')
+    ret = 'Skipped after ' + str(retry_amount + 1) + ' attempts'
+    return ret
+
+def run_attempt(adb_cmd, app_name, apk_path, sleep_s, measure_start, install_cache, frames, sampler):
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '26']) #Unlock phone before test run
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '82'])
+    #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '82'])
+    #retry_call_adb(adb_cmd, ['uninstall', app_name], retry_count = 3,
+				 #check_returncode=False)  # check if app is installed at all
+    with span('pm clear'):
+        retry_call_adb(adb_cmd, ['shell', 'pm', 'clear', app_name], retry_count = 3,
                      check_returncode=False)  # app might have never existed
+    with span('sleep after clear'):
         time.sleep(5)
-        retry_call_program(adb_cmd + ['install', '-r', '-d', apk_path], retry_count = 3)
-        retry_call_program(adb_cmd + ['shell', 'sync'], retry_count = 3)
-        retry_call_program(adb_cmd + ['logcat', '-c'], retry_count = 3)
-        time.sleep(5)
+    with span('install'):
+        if install_cache is not None:
+            install_cache.install(adb_cmd, app_name, apk_path)
+        else:
+            retry_call_adb(adb_cmd, ['install', '-r', '-d', apk_path], retry_count = 3)
+    with span('sync'):
+        retry_call_adb(adb_cmd, ['shell', 'sync'], retry_count = 3)
+    with span('logcat -c'):
+        retry_call_adb(adb_cmd, ['logcat', '-c'], retry_count = 3)
+    follower = None
+    if measure_start is False:
+        follower = LogcatFollower(adb_cmd).start()
+    try:
+        with span('sleep before start'):
+            time.sleep(5)
         activity_name = '{}/com.unity3d.player.UnityPlayerActivity'.format(
             app_name)
-        
-        retry_call_program(adb_cmd + ['shell', 'am', 'start', '-n', activity_name], retry_count = 3)
-        #call_program(adb_cmd + ['shell' , 'input', 'keyevent' , '26'])
+    
+        with span('am start'):
+            retry_call_adb(adb_cmd, ['shell', 'am', 'start', '-n', activity_name], retry_count = 3)
+        if frames is not None:
+            frames.start()
+        if sampler is not None:
+            sampler.start()
+        #call_adb(adb_cmd, ['shell' , 'input', 'keyevent' , '26'])
         if measure_start is not False:
-            ret = measure_startup(adb_cmd, sleep_s)
+            with span('measure startup'):
+                ret = measure_startup(adb_cmd, sleep_s)
         else: 
-            print('waiting the remainder')
-            time.sleep(sleep_s)
-            ret = get_results_from_logcat(adb_cmd)
-        if ret is not None:
-            return ret
-        counter -= 1
-        print('Did not get result, retrying',counter,'more times')
-    ret = 'Skipped after ' + str(retry_amount + 1) + ' attempts'
+            print('waiting for the result')
+            ret = wait_for_results(adb_cmd, follower, sleep_s)
+    finally:
+        # am start may fail after the stream was opened, neither it nor the
+        # collectors must outlive the attempt
+        if follower is not None:
+            follower.stop()
+        if frames is not None:
+            frames.stop()
+        if sampler is not None:
+            sampler.stop()
     return ret
     
-def send_to_Kibana(url, device_id, sleep, result, headers):
+def result_data(result, profile):
+    # structured results send every metric with its typed value
+    if is_structured(result):
+        data = dict((metric_label(scene, metric), value) for scene, metric, value in parse_records(result))
+    else:
+        data = {"frame_time" : str(result)}
+    if profile.state is not None:
+        data["device_state"] = profile.state.to_dict()
+    return data
+
+def send_to_Kibana(url, device_id, sleep, result, spool, profile):
     test_url = url + '/_update'
     print(test_url)
     #result_string = ""
@@ -122,30 +182,26 @@ def send_to_Kibana(url, device_id, sleep, result, headers):
           "result_new" : {
             "serial" : device_id,
             "sleep" : str(sleep),
+            "device" : profile.to_dict(),
             "data" : [
-                {
-                "frame_time" : str(result)
-              }
+                result_data(result, profile)
             ]
           },
           "result_existing" : {
             "serial" : device_id,
             "sleep" : str(sleep),
-            "data" : {
-                "frame_time" : str(result)
-            }
+            "data" : result_data(result, profile)
           }
         }
       }
 }
     print (string)
-    r = requests.post(test_url, data = json.dumps(string), headers = headers, timeout = 5)
-    print (r.text)
+    spool.append(make_record('POST', test_url, string))
     
 def main():
     parser = argparse.ArgumentParser(prog='adb_perf_runner')
     parser.add_argument(
-        'app_name', type=str,
+        'app_name', type=str, nargs='?', default=None,
         help="App name")
     parser.add_argument(
         'apks', type=str, nargs='*', default=None,
@@ -156,18 +212,72 @@ def main():
     parser.add_argument(
         '--run', type=int, default=1,
         help='Number of times to run app')
+    parser.add_argument(
+        '--adaptive', type=float, default=None,
+        help='Keep running each apk until the confidence interval of its result is narrower than this fraction of the mean (f.e. 0.02 for 2%%). --run becomes the minimum amount of runs')
+    parser.add_argument(
+        '--max-run', type=int, default=30,
+        help='Maximum amount of runs per apk in --adaptive mode')
+    parser.add_argument(
+        '--order', type=str, choices=ORDERS, default='interleaved',
+        help='interleaved runs every apk once per cycle, blocked runs all cycles of an apk before the next one (one install per apk), randomized-balanced shuffles the apks within every cycle so each apk is equally often first, second, ...')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for --order randomized-balanced, the same seed gives the same order')
+    parser.add_argument(
+        '--resume', type=str, default=None,
+        help='Session id printed at the start of an interrupted run. Run the same command with this added to run only the tests that did not finish')
     parser.add_argument(
         '--device', type=str, default=None,
         help='Device identifier (use `adb devices` to find that)')
+    parser.add_argument(
+        '--devices', type=str, default=None,
+        help='Run on several devices in parallel: "all" for every device in `adb devices` or a comma separated list of serials. Overrides --device')
     parser.add_argument(
         '--sleep', type=int, default=60*5,
-        help='Time to sleep before fetching results')
+        help='Maximum time to wait for the ZZRES>> result of a test, the test ends as soon as the result is logged')
     parser.add_argument(
         '--retry', type=int, default=3,
         help='Amount of times to retry before skipping a test. Test will be run (1 + retry) amount of times')
+    parser.add_argument(
+        '--max-temp', type=float, default=None,
+        help='Wait before every test until the battery temperature (in C) is at or below this')
+    parser.add_argument(
+        '--max-thermal-status', type=int, default=None,
+        help='Wait before every test until the thermal status from `dumpsys thermalservice` (0 none - 6 shutdown) is at or below this')
+    parser.add_argument(
+        '--min-battery', type=int, default=None,
+        help='Wait before every test until a charging device has at least this battery level')
+    parser.add_argument(
+        '--gate-timeout', type=int, default=30*60,
+        help='Start the test anyway after waiting this many seconds for the device')
     parser.add_argument(
         '--startup', action='store_true',
         help='Add this keyword to measure startup time. It will not collect the data, just measure time until data was output')
+    parser.add_argument(
+        '--frames', type=str, choices=FRAME_MODES, default=None,
+        help='Collect frame times from the host while the test runs: surfaceflinger (works for any Unity build) or gfxinfo (HWUI rendered views only)')
+    parser.add_argument(
+        '--sample-system', type=float, default=None,
+        help='Sample cpu load and frequencies, app memory and gpu load every this many seconds while the test runs')
+    parser.add_argument(
+        '--trace', action='store_true',
+        help='Record how long every phase of the runner takes, writes a Chrome trace (results/trace_{time}.json, open it in ui.perfetto.dev) and prints the time per phase at the end')
+    parser.add_argument(
+        '--adb', type=str, default=None,
+        help='Path of the adb executable to use instead of the one in the Android SDK (f.e. fake_adb.py)')
+    parser.add_argument(
+        '--results', type=str, default=None,
+        help='Directory to keep the results in instead of results next to this script')
+    parser.add_argument(
+        '--replay-spool', action='store_true',
+        help='Send the Kibana results that are still waiting in results/spool (f.e. because the server was down) and exit')
+    parser.add_argument(
+        '--spawn-adb', action='store_true',
+        help='Start a new adb process for every adb command instead of talking to the adb server directly')
+    parser.add_argument(
+        '--reinstall', action='store_true',
+        help='Always reinstall the apk before a test, even if the exact same apk is already installed on the device')
     parser.add_argument(
         '--kibana', action='store_true',
         help='Add this keyword to send data to local Kibana server (in development)')
@@ -175,12 +285,26 @@ def main():
 
     sdk_root = 'C:/Android_stuff/SDK'
     adb_path = os.path.join(sdk_root, 'platform-tools/adb')
+    if args.adb is not None:
+        adb_path = args.adb
 
-    adb_cmd = [adb_path]
-    result_sets = []
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    results_path = os.path.join(dir_path,'results')
+    if args.results is not None:
+        results_path = args.results
+    if (os.path.isdir(results_path)) is False:
+        os.makedirs(results_path)
+    spool_dir = os.path.join(results_path, 'spool')
+    if args.replay_spool:
+        replay_spools(spool_dir)
+        return
+    if args.app_name is None:
+        parser.error('the following arguments are required: app_name')
+    if args.trace:
+        get_tracer().enable()
+        trace_path = os.path.join(results_path, 'trace_' + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + '.json')
     if (args.kibana):
         kibana_url = "http://localhost:9200/performance/tests/"
-        headers = {"Content-Type" : "application/json"}
         start_time = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
         #print(start_time)
         test = {
@@ -188,30 +312,15 @@ def main():
         'test_finished_date' : start_time,
         'results' : []
         }
-        r = requests.post(kibana_url , data = json.dumps(test, default=str), headers=headers, timeout=5)
-        resp_json = r.json()
-        #print(resp_json)
-        test_id = resp_json["_id"]
+        # the id is picked here so results can be spooled before the server
+        # has seen the test document
+        test_id = uuid.uuid4().hex
         kibana_send_url = kibana_url + str(test_id)
+        spool = Spool(spool_path(spool_dir, 'tests_' + test_id))
+        spool.append(make_record('PUT', kibana_send_url, test))
+        sender = SpoolSender(spool)
         #print(kibana_send_url)
         
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    results_path = os.path.join(dir_path,'results')
-    if (os.path.isdir(results_path)) is False:
-        os.makedirs(results_path)
-    if args.device is not None:
-        adb_cmd += ['-s', args.device]
-        device_id = args.device
-    else:
-        device_id = call_program(adb_cmd + ['shell','getprop','ro.boot.serialno']).strip()
-        device_id = device_id.decode('ascii')
-    output_dir = os.path.join(results_path, device_id)    
-    if (os.path.isdir(output_dir)) is False:
-        os.makedirs(output_dir)
-    results_in_folder = glob.glob(os.path.join(output_dir,'*.txt'))
-    result_file_name = str((len(results_in_folder) + 1)) + '_Test_run_' + str(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")) + '.txt'
-    result_file_path = os.path.join(output_dir, result_file_name)
-    write_to_file(result_file_path, 'BEGIN\n')
     if args.folder is not None:
         fullpath = os.path.join(args.folder, '*.apk')
         apks = glob.glob(fullpath)
@@ -226,28 +335,133 @@ def main():
         measure = True
     else:
         measure = False
-        
-    for i in range(len(apks)):
-            result_sets.append([])
-    call_program(adb_cmd + ['logcat', '-G', '10M'])
-    level1 =  call_program(adb_cmd + ['shell', 'dumpsys', 'battery', '|', 'grep', 'level']).strip()
-    
-    
-    for i in range(args.run):
-        print('Cycle ', i , '\n')
-        write_to_file(result_file_path, 'Cycle ' + str(i) + '\n')
-        for i_apk, apk in enumerate(apks):
-            tempBatLevel = call_program(adb_cmd + ['shell', 'dumpsys', 'battery', '|', 'grep', 'level']).strip()
-            print('Battery level before test # ' + str(i_apk) + ' is ' + str(tempBatLevel.decode('utf-8')) + '\n')
-            write_to_file(result_file_path, 'Battery level before test # ' + str(i_apk) + ' is ' + str(tempBatLevel.decode('utf-8')) + '\n')
-            result = run_single_app(adb_cmd, args.app_name, apk, args.sleep, args.retry, measure)
+    set_client_enabled(not args.spawn_adb)
+    install_cache = None if args.reinstall else InstallCache()
+    if args.devices is not None:
+        devices = resolve_devices(adb_path, args.devices)
+        print('Running on devices:', ', '.join(devices))
+    else:
+        devices = [args.device]
+    # without -s adb picks the only device, its transport serial only names
+    # the results, adb commands still go without -s
+    label = default_serial(adb_path) if args.device is None and args.devices is None else None
+
+    def worker(device, task_queue):
+        adb_cmd = [adb_path]
+        if device is not None:
+            adb_cmd += ['-s', device]
+        # props, battery and display in one call, also tells the serial
+        profile = get_profile(adb_cmd, device)
+        device_id = device if device is not None else (label or profile.serial)
+        print(device_id, 'Device:', profile)
+        output_dir = os.path.join(results_path, device_id)
+        if (os.path.isdir(output_dir)) is False:
+            os.makedirs(output_dir, exist_ok=True)
+        results_in_folder = glob.glob(os.path.join(output_dir,'*.txt'))
+        result_file_name = str((len(results_in_folder) + 1)) + '_Test_run_' + str(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")) + '.txt'
+        result_file_path = os.path.join(output_dir, result_file_name)
+
+        result_sets = []
+        for i in range(len(apks)):
+                result_sets.append([])
+        call_adb(adb_cmd, ['logcat', '-G', '10M'])
+        battery_start = profile.state.level_line()
+        resumed = previous.get(device_id)
+        if resumed is not None:
+            # carry on with the run this device had started in the session
+            run_id = resumed['run_id']
+            result_file_path = resumed['result_file']
+            result_sets = resumed['result_sets']
+            battery_start = resumed['battery_start']
+            print(device_id, 'Resuming run', run_id, 'with', sum(len(r) for r in result_sets), 'finished tests')
+            if adaptive is not None:
+                # the device converges on what it had finished as well
+                for i_apk, result_set in enumerate(result_sets):
+                    for result in result_set:
+                        adaptive.add_completed(i_apk, result, device)
+        else:
+            run_id = db.start_run('adb_perf_runner', args.app_name, device_id, result_file_path, battery_start, session,
+                                  profile.to_json())
+        # kept by run_on_devices if the device fails halfway
+        task_queue.results = result_sets
+        frames = FrameCollector(adb_cmd, args.app_name, args.frames) if args.frames is not None else None
+        sampler = SystemSampler(adb_cmd, args.app_name, args.sample_system) if args.sample_system is not None else None
+
+        cycle = None
+        task = next_task(task_queue)
+        while task is not None:
+            i, i_apk = task
+            apk = apks[i_apk]
+            if i != cycle:
+                cycle = i
+                print(device_id, 'Cycle ', i , '\n')
+            with span('device gate'):
+                state = wait_for_device(adb_cmd, args.max_temp, args.max_thermal_status, args.min_battery, args.gate_timeout)
+            profile.state = state
+            print(device_id, 'Battery level before test # ' + str(i_apk) + ' is ' + state.level_line() + '\n')
+            print(device_id, 'Device state:', state)
+            with span('test', cycle=i, apk=os.path.basename(apk)):
+                result = run_single_app(adb_cmd, args.app_name, apk, args.sleep, args.retry, measure, install_cache, frames, sampler)
+            frame_summary = frames.summary() if frames is not None else None
+            system_summary = sampler.summary() if sampler is not None else None
             if(args.kibana):
-                send_to_Kibana(kibana_send_url, device_id, args.sleep, result, headers)
-            print('Result set {0}: {1}'.format(i_apk, result))
-            write_to_file(result_file_path, 'Result set {0}: {1}'.format(i_apk, result) + '\n') 
+                send_to_Kibana(kibana_send_url, device_id, args.sleep, result, spool, profile)
+                sender.notify()
+            print(device_id, 'Result set {0}: {1}'.format(i_apk, result))
+            if frames is not None:
+                print(device_id, 'Frames {0}: {1}'.format(i_apk, format_frame_summary(frame_summary)))
+            if sampler is not None:
+                print(device_id, 'System {0}: {1}'.format(i_apk, format_system_summary(system_summary)))
+            db.add_test(run_id, i, i_apk, apk, state.level_line(), result, parse_text_scenes(result),
+                        device_state=state.to_json(),
+                        frames=json.dumps(frame_summary) if frame_summary is not None else None,
+                        system=json.dumps(system_summary) if system_summary is not None else None,
+                        metrics=parse_records(result) if is_structured(result) else None)
             result_sets[i_apk].append(result)
-    level2 = call_program(adb_cmd + ['shell', 'dumpsys', 'battery', '|', 'grep', 'level']).strip()
-    print(result_sets)
+            if adaptive is not None:
+                adaptive.add_result(i_apk, result, device)
+            task = next_task(task_queue)
+        battery_end = profile.refresh(adb_cmd).level_line()
+        print(device_id, result_sets)
+        db.finish_run(run_id, battery_end)
+        apk_names = [os.path.basename(apk) for apk in apks]
+        db.write_report(run_id, result_file_path, apk_names)
+        summary = format_summary(apk_names, result_sets, parse_result_scenes)
+        with open(result_file_path, 'a') as out_f:
+            out_f.write(summary)
+        print('--------------------------------')
+        print(device_id, 'Battery on start ' + battery_start)
+        print(device_id, 'Battery on finish ' + battery_end)
+        return result_sets
+
+    db = ResultsDB(results_path)
+    completed = set()
+    previous = {}
+    if args.resume is not None:
+        session = args.resume
+        try:
+            completed, previous = load_session(db, session, apks)
+        except ResumeError as e:
+            db.close()
+            parser.error(str(e))
+    else:
+        session = new_session_id()
+    print('Session', session, '(if the run gets interrupted, add --resume', session, 'to the same command to finish it)')
+    if args.adaptive is not None:
+        adaptive = AdaptiveTasks(len(apks), args.run, args.max_run, args.adaptive, parse_result_scenes,
+                                 args.order, args.seed)
+        task_queue = adaptive
+        tasks = order_tasks(adaptive.max_runs, len(apks), args.order, args.seed)
+    else:
+        adaptive = None
+        tasks = remaining_tasks(order_tasks(args.run, len(apks), args.order, args.seed), completed)
+        task_queue = make_task_queue(tasks)
+    # in --adaptive mode every device runs all of its own cells side by side
+    print(format_estimate(estimate_run(tasks, apks, len(devices) if adaptive is None else 1, args.sleep,
+                                       args.reinstall, db.get_test_durations(args.app_name)), args.order))
+    device_results = run_on_devices(devices, task_queue, worker)
+    db.close()
+
     if(args.kibana):
         finish_time = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
         body = {
@@ -255,27 +469,22 @@ def main():
                 'test_finished_date' : finish_time
             }
         }
-        r = requests.post(kibana_send_url + '/_update', data = json.dumps(body), headers = headers, timeout = 5)
-    
-    for set in result_sets:
-            for string in set:
-                write_to_file(result_file_path, string + '\n')
-    print('--------------------------------')
-    write_payload = '--------------------------------' + '\n' + 'Battery on start ' + level1.decode('utf-8') + '\n' + 'Battery on finish ' + level2.decode('utf-8') + '\n'
-    write_to_file(result_file_path, write_payload)
-    print('Battery on start ' + level1.decode('utf-8'))
-    print('Battery on finish ' + level2.decode('utf-8'))
-    for i, result_set in enumerate(result_sets):
-        print('Result set {0}'.format(i))
-        write_to_file(result_file_path,'Result set {0}'.format(i) + '\n')	
-        print('APK Name:',os.path.basename(apks[i]))
-        write_to_file(result_file_path, 'APK Name:' + os.path.basename(apks[i]) + '\n')
-        write_payload = ""
-        for r in result_set:
-            print(r)
-            write_payload += r + '\n'
-        write_to_file(result_file_path, write_payload)
+        spool.append(make_record('POST', kibana_send_url + '/_update', body))
+        sender.close()
 
+    for device_id, result_sets in device_results.items():
+        print('--------------------------------')
+        print('Device', device_id if device_id is not None else label)
+        for i, result_set in enumerate(result_sets):
+            print('Result set {0}'.format(i))
+            print('APK Name:',os.path.basename(apks[i]))
+            for r in result_set:
+                print(r)
+        print(format_summary([os.path.basename(apk) for apk in apks], result_sets, parse_result_scenes), end='')
+    if args.trace:
+        get_tracer().write(trace_path)
+        print(get_tracer().format_summary(), end='')
+        print('Trace written to', trace_path)
 
 if __name__ == '__main__':
     main()
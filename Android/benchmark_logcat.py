@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# Measures how fast utils/logcat.py parses `logcat -d` dumps, on generated
+# logs of different sizes and amounts of engine chatter, and fails when it
+# got slower than the checked in logcat_bench_baseline.json:
+#   python benchmark_logcat.py --sizes 0.1,1,10
+#   python benchmark_logcat.py --no-baseline --output logcat_bench_baseline.json
+
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+import utils.logcat
+from utils.fake_device import format_logcat_line
+from utils.logcat import LogcatParser, LogcatReader, RESULT_IDENT, APP_STARTED_IDENT
+
+PACKAGE = 'com.perf.bench'
+PARSERS = ['dump', 'poll', 'stream']
+# how often LogcatReader fetches what was logged since its last poll
+POLL_STEPS = 10
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'logcat_bench_baseline.json')
+# share of each kind of line after the start up block
+NOISE = {
+    'quiet' : {'frame' : 1},
+    'chatty' : {'frame' : 6, 'script' : 3, 'activity' : 1},
+    'spam' : {'frame' : 3, 'script' : 2, 'activity' : 4, 'near_miss' : 1},
+}
+# metric -> True when higher is better, compared against --baseline.
+# lines/s depends on the machine and what else runs on it, `relative` is
+# the speed compared to REFERENCE on the same corpus, timed in between.
+COMPARED = {'relative' : True, 'peak_kb' : False}
+REFERENCE = re.compile(r'ZZRES>>')
+# small dumps parse in milliseconds, they are repeated for at least this
+# long so one unlucky run doesn't decide
+MIN_MEASURE_S = 0.5
+EXPECTED_ATTRIBUTES = ('ARM64', 'il2cpp', 'Release', '2020.3.1f1 ', '77a89f25062f', 'Vulkan', True)
+
+
+def start_up_lines(pid):
+    return [
+        ('I', 'ActivityManager', 'Start proc {0}:{1}/u0a123 for activity {1}/com.unity3d.player.UnityPlayerActivity'.format(pid, PACKAGE)),
+        ('I', 'Unity', 'SystemInfo CPU = ARM64 FP ASIMD AES, Cores = 8, Memory = 7680mb'),
+        ('I', 'Unity', "Built from '2020.3/staging' branch, Version '2020.3.1f1 (77a89f25062f)', "
+                       "Build type 'Release', Scripting Backend 'il2cpp', CPU 'arm64-v8a', Stripping 'Disabled'"),
+        ('I', 'Unity', 'Vulkan API version 1.1.128'),
+        ('I', 'Unity', 'Graphics API = Vulkan'),
+        ('I', 'Unity', APP_STARTED_IDENT),
+    ]
+
+
+def noise_line(kind, rng, i):
+    if kind == 'frame':
+        return ('D', 'Unity', 'Frame {0} gfx jobs done, batches {1}, tris {2}'.format(
+            i, rng.randint(300, 500), rng.randint(100000, 300000)))
+    if kind == 'script':
+        # Debug.Log from game code comes with its managed stack
+        return ('I', 'Unity', 'Spawned wave {0} with {1} enemies at ({2:.2f}, {3:.2f}, {4:.2f}) '
+                'UnityEngine.Debug:Log(Object) WaveSpawner:Spawn(Int32) '
+                '(at Assets/Scripts/WaveSpawner.cs:{5}) UnityEngine.MonoBehaviour:Update()'.format(
+                    i, rng.randint(1, 40), rng.uniform(-50, 50), rng.uniform(0, 10),
+                    rng.uniform(-50, 50), rng.randint(10, 400)))
+    if kind == 'activity':
+        return ('W', 'ActivityManager', 'Slow operation: {0}ms so far, now at startProcess: done updating pids map '
+                'callerApp=ProcessRecord{{{1:x} {2}:com.android.systemui/u0a{3}}}'.format(
+                    rng.randint(50, 900), rng.getrandbits(28), rng.randint(1000, 9000), rng.randint(10, 99)))
+    # mentions what the parser looks for without being a match
+    return ('I', 'Unity', 'Thermal: CPU usage {0}% on big cores, Graphics API busy {1}%, Build typed in {2}ms'.format(
+        rng.randint(0, 100), rng.randint(0, 100), rng.randint(1, 20)))
+
+
+def result_payload(rng, scenes):
+    if scenes == 0:
+        return '{0:.3f}'.format(rng.gauss(16.6, 0.3))
+    return ' ---- '.join('Scene name: Test_{0:02d} | Frame time: {1:.3f}ms'.format(
+        i + 1, rng.gauss(16.6 + i, 0.3)) for i in range(scenes))
+
+
+def make_corpus(size_mb, noise, results=3, scenes=0, seed=0, epoch=False):
+    # -> text of a `logcat -d -v threadtime` (or `-v epoch`) dump of about
+    # size_mb with the start up block first and `results` ZZRES>> lines
+    # spread over it
+    rng = random.Random(seed)
+    pid = 12345
+    stamp = 1.7e9
+    kinds = []
+    for kind, weight in sorted(NOISE[noise].items()):
+        kinds += [kind] * weight
+    lines = [format_logcat_line(stamp, pid, priority, tag, message, epoch)
+             for priority, tag, message in start_up_lines(pid)]
+    target = int(size_mb * 1e6)
+    size = sum(len(line) for line in lines)
+    marks = [target * (i + 1) // (results + 1) for i in range(results)]
+    i = 0
+    while size < target:
+        stamp += 0.004
+        if len(marks) > 0 and size >= marks[0]:
+            marks.pop(0)
+            entry = ('I', 'Unity', RESULT_IDENT + result_payload(rng, scenes))
+        else:
+            entry = noise_line(rng.choice(kinds), rng, i)
+        line = format_logcat_line(stamp, pid, *entry, epoch=epoch)
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return ''.join(lines)
+
+
+def poll_chunks(corpus):
+    # what `logcat -d -v epoch -t <time>` answers to each poll of a
+    # LogcatReader: everything from the time of the last line it got, that
+    # line included. The first poll comes right after the start up block.
+    lines = corpus.splitlines(True)
+    ends = [len(start_up_lines(0))] + [len(lines) * step // POLL_STEPS for step in range(1, POLL_STEPS + 1)]
+    chunks = []
+    start = 0
+    for end in ends:
+        chunks.append(''.join(lines[start:end]).encode('utf-8'))
+        since = lines[end - 1].split(None, 1)[0]
+        start = end - 1
+        while start > 0 and lines[start - 1].split(None, 1)[0] == since:
+            start -= 1
+    return chunks
+
+
+def run_dump(corpus, chunks):
+    parser = LogcatParser()
+    parser.feed_dump(corpus)
+    return parser
+
+
+def run_poll(corpus, chunks):
+    # the incremental path of LogcatReader, adb answers with the chunks
+    replies = iter(chunks)
+    call_adb = utils.logcat.call_adb
+    utils.logcat.call_adb = lambda adb_cmd, args: next(replies)
+    try:
+        reader = LogcatReader(['adb'], filters=[], sdk=30)
+        for _ in chunks:
+            reader.poll()
+    finally:
+        utils.logcat.call_adb = call_adb
+    if not reader.incremental:
+        raise RuntimeError('LogcatReader fell back to full dumps')
+    return reader.parser
+
+
+def run_stream(corpus, chunks):
+    # what LogcatFollower does with every line it reads
+    parser = LogcatParser()
+    for line in corpus.splitlines():
+        parser.feed_line(line)
+    return parser
+
+
+RUNS = {'dump' : run_dump, 'poll' : run_poll, 'stream' : run_stream}
+
+
+def check_parser(parser, results, parser_name):
+    # a fast parser that misses results is no good
+    if len(parser.results) != results or parser.attributes() != EXPECTED_ATTRIBUTES:
+        raise RuntimeError('{0} parsed {1} results and {2}, expected {3} and {4}'.format(
+            parser_name, len(parser.results), parser.attributes(), results, EXPECTED_ATTRIBUTES))
+
+
+def run_reference(corpus, chunks):
+    # the least any parser does: split the lines and search each once
+    for line in corpus.splitlines():
+        REFERENCE.search(line)
+
+
+def time_run(run, corpus, chunks):
+    # like timeit, a collection in the middle would land on a random run
+    gc.collect()
+    gc.disable()
+    start = time.perf_counter()
+    try:
+        parser = run(corpus, chunks)
+    finally:
+        elapsed = time.perf_counter() - start
+        gc.enable()
+    return parser, elapsed
+
+
+def measure(parser_name, corpus, results, repeat):
+    # -> (fastest run, median speed relative to the reference run timed
+    # right before it, peak memory)
+    run = RUNS[parser_name]
+    chunks = poll_chunks(corpus) if parser_name == 'poll' else None
+    best = None
+    ratios = []
+    spent = 0.0
+    while len(ratios) < repeat or spent < MIN_MEASURE_S:
+        _, reference = time_run(run_reference, corpus, chunks)
+        parser, elapsed = time_run(run, corpus, chunks)
+        best = elapsed if best is None else min(best, elapsed)
+        ratios.append(reference / elapsed)
+        spent += elapsed
+    check_parser(parser, results, parser_name)
+    # separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    run(corpus, chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, statistics.median(ratios), peak
+
+
+def run_benchmark(size_mb, noise, parser_name, results, scenes, repeat, seed):
+    # LogcatReader asks for `-v epoch`, the others parse the default format
+    corpus = make_corpus(size_mb, noise, results, scenes, seed, epoch=parser_name == 'poll')
+    lines = corpus.count('\n')
+    elapsed, relative, peak = measure(parser_name, corpus, results, repeat)
+    return {
+        'size_mb' : size_mb,
+        'noise' : noise,
+        'parser' : parser_name,
+        'lines' : lines,
+        'seconds' : round(elapsed, 4),
+        'lines_per_s' : int(lines / elapsed),
+        'mb_per_s' : round(len(corpus) / 1e6 / elapsed, 1),
+        'relative' : round(relative, 3),
+        'peak_kb' : int(peak / 1024),
+    }
+
+
+def format_results(results):
+    row = '{0:>7} {1:<7} {2:<7} {3:>8} {4:>9} {5:>12} {6:>7} {7:>9} {8:>9}'
+    lines = [row.format('size MB', 'noise', 'parser', 'lines', 'seconds', 'lines/s', 'MB/s', 'relative', 'peak KB')]
+    for result in results:
+        lines.append(row.format(
+            result['size_mb'], result['noise'], result['parser'], result['lines'],
+            result['seconds'], result['lines_per_s'], result['mb_per_s'], result['relative'],
+            result['peak_kb']))
+    return '\n'.join(lines)
+
+
+def compare_baseline(results, baseline, tolerance):
+    # -> list of regressions, a metric regressed when it got more than
+    # `tolerance` worse than in the baseline
+    regressions = []
+    previous = dict(((r['size_mb'], r['noise'], r['parser']), r) for r in baseline)
+    for result in results:
+        old = previous.get((result['size_mb'], result['noise'], result['parser']))
+        if old is None:
+            continue
+        for metric, higher_is_better in sorted(COMPARED.items()):
+            if metric not in old:
+                # written by an older version of this script
+                continue
+            if higher_is_better:
+                regressed = result[metric] < old[metric] * (1 - tolerance)
+            else:
+                regressed = result[metric] > old[metric] * (1 + tolerance)
+            if regressed:
+                regressions.append('{0} on {1}MB {2}: {3} {4} -> {5}'.format(
+                    result['parser'], result['size_mb'], result['noise'], metric,
+                    old[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark_logcat')
+    parser.add_argument('--sizes', type=str, default='0.1,1,10',
+                        help='Comma separated sizes of the generated logcat dumps in MB')
+    parser.add_argument('--noise', type=str, default=','.join(sorted(NOISE)),
+                        help='Comma separated noise levels: ' + ', '.join(sorted(NOISE)))
+    parser.add_argument('--parsers', type=str, default=','.join(PARSERS),
+                        help='Comma separated parsers: dump (one logcat -d), poll (LogcatReader '
+                             'fetching only the new lines, ' + str(POLL_STEPS) + ' polls), '
+                             'stream (line by line like the follower)')
+    parser.add_argument('--results', type=int, default=3, help='ZZRES>> lines in every dump')
+    parser.add_argument('--scenes', type=int, default=10,
+                        help='Scene results per ZZRES>> line, 0 logs a single value')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (at least ' + str(MIN_MEASURE_S) + 's of them), the fastest counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this json file')
+    parser.add_argument('--baseline', type=str, default=BASELINE,
+                        help='Json written by --output earlier, exits with 1 if this run is slower '
+                             '(default: the checked in logcat_bench_baseline.json)')
+    parser.add_argument('--no-baseline', action='store_true', help='Only measure, compare against nothing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much worse than the baseline still passes, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    # read first, --output may replace it
+    baseline = None
+    if not args.no_baseline:
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        else:
+            print('No baseline at', args.baseline, 'write one with --output', args.baseline)
+
+    results = []
+    for size_mb in [float(size) for size in args.sizes.split(',')]:
+        for noise in args.noise.split(','):
+            for parser_name in args.parsers.split(','):
+                results.append(run_benchmark(size_mb, noise, parser_name, args.results,
+                                             args.scenes, args.repeat, args.seed))
+    print(format_results(results))
+    if args.output is not None:
+        with open(args.output, 'w') as out_f:
+            json.dump(results, out_f, indent=2)
+    if baseline is not None:
+        regressions = compare_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No regressions against', args.baseline)
+
+if __name__ == '__main__':
+    main()
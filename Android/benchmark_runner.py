@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# Measures what the runners themselves cost per test, against simulated
+# devices (utils/fake_adb_server.py) so no phone is needed:
+#   python benchmark_runner.py --devices 1,2,4 --output bench.json
+#   python benchmark_runner.py --devices 1,2,4 --baseline bench.json
+
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from utils.fake_adb_server import FakeAdbServer, fake_serials
+from utils.fake_device import FakeConfig
+from utils.fake_snipeit_server import FakeSnipeItServer, fake_records
+
+PACKAGE = 'com.perf.bench'
+SCRIPTS = ['adb_perf_runner.py', 'APR_SCENEBASED.py']
+# waits the runners do on purpose and the simulated install, they are not overhead
+DEVICE_SPANS = ('sleep after clear', 'sleep before start', 'adb install')
+# metrics where lower is better, compared against --baseline
+COMPARED = ['overhead_per_test_s', 'cpu_per_test_s']
+
+
+def make_apks(directory, count, size_mb):
+    apks = []
+    for i in range(count):
+        path = os.path.join(directory, 'bench_{0}.apk'.format(i))
+        with open(path, 'wb') as apk_file:
+            apk_file.write(b'package=' + PACKAGE.encode('ascii') + b'\n')
+            apk_file.write(os.urandom(int(size_mb * 1e6)))
+        apks.append(path)
+    return apks
+
+
+def child_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def attempt_overheads(trace, run_time):
+    # time of every attempt minus the deliberate sleeps, the install and the
+    # time the fake app took to log its result
+    events = [event for event in trace['traceEvents'] if event.get('ph') == 'X']
+    overheads = []
+    for attempt in events:
+        if attempt['name'] != 'attempt':
+            continue
+        end = attempt['ts'] + attempt['dur']
+        slept = sum(event['dur'] for event in events
+                    if event['name'] in DEVICE_SPANS and event['tid'] == attempt['tid'] and
+                    attempt['ts'] <= event['ts'] < end)
+        overheads.append((attempt['dur'] - slept) / 1e6 - run_time)
+    return overheads
+
+
+def count_spans(trace, category, name=None):
+    return sum(1 for event in trace['traceEvents']
+               if event.get('cat') == category and (name is None or event['name'] == name))
+
+
+def run_benchmark(script, device_count, apks, runs, run_time, chatter, work_dir, spawn_adb):
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    # the scene based runner expects scene results
+    scenes = 2 if script == 'APR_SCENEBASED.py' else 0
+    config = FakeConfig(run_time=run_time, chatter=chatter, scenes=scenes)
+    server = FakeAdbServer(fake_serials(device_count), config).start()
+    results = os.path.join(work_dir, '{0}_{1}'.format(os.path.splitext(script)[0], device_count))
+    args = [sys.executable, os.path.join(dir_path, script), PACKAGE] + apks + [
+        '--run', str(runs), '--devices', ','.join(server.devices),
+        '--adb', os.path.join(dir_path, 'fake_adb.py'), '--results', results,
+        '--sleep', str(int(config.run_time * 10 + 30)), '--trace']
+    if spawn_adb:
+        args.append('--spawn-adb')
+    env = dict(os.environ, ANDROID_ADB_SERVER_PORT=str(server.port))
+    cpu = child_cpu()
+    start = time.time()
+    process = subprocess.run(args, env=env, cwd=work_dir, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+    wall = time.time() - start
+    cpu = child_cpu() - cpu
+    server.shutdown()
+    server.server_close()
+    traces = glob.glob(os.path.join(results, 'trace_*.json'))
+    if process.returncode != 0 or len(traces) == 0:
+        print(process.stdout.decode('utf-8', errors='ignore')[-2000:])
+        raise RuntimeError(script + ' failed with exit code ' + str(process.returncode))
+    with open(traces[0]) as trace_file:
+        trace = json.load(trace_file)
+    tests = runs * len(apks)
+    overheads = attempt_overheads(trace, config.run_time)
+    return {
+        'script' : script,
+        'devices' : device_count,
+        'tests' : tests,
+        'attempts' : len(overheads),
+        'wall_s' : round(wall, 2),
+        'tests_per_min' : round(tests / wall * 60, 2),
+        'overhead_per_test_s' : round(sum(overheads) / tests, 3),
+        'cpu_per_test_s' : round(cpu / tests, 3),
+        'adb_calls_per_test' : round(count_spans(trace, 'adb') / tests, 1),
+        'installs' : count_spans(trace, 'adb', 'adb install'),
+    }
+
+
+def format_results(results):
+    row = '{0:<20} {1:>7} {2:>6} {3:>8} {4:>9} {5:>8} {6:>11} {7:>6} {8:>10} {9:>9}'
+    lines = [row.format('script', 'devices', 'tests', 'wall s', 'tests/min', 'scaling',
+                        'overhead s', 'cpu s', 'adb calls', 'installs')]
+    single = {}
+    for result in results:
+        if result['devices'] == 1:
+            single[result['script']] = result['tests_per_min']
+    for result in results:
+        # throughput compared to N devices each as fast as a single one
+        scaling = '-'
+        if result['script'] in single:
+            scaling = '{0:.0%}'.format(result['tests_per_min'] / (single[result['script']] * result['devices']))
+        lines.append(row.format(
+            result['script'], result['devices'], result['tests'], result['wall_s'],
+            result['tests_per_min'], scaling, result['overhead_per_test_s'],
+            result['cpu_per_test_s'], result['adb_calls_per_test'], result['installs']))
+    return '\n'.join(lines)
+
+
+def compare_baseline(results, baseline, tolerance):
+    # -> list of regressions, a metric regressed when it got more than
+    # `tolerance` worse and by more than 50ms
+    regressions = []
+    previous = dict(((r['script'], r['devices']), r) for r in baseline)
+    for result in results:
+        old = previous.get((result['script'], result['devices']))
+        if old is None:
+            continue
+        for metric in COMPARED:
+            if result[metric] > old[metric] * (1 + tolerance) and result[metric] - old[metric] > 0.05:
+                regressions.append('{0} on {1} devices: {2} {3} -> {4}'.format(
+                    result['script'], result['devices'], metric, old[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark_runner')
+    parser.add_argument('--scripts', type=str, default=','.join(SCRIPTS),
+                        help='Comma separated runner scripts to measure')
+    parser.add_argument('--devices', type=str, default='1,2,4',
+                        help='Comma separated amounts of simulated devices')
+    parser.add_argument('--apks', type=int, default=2, help='Amount of fake apks')
+    parser.add_argument('--apk-size', type=float, default=20.0, help='Size of every fake apk in MB')
+    parser.add_argument('--run', type=int, default=2, help='Cycles per run')
+    parser.add_argument('--run-time', type=float, default=1.0,
+                        help='Seconds the fake app takes until it logs its result')
+    parser.add_argument('--chatter', type=int, default=200,
+                        help='Engine log lines per second of the fake app')
+    parser.add_argument('--spawn-adb', action='store_true',
+                        help='Run the scripts with --spawn-adb')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this json file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Json written by --output earlier, exits with 1 if this run is slower')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='How much worse than the baseline still passes, 0.2 is 20%%')
+    args = parser.parse_args()
+
+    results = []
+    device_counts = [int(count) for count in args.devices.split(',')]
+    snipeit = FakeSnipeItServer(fake_records(fake_serials(max(device_counts)))).start()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # APR_SCENEBASED reads the Snipe-IT key from the working directory
+        with open(os.path.join(work_dir, 'config.json'), 'w') as config_file:
+            json.dump({'snipeItKey' : 'Bearer benchmark', 'snipeItUrl' : snipeit.url}, config_file)
+        apks = make_apks(work_dir, args.apks, args.apk_size)
+        for script in args.scripts.split(','):
+            for device_count in device_counts:
+                print('Running', script, 'on', device_count, 'simulated devices')
+                results.append(run_benchmark(script, device_count, apks, args.run, args.run_time,
+                                             args.chatter, work_dir, args.spawn_adb))
+    snipeit.shutdown()
+    print(format_results(results))
+    if args.output is not None:
+        with open(args.output, 'w') as out_f:
+            json.dump(results, out_f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_baseline(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No regressions against', args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+# lets the tests import the scripts' helpers as `utils.x`, like the scripts do
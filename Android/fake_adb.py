@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Stand-in for the adb executable, talks to the fake adb server the same way
+# adb talks to the real one:
+#   python fake_adb.py server --devices 4 --port 5038
+#   ANDROID_ADB_SERVER_PORT=5038 python adb_perf_runner.py ... --adb ./fake_adb.py
+
+import argparse
+import os
+import sys
+from utils.adb_client import AdbClient, AdbError, ID_STDOUT, ID_STDERR, ID_EXIT
+from utils.fake_adb_server import FakeAdbServer, INSTALL_SERVICE, fake_serials
+from utils.fake_device import FakeConfig, RESULT_FORMATS
+
+
+def split_options(argv):
+    # adb [-s serial] [-P port] command ...
+    serial = os.environ.get('ANDROID_SERIAL')
+    port = None
+    while len(argv) > 1 and argv[0] in ('-s', '-P'):
+        if argv[0] == '-s':
+            serial = argv[1]
+        else:
+            port = int(argv[1])
+        argv = argv[2:]
+    return serial, port, argv
+
+
+def run_shell(client, serial, command):
+    code = 0
+    for packet_id, data in client.shell_packets(serial, command):
+        if packet_id == ID_STDOUT:
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        elif packet_id == ID_STDERR:
+            sys.stderr.buffer.write(data)
+        elif packet_id == ID_EXIT:
+            code = data[0]
+    return code
+
+
+def run_server(argv):
+    parser = argparse.ArgumentParser(prog='fake_adb.py server')
+    parser.add_argument('--devices', type=int, default=1, help='Amount of simulated devices')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037)))
+    parser.add_argument('--run-time', type=float, default=2.0,
+                        help='Seconds from app start until ZZRES>> is logged')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='Share of app starts that never log a result')
+    parser.add_argument('--scenes', type=int, default=0,
+                        help='Log this many scene results instead of a single value')
+    parser.add_argument('--chatter', type=int, default=200,
+                        help='Engine log lines per second while the app runs')
+    parser.add_argument('--result-format', type=str, choices=RESULT_FORMATS, default='text',
+                        help='Log structured json or key=value results with several metrics per scene')
+    parser.add_argument('--sdk', type=int, default=30,
+                        help='Android sdk level the devices report, below 24 logcat acts like on Android 6')
+    parser.add_argument('--install-mb-per-s', type=float, default=40.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    config = FakeConfig(run_time=args.run_time, fail_rate=args.fail_rate, scenes=args.scenes,
+                        chatter=args.chatter, install_mb_per_s=args.install_mb_per_s, seed=args.seed,
+                        result_format=args.result_format, sdk=args.sdk)
+    server = FakeAdbServer(fake_serials(args.devices), config, args.port)
+    print('Fake adb server on port', server.port, 'with', ', '.join(server.devices))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv):
+    serial, port, argv = split_options(argv)
+    if len(argv) == 0:
+        print('Usage: fake_adb.py [-s serial] [-P port] devices|shell|logcat|install|uninstall|exec-out|pull|server ...')
+        return 1
+    command, args = argv[0], argv[1:]
+    if command == 'server':
+        return run_server(args)
+    if command in ('start-server', 'kill-server', 'wait-for-device'):
+        return 0
+    client = AdbClient(port=port)
+    try:
+        if command == 'devices':
+            print('List of devices attached')
+            print(client.host_command('host:devices').decode('utf-8'))
+            return 0
+        if command == 'shell':
+            return run_shell(client, serial, ' '.join(args))
+        if command == 'logcat':
+            return run_shell(client, serial, ' '.join(['logcat'] + args))
+        if command == 'exec-out':
+            sys.stdout.buffer.write(client.exec_out(serial, ' '.join(args)))
+            return 0
+        if command == 'install':
+            apk = os.path.abspath(args[-1])
+            out = client.read_service(serial, INSTALL_SERVICE + apk).decode('utf-8')
+            print(out, end='')
+            return 0 if 'Success' in out else 1
+        if command == 'uninstall':
+            return run_shell(client, serial, 'pm uninstall ' + args[-1])
+        if command == 'pull':
+            out, _, code = client.shell(serial, 'cat ' + args[0])
+            target = args[1] if len(args) > 1 else '.'
+            if os.path.isdir(target):
+                target = os.path.join(target, os.path.basename(args[0]))
+            with open(target, 'wb') as out_f:
+                out_f.write(out)
+            return code
+    except (OSError, AdbError) as e:
+        print('adb: error:', e, file=sys.stderr)
+        return 1
+    print('adb: unknown command', command, file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
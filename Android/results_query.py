@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from utils.results_db import ResultsDB, DB_NAME
+
+
+def print_rows(rows):
+    if len(rows) == 0:
+        print('No results')
+        return
+    print('\t'.join(rows[0].keys()))
+    for row in rows:
+        print('\t'.join(str(value) for value in row))
+
+
+def list_runs(db, args):
+    sql = 'SELECT * FROM runs'
+    where = []
+    params = []
+    if args.device is not None:
+        where.append('device_id = ?')
+        params.append(args.device)
+    if args.session is not None:
+        where.append('session = ?')
+        params.append(args.session)
+    if len(where) > 0:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY id'
+    print_rows(db.query(sql, params))
+
+
+def list_results(db, args):
+    sql = ('SELECT runs.id AS run, runs.device_id AS device, cycles.cycle, apks.name AS apk, '
+           'scenes.name AS scene, results.metric, results.raw, results.value, attributes.changeset, '
+           'attributes.graphics_api '
+           'FROM results JOIN cycles ON cycles.id = results.cycle_id '
+           'JOIN runs ON runs.id = cycles.run_id '
+           'JOIN apks ON apks.id = cycles.apk_id '
+           'LEFT JOIN scenes ON scenes.id = results.scene_id '
+           'LEFT JOIN attributes ON attributes.cycle_id = cycles.id')
+    where = []
+    params = []
+    if args.run is not None:
+        where.append('runs.id = ?')
+        params.append(args.run)
+    if args.device is not None:
+        where.append('runs.device_id = ?')
+        params.append(args.device)
+    if args.apk is not None:
+        where.append('apks.name = ?')
+        params.append(args.apk)
+    if args.scene is not None:
+        where.append('scenes.name = ?')
+        params.append(args.scene)
+    if args.metric is not None:
+        where.append('results.metric = ?')
+        params.append(args.metric)
+    if args.scene is None and args.metric is None and not args.all:
+        # scene based and structured results also store the whole ZZRES
+        # line, only show it when nothing was parsed from it
+        where.append('(results.scene_id IS NOT NULL OR results.metric IS NOT NULL OR NOT EXISTS (SELECT 1 FROM results AS r '
+                     'WHERE r.cycle_id = results.cycle_id AND (r.scene_id IS NOT NULL OR r.metric IS NOT NULL)))')
+    if args.changeset is not None:
+        where.append('attributes.changeset = ?')
+        params.append(args.changeset)
+    if len(where) > 0:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY results.id'
+    print_rows(db.query(sql, params))
+
+
+def report(db, args):
+    if db.get_run(args.run_id) is None:
+        print('No run with id', args.run_id)
+        return
+    text = db.render_report(args.run_id)
+    if args.output is not None:
+        with open(args.output, 'w') as out_f:
+            out_f.write(text)
+    else:
+        print(text, end='')
+
+
+def main():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(prog='results_query')
+    parser.add_argument(
+        '--results', type=str, default=os.path.join(dir_path, 'results'),
+        help='Results directory that holds ' + DB_NAME)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    runs_parser = commands.add_parser('runs', help='List runs')
+    runs_parser.add_argument('--device', type=str, default=None)
+    runs_parser.add_argument('--session', type=str, default=None,
+                             help='Only the runs started together with this session id')
+    runs_parser.set_defaults(func=list_runs)
+
+    results_parser = commands.add_parser('results', help='List results, filters can be combined')
+    results_parser.add_argument('--run', type=int, default=None)
+    results_parser.add_argument('--device', type=str, default=None)
+    results_parser.add_argument('--apk', type=str, default=None, help='Apk file name')
+    results_parser.add_argument('--scene', type=str, default=None)
+    results_parser.add_argument('--metric', type=str, default=None,
+                                help='Metric name of structured results, f.e. load_time_ms')
+    results_parser.add_argument('--changeset', type=str, default=None)
+    results_parser.add_argument('--all', action='store_true',
+                                help='Also show the raw ZZRES line of scene based and structured results')
+    results_parser.set_defaults(func=list_results)
+
+    report_parser = commands.add_parser('report', help='Print the text report of a run')
+    report_parser.add_argument('run_id', type=int)
+    report_parser.add_argument('--output', type=str, default=None,
+                               help='Write the report to this file instead')
+    report_parser.set_defaults(func=report)
+
+    args = parser.parse_args()
+    if not os.path.isfile(os.path.join(args.results, DB_NAME)):
+        print('No', DB_NAME, 'in', args.results)
+        return
+    db = ResultsDB(args.results)
+    args.func(db, args)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import random
+from utils.adaptive import MIN_RUNS, AdaptiveTasks
+from utils.metrics import parse_result_scenes
+
+
+def scene_result(frame_time):
+    return 'Scene name: Test_01 | Frame time: {0:.2f}ms ---- Scene name: Test_02 | Frame time: {1:.2f}ms'.format(
+        frame_time, frame_time * 2)
+
+
+def run_until_done(tasks, make_result):
+    runs = 0
+    while True:
+        try:
+            cycle, i_apk = tasks.get_nowait()
+        except Exception:
+            return runs
+        runs += 1
+        tasks.add_result(i_apk, make_result())
+
+
+def test_noisy_scene_results_do_not_converge_early():
+    rng = random.Random(1)
+    tasks = AdaptiveTasks(1, 5, 30, 0.02, parse_result_scenes)
+    runs = run_until_done(tasks, lambda: scene_result(rng.uniform(10, 40)))
+    assert runs == 30
+    assert not tasks.converged.get((None, 0), False)
+
+
+def test_stable_scene_results_converge():
+    rng = random.Random(2)
+    tasks = AdaptiveTasks(1, 5, 30, 0.02, parse_result_scenes)
+    runs = run_until_done(tasks, lambda: scene_result(rng.gauss(16.6, 0.1)))
+    assert runs < 30
+    assert tasks.converged.get((None, 0), False)
+
+
+def test_skipped_result_does_not_block_convergence():
+    rng = random.Random(3)
+    tasks = AdaptiveTasks(1, 5, 30, 0.02, parse_result_scenes)
+    results = iter(['Test #1 Skipped after 3 attempts'] +
+                   [scene_result(rng.gauss(16.6, 0.1)) for i in range(40)])
+    runs = run_until_done(tasks, lambda: next(results))
+    assert runs < 30
+    assert tasks.converged.get((None, 0), False)
+    assert list(tasks.payloads[(None, 0)].keys()) == ['Test_01', 'Test_02']
+
+
+def test_devices_converge_on_their_own_results():
+    rng = random.Random(4)
+    tasks = AdaptiveTasks(1, 5, 30, 0.02, parse_result_scenes)
+    steady, noisy = tasks.for_device('A'), tasks.for_device('B')
+    runs = {'A' : 0, 'B' : 0}
+    for device, device_tasks, make_result in [('A', steady, lambda: scene_result(rng.gauss(16.6, 0.1))),
+                                              ('B', noisy, lambda: scene_result(rng.uniform(10, 40)))]:
+        while True:
+            try:
+                cycle, i_apk = device_tasks.get_nowait()
+            except Exception:
+                break
+            assert cycle == runs[device]
+            runs[device] += 1
+            tasks.add_result(i_apk, make_result(), device)
+    # the noisy phone neither holds back nor finishes the steady one
+    assert tasks.converged[('A', 0)]
+    assert runs['A'] < 30
+    assert not tasks.converged.get(('B', 0), False)
+    assert runs['B'] == 30
+
+
+def test_too_few_runs_are_raised_with_a_notice(capsys):
+    tasks = AdaptiveTasks(1, 2, 30, 0.02)
+    assert tasks.min_runs == MIN_RUNS
+    assert '--run 2' in capsys.readouterr().out
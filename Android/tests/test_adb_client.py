@@ -0,0 +1,80 @@
+import socket
+import threading
+import pytest
+import utils.adb_client
+from utils.adb_client import AdbClient, AdbStreamError, call_adb, retry_call_adb
+
+
+def fake_server(answers, connections=1):
+    # an adb server that answers the transport and the service request of
+    # every connection with `answers` and then hangs up
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(connections)
+    accepted = []
+
+    def serve():
+        for _ in range(connections):
+            conn, _ = server.accept()
+            accepted.append(conn)
+            for answer in answers:
+                size = int(conn.recv(4), 16)
+                conn.recv(size)
+                conn.sendall(answer)
+            conn.close()
+        server.close()
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1], accepted
+
+
+def accept_then_hang_up():
+    # takes the transport and the shell request, then drops the connection
+    # like a device that went away mid command
+    return fake_server([b'OKAY', b'OKAY'])[0]
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def use_client(monkeypatch, port):
+    spawned = []
+    monkeypatch.setattr(utils.adb_client, '_client', AdbClient(port=port))
+    monkeypatch.setattr(utils.adb_client, 'call_program',
+                        lambda args, **kwargs: spawned.append(args) or b'spawned')
+    return spawned
+
+
+def test_accepted_command_is_not_run_again(monkeypatch):
+    spawned = use_client(monkeypatch, accept_then_hang_up())
+    with pytest.raises(AdbStreamError):
+        call_adb(['adb'], ['shell', 'am', 'start', '-n', 'com.x/.Main'])
+    assert spawned == []
+
+
+def test_no_server_spawns_adb(monkeypatch):
+    spawned = use_client(monkeypatch, unused_port())
+    assert call_adb(['adb'], ['shell', 'pm', 'clear', 'com.x']) == b'spawned'
+    assert spawned == [['adb', 'shell', 'pm', 'clear', 'com.x']]
+
+
+def test_idempotent_command_runs_again_after_a_broken_stream(monkeypatch):
+    spawned = use_client(monkeypatch, accept_then_hang_up())
+    assert retry_call_adb(['adb'], ['shell', 'sync'], retry_count=3) == b'spawned'
+    assert spawned == [['adb', 'shell', 'sync']]
+
+
+def test_device_without_shell_v2_is_remembered(monkeypatch):
+    refused = b'FAIL' + b'0006closed'
+    port, accepted = fake_server([b'OKAY', refused], connections=2)
+    monkeypatch.setattr(utils.adb_client, '_no_shell_v2', set())
+    spawned = use_client(monkeypatch, port)
+    assert call_adb(['adb', '-s', 'OLD1'], ['shell', 'getprop']) == b'spawned'
+    assert call_adb(['adb', '-s', 'OLD1'], ['shell', 'getprop']) == b'spawned'
+    # the second call went straight to adb
+    assert len(accepted) == 1
+    assert len(spawned) == 2
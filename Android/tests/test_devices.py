@@ -0,0 +1,73 @@
+import threading
+import utils.devices
+from utils.adaptive import AdaptiveTasks
+from utils.devices import build_task_matrix, default_serial, make_task_queue, next_task, run_on_devices
+
+
+def make_worker(failing):
+    # `failing` raises on its second cell, after it finished the first one
+    def worker(device_id, task_queue):
+        result_sets = [[], []]
+        task_queue.results = result_sets
+        if device_id != failing:
+            # the failing device goes first so its cell is given back while
+            # the other one still runs
+            for thread in threading.enumerate():
+                if thread.name == 'device-' + failing:
+                    thread.join(5)
+        task = next_task(task_queue)
+        while task is not None:
+            cycle, i_apk = task
+            if device_id == failing and sum(len(r) for r in result_sets) == 1:
+                raise RuntimeError('device went offline')
+            result_sets[i_apk].append((device_id, cycle))
+            task = next_task(task_queue)
+        return result_sets
+    return worker
+
+
+def test_cell_of_a_failed_device_is_run_by_another():
+    tasks = build_task_matrix(3, 2)
+    results = run_on_devices(['A', 'B'], make_task_queue(tasks),
+                             make_worker('A'))
+    done = [(cycle, i_apk) for result_sets in results.values()
+            for i_apk, result_set in enumerate(result_sets) for device, cycle in result_set]
+    assert sorted(done) == sorted(tasks)
+    # what A finished before failing is kept
+    assert sum(len(r) for r in results['A']) == 1
+
+
+def test_cell_nobody_could_take_is_reported(capsys):
+    results = run_on_devices(['A'], make_task_queue(build_task_matrix(2, 1)),
+                             make_worker('A'))
+    assert results['A'] == [[('A', 0)], []]
+    assert 'Cycle 1 apk #0 was not run' in capsys.readouterr().out
+
+
+def test_adaptive_tasks_hand_out_a_given_back_cell_first():
+    tasks = AdaptiveTasks(2, 5, 10, 0.02)
+    first = tasks.get_nowait()
+    tasks.put(first)
+    assert tasks.get_nowait() == first
+    assert tasks.get_nowait() != first
+
+
+def test_adaptive_tasks_give_every_device_its_own_cells():
+    tasks = AdaptiveTasks(2, 5, 5, 0.02)
+
+    def worker(device_id, task_queue):
+        done = []
+        task = next_task(task_queue)
+        while task is not None:
+            done.append(task)
+            task = next_task(task_queue)
+        return done
+    results = run_on_devices(['A', 'B'], tasks, worker)
+    assert sorted(results['A']) == sorted(results['B']) == build_task_matrix(5, 2)
+
+
+def test_default_serial_is_the_transport_serial_of_the_only_device(monkeypatch):
+    monkeypatch.setattr(utils.devices, 'list_devices', lambda adb_path: ['emulator-5554'])
+    assert default_serial('adb') == 'emulator-5554'
+    monkeypatch.setattr(utils.devices, 'list_devices', lambda adb_path: ['192.168.1.20:5555', 'emulator-5554'])
+    assert default_serial('adb') is None
@@ -0,0 +1,57 @@
+import threading
+import time
+import utils.frames
+from utils.fake_device import ACTIVITY, FakeConfig, FakeDevice
+from utils.frames import PENDING_FENCE, FrameCollector, find_layer, parse_surfaceflinger_latency
+
+
+def fake_adb(monkeypatch, device, calls):
+    def call_adb(adb_cmd, args, check_returncode=True, **kwargs):
+        calls.append(args)
+        return device.shell(' '.join(args[1:]))[0]
+    monkeypatch.setattr(utils.frames, 'call_adb', call_adb)
+
+
+def frame_threads():
+    return [thread for thread in threading.enumerate() if thread.name.endswith('-frames')]
+
+
+def test_surface_view_layer_is_preferred():
+    layers = ('com.perf.bench/com.unity3d.player.UnityPlayerActivity#0\n'
+              'SurfaceView - com.perf.bench/com.unity3d.player.UnityPlayerActivity#1\n'
+              'SurfaceView[com.perf.bench/com.unity3d.player.UnityPlayerActivity](BLAST)#2\n')
+    assert find_layer(layers, 'com.perf.bench').endswith('(BLAST)#2')
+    assert find_layer('StatusBar#0\n', 'com.perf.bench') is None
+
+
+def test_pending_frames_are_skipped():
+    refresh, presents = parse_surfaceflinger_latency(
+        '16666667\n1 100 100\n2 {0} 3\n3 0 4\n4 200 200\n'.format(PENDING_FENCE))
+    assert (refresh, presents) == (16666667, [100, 200])
+
+
+def test_frames_of_a_running_app(tmp_path, monkeypatch):
+    calls = []
+    device = FakeDevice('FAKE0001', FakeConfig())
+    fake_adb(monkeypatch, device, calls)
+    apk = tmp_path / 'a.apk'
+    apk.write_text('package=com.perf.bench\n')
+    device.install(str(apk))
+    device.start_app('com.perf.bench/' + ACTIVITY)
+    frames = FrameCollector(['adb'], 'com.perf.bench', interval=0.05)
+    frames.start()
+    # an attempt that was never stopped leaves no thread behind
+    frames.start()
+    time.sleep(0.3)
+    summary = frames.stop()
+    device.stop_app('com.perf.bench')
+    assert frame_threads() == []
+    assert summary['frames'] > 0
+    assert summary['p50_ms'] == 16.667
+
+
+def test_stop_without_a_start_asks_the_device_nothing(monkeypatch):
+    calls = []
+    fake_adb(monkeypatch, FakeDevice('FAKE0001', FakeConfig()), calls)
+    assert FrameCollector(['adb'], 'com.perf.bench').stop() == {'frames' : 0}
+    assert calls == []
@@ -0,0 +1,45 @@
+import utils.install_cache
+from utils.fake_device import FakeConfig, FakeDevice
+from utils.install_cache import InstallCache
+
+APP = 'com.perf.bench'
+
+
+def fake_adb(monkeypatch, device):
+    def call_adb(adb_cmd, args, check_returncode=True, **kwargs):
+        if args[0] == 'install':
+            return device.install(args[-1]).encode('utf-8')
+        return device.shell(' '.join(args[1:]))[0]
+    monkeypatch.setattr(utils.install_cache, 'call_adb', call_adb)
+    monkeypatch.setattr(utils.install_cache, 'retry_call_adb', call_adb)
+
+
+def write_apk(path, build):
+    with open(path, 'w') as out_f:
+        out_f.write('package=' + APP + '\n' + build + '\n')
+    return str(path)
+
+
+def test_same_apk_is_installed_once(tmp_path, monkeypatch):
+    device = FakeDevice('FAKE0001', FakeConfig(install_overhead=0))
+    fake_adb(monkeypatch, device)
+    apk = write_apk(tmp_path / 'a.apk', 'build 1')
+    assert InstallCache().install(['adb'], APP, apk)
+    # the marker is on the device, a new run skips the install too
+    assert not InstallCache().install(['adb'], APP, apk)
+    assert device.install_count == 1
+
+    write_apk(tmp_path / 'a.apk', 'build 22')
+    assert InstallCache().install(['adb'], APP, apk)
+    assert device.install_count == 2
+
+
+def test_install_by_someone_else_invalidates_the_marker(tmp_path, monkeypatch):
+    device = FakeDevice('FAKE0001', FakeConfig(install_overhead=0))
+    fake_adb(monkeypatch, device)
+    apk = write_apk(tmp_path / 'a.apk', 'build 1')
+    cache = InstallCache()
+    cache.install(['adb'], APP, apk)
+    device.install(write_apk(tmp_path / 'other.apk', 'other build'))
+    assert cache.install(['adb'], APP, apk)
+    assert device.install_count == 3
@@ -0,0 +1,27 @@
+from utils.kibana import BulkSink, build_scene_update
+from utils.spool import Spool
+
+
+def document(serial):
+    return {'device_serial' : serial, 'date_of_test' : '2026-10-18T10:00:00Z', 'data' : [], 'error_log' : []}
+
+
+def test_every_device_gets_its_own_document(tmp_path):
+    spool = Spool(str(tmp_path / 'spool.jsonl'))
+    # nothing listens there, the results stay in the spool
+    sink = BulkSink('http://127.0.0.1:9/perf', spool, flush_interval=3600)
+    first = sink.add_scene_result('Test_01', 'a.apk', '16.5', document('FAKE0001'))
+    second = sink.add_scene_result('Test_01', 'a.apk', '17.5', document('FAKE0002'))
+    again = sink.add_scene_result('Test_01', 'a.apk', '16.6', document('FAKE0001'))
+    assert first != second
+    assert first == again
+    assert spool.pending_count() == 3
+
+
+def test_scene_results_with_units_are_data():
+    action, body = build_scene_update('id', ' 19.406ms ')
+    assert body['script']['params']['value'] == 19.406
+    assert 'data.add' in body['script']['source']
+    action, body = build_scene_update('id', 'Test #1 Skipped after 3 attempts')
+    assert body['script']['params']['value'] == 'Test #1 Skipped after 3 attempts'
+    assert 'error_log.add' in body['script']['source']
@@ -0,0 +1,80 @@
+import utils.logcat
+from utils.fake_device import FakeDevice, FakeConfig
+from utils.logcat import LogcatParser, LogcatReader
+
+
+def fake_adb(monkeypatch, device):
+    # adb commands go straight to the fake device's shell
+    def call_adb(adb_cmd, args, check_returncode=True, **kwargs):
+        out, code = device.shell(' '.join(args[1:] if args[0] == 'shell' else args))
+        return out
+    monkeypatch.setattr(utils.logcat, 'call_adb', call_adb)
+
+
+def test_incremental_polls_only_new_lines(monkeypatch):
+    device = FakeDevice('FAKE0001', FakeConfig())
+    fake_adb(monkeypatch, device)
+    reader = LogcatReader(['adb'], sdk=30)
+    device.log_line('I', 'Unity', 'APP_STARTED')
+    assert reader.poll() == 1
+    device.log_line('I', 'Unity', 'ZZRES>>16.5')
+    assert reader.poll() == 1
+    assert reader.incremental
+    assert reader.parser.first_result() == '16.5'
+
+
+def test_old_logcat_falls_back_to_full_dumps(monkeypatch):
+    # the legacy shell exits with 0, logcat only prints its usage
+    device = FakeDevice('FAKE0001', FakeConfig(sdk=23))
+    fake_adb(monkeypatch, device)
+    reader = LogcatReader(['adb'])
+    device.log_line('I', 'Unity', 'ZZRES>>16.5')
+    reader.poll()
+    assert not reader.incremental
+    assert reader.parser.first_result() == '16.5'
+
+
+def test_old_sdk_starts_with_full_dumps(monkeypatch):
+    device = FakeDevice('FAKE0001', FakeConfig(sdk=23))
+    fake_adb(monkeypatch, device)
+    reader = LogcatReader(['adb'], sdk=23)
+    assert not reader.incremental
+    device.log_line('I', 'Unity', 'ZZRES>>16.5')
+    reader.poll()
+    assert reader.parser.first_result() == '16.5'
+
+PLAYER_START = (
+    "10-18 10:00:00.100  4242  4260 I Unity   : SystemInfo CPU = ARM64 FP ASIMD AES, Cores = 8, Memory = 7680mb\n"
+    "10-18 10:00:00.101  4242  4260 I Unity   : Built from '2020.3/staging' branch, Version '2020.3.1f1 (77a89f25062f)', "
+    "Build type 'Release', Scripting Backend 'il2cpp', CPU 'arm64-v8a', Stripping 'Disabled'\n"
+    "10-18 10:00:00.102  4242  4260 I Unity   : Vulkan API version 1.1.128\n"
+    "10-18 10:00:00.103  4242  4260 I Unity   : APP_STARTED\n")
+
+
+def test_build_attributes_come_from_the_player_start():
+    parser = LogcatParser()
+    parser.feed_dump(PLAYER_START)
+    architecture, backend, build_type, version, changeset, graphics_api, started = parser.attributes()
+    assert (architecture, backend, build_type) == ('ARM64', 'il2cpp', 'Release')
+    assert (version.strip(), changeset, graphics_api, started) == ('2020.3.1f1', '77a89f25062f', 'Vulkan', True)
+    assert parser.result() is None
+
+
+def test_repeated_dumps_only_parse_new_lines():
+    parser = LogcatParser()
+    parser.feed_dump(PLAYER_START)
+    dump = PLAYER_START + '10-18 10:00:09.000  4242  4260 I Unity   : ZZRES>>16.5\n'
+    parser.feed_dump(dump)
+    parser.feed_dump(dump)
+    assert parser.results == ['16.5']
+    # a half written last line waits for the next dump
+    parser.feed_dump(dump + '10-18 10:00:09.500  4242  4260 I Unity   : ZZRES>>17')
+    assert parser.results == ['16.5']
+
+
+def test_cleared_buffer_starts_over():
+    parser = LogcatParser()
+    parser.feed_dump(PLAYER_START + '10-18 10:00:09.000  4242  4260 I Unity   : ZZRES>>16.5\n')
+    # logcat -c before the next test, its result must not be the old one
+    parser.feed_dump('10-18 10:05:00.000  4343  4360 I Unity   : ZZRES>>18.5\n')
+    assert parser.result() == '18.5'
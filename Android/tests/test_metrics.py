@@ -0,0 +1,43 @@
+import argparse
+import results_query
+from utils.metrics import combine_payloads, is_end, is_structured, parse_records, parse_result_scenes
+from utils.results_db import ResultsDB
+
+
+def test_json_and_key_value_records_are_the_same():
+    as_json = parse_records('{"scene": "Test_01", "frame_time_ms": 16.5, "load_time_ms": 812}')
+    as_key_value = parse_records('scene=Test_01 frame_time_ms=16.5 load_time_ms=812')
+    assert as_json == as_key_value == [('Test_01', 'frame_time_ms', 16.5), ('Test_01', 'load_time_ms', 812)]
+    assert parse_records('[{"scene": "Test_01", "metric": "memory_mb", "value": 512}]') == \
+        [('Test_01', 'memory_mb', 512)]
+    # typed values, text stays text
+    assert parse_records('gpu="Adreno 640" vsync=true') == [(None, 'gpu', 'Adreno 640'), (None, 'vsync', True)]
+    assert parse_records('{"scene": ') == []
+
+
+def test_payloads_over_several_lines_become_one_result():
+    payloads = ['scene=Test_01 frame_time_ms=16.5', '{"scene": "Test_02", "frame_time_ms": 17.5}', 'end=1']
+    assert not is_end(payloads[0])
+    assert is_end(payloads[2])
+    assert is_end('{"end": true}')
+    result = combine_payloads(payloads)
+    assert is_structured(result)
+    assert parse_result_scenes(result) == [('Test_01 | frame_time_ms', 16.5), ('Test_02 | frame_time_ms', 17.5)]
+    # plain and scene based results keep their own parsers
+    assert parse_result_scenes('16.5') is None
+    assert parse_result_scenes('Scene name: Test_01 | Frame time: 21.52ms') == [('Test_01', '21.52ms')]
+
+
+def test_query_by_metric(tmp_path, capsys):
+    db = ResultsDB(str(tmp_path))
+    run_id = db.start_run('APR_SCENEBASED', 'com.perf.bench', 'FAKE0001', 'run.txt', '100')
+    result = combine_payloads(['scene=Test_01 frame_time_ms=16.5 load_time_ms=812'])
+    db.add_test(run_id, 0, 0, 'a.apk', '100', result, metrics=parse_records(result))
+    args = argparse.Namespace(run=None, device=None, apk=None, scene=None, metric='load_time_ms',
+                              changeset=None, all=False)
+    results_query.list_results(db, args)
+    db.close()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    row = dict(zip(lines[0].split('\t'), lines[1].split('\t')))
+    assert (row['scene'], row['metric'], row['value']) == ('Test_01', 'load_time_ms', '812.0')
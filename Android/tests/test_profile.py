@@ -0,0 +1,44 @@
+import utils.profile
+import utils.thermal
+from utils.fake_device import FakeConfig, FakeDevice
+from utils.profile import get_profile, parse_profile
+
+
+def fake_adb(monkeypatch, device, calls):
+    def call_adb(adb_cmd, args, check_returncode=True, **kwargs):
+        calls.append(args)
+        return device.shell(' '.join(args[1:]))[0]
+    monkeypatch.setattr(utils.profile, 'call_adb', call_adb)
+    monkeypatch.setattr(utils.thermal, 'call_adb', call_adb)
+    monkeypatch.setattr(utils.profile, '_profiles', {})
+
+
+def test_profile_of_one_shell_call(monkeypatch):
+    calls = []
+    fake_adb(monkeypatch, FakeDevice('FAKE0001', FakeConfig()), calls)
+    profile = get_profile(['adb', '-s', 'FAKE0001'], 'FAKE0001')
+    assert len(calls) == 1
+    assert (profile.serial, profile.model, profile.sdk) == ('FAKE0001', 'Fake FAKE0001', 30)
+    assert (profile.gpu_vendor, profile.gpu, profile.gles_version) == ('Qualcomm', 'Adreno (TM) 640', 'OpenGL ES 3.2')
+    assert (profile.width, profile.height, profile.density, profile.refresh_rate) == (1080, 2340, 440, 60.0)
+    assert profile.state.level == 100
+    assert 'Android 11 (sdk 30)' in str(profile)
+
+
+def test_later_calls_only_refresh_the_state(monkeypatch):
+    calls = []
+    device = FakeDevice('FAKE0001', FakeConfig())
+    fake_adb(monkeypatch, device, calls)
+    first = get_profile(['adb'])
+    # known by its serial from the props now
+    again = get_profile(['adb', '-s', 'FAKE0001'], 'FAKE0001')
+    assert again is first
+    assert calls[1] == utils.thermal.STATE_COMMAND
+
+
+def test_wm_override_wins():
+    out = ('[ro.serialno]: [ABC]\n----BATTERY----\n----DISPLAY----\n'
+           'Physical size: 1080x2340\nOverride size: 720x1560\nPhysical density: 440\n')
+    profile = parse_profile(out)
+    assert (profile.width, profile.height, profile.density) == (720, 1560, 440)
+    assert profile.to_dict()['serial'] == 'ABC'
@@ -0,0 +1,65 @@
+import pytest
+from utils.results_db import ResultsDB
+from utils.resume import ResumeError, load_session
+
+APKS = ['/apks/a.apk', '/apks/b.apk']
+
+EXPECTED_REPORT = '''BEGIN
+Cycle 0
+Battery level before test # 0 is 100
+Result set 0: 16.5
+Battery level before test # 1 is 99
+Result set 1: Scene name: Test_01 | Frame time: 21.52ms
+Cycle 1
+Battery level before test # 0 is 98
+Result set 0: Test #2 Skipped after 3 attempts
+16.5
+Test #2 Skipped after 3 attempts
+Scene name: Test_01 | Frame time: 21.52ms
+--------------------------------
+Battery on start 100
+Battery on finish 97
+Result set 0
+APK Name:a.apk
+16.5
+Test #2 Skipped after 3 attempts
+Result set 1
+APK Name:b.apk
+Scene name: Test_01 | Frame time: 21.52ms
+'''
+
+
+def start(db):
+    return db.start_run('adb_perf_runner', 'com.perf.bench', 'FAKE0001', 'run.txt', '100', 'session1')
+
+
+def test_tests_survive_a_reopen_and_resume_the_same_run(tmp_path):
+    db = ResultsDB(str(tmp_path))
+    run_id = start(db)
+    db.add_test(run_id, 0, 0, APKS[0], '100', '16.5')
+    db.add_test(run_id, 0, 1, APKS[1], '99', 'Scene name: Test_01 | Frame time: 21.52ms',
+                scenes=[('Test_01', '21.52ms')])
+    db.close()
+
+    db = ResultsDB(str(tmp_path))
+    completed, previous = load_session(db, 'session1', APKS)
+    assert completed == {(0, 0), (0, 1)}
+    assert previous['FAKE0001']['run_id'] == run_id
+    assert previous['FAKE0001']['result_sets'] == [['16.5'], ['Scene name: Test_01 | Frame time: 21.52ms']]
+    db.add_test(run_id, 1, 0, APKS[0], '98', 'Test #2 Skipped after 3 attempts')
+    db.finish_run(run_id, '97')
+    assert [test['cycle'] for test in db.get_tests(run_id)] == [0, 0, 1]
+    # the scene value is kept as a number next to the raw text
+    assert db.query('SELECT value FROM results WHERE scene_id IS NOT NULL')[0][0] == 21.52
+    assert db.render_report(run_id) == EXPECTED_REPORT
+    db.close()
+
+
+def test_resume_with_other_apks_is_refused(tmp_path):
+    db = ResultsDB(str(tmp_path))
+    db.add_test(start(db), 0, 0, APKS[0], '100', '16.5')
+    with pytest.raises(ResumeError):
+        load_session(db, 'session1', list(reversed(APKS)))
+    with pytest.raises(ResumeError):
+        load_session(db, 'other', APKS)
+    db.close()
@@ -0,0 +1,35 @@
+from utils.devices import remaining_tasks
+from utils.results_db import ResultsDB
+from utils.resume import load_session, new_session_id
+from utils.schedule import order_tasks
+
+APKS = ['/apks/a.apk', '/apks/b.apk']
+
+
+def test_resumed_session_runs_only_what_did_not_finish(tmp_path):
+    session = new_session_id()
+    db = ResultsDB(str(tmp_path))
+    tasks = order_tasks(3, 2, 'randomized-balanced', seed=7)
+    # two devices, the run was interrupted after three tests
+    runs = dict((device, db.start_run('adb_perf_runner', 'com.perf.bench', device, device + '.txt', '100', session))
+                for device in ['FAKE0001', 'FAKE0002'])
+    for device, (cycle, i_apk) in zip(['FAKE0001', 'FAKE0002', 'FAKE0001'], tasks[:3]):
+        db.add_test(runs[device], cycle, i_apk, APKS[i_apk], '100', '16.5')
+    # another session in the same database is not part of it
+    other = db.start_run('adb_perf_runner', 'com.perf.bench', 'FAKE0001', 'x.txt', '100', new_session_id())
+    db.add_test(other, 2, 1, APKS[1], '100', '16.5')
+    db.close()
+
+    db = ResultsDB(str(tmp_path))
+    completed, previous = load_session(db, session, APKS)
+    db.close()
+    # the same order picks up where it stopped
+    assert remaining_tasks(order_tasks(3, 2, 'randomized-balanced', seed=7), completed) == tasks[3:]
+    assert sorted(previous) == ['FAKE0001', 'FAKE0002']
+    assert previous['FAKE0001']['run_id'] == runs['FAKE0001']
+    assert previous['FAKE0001']['result_file'] == 'FAKE0001.txt'
+    assert sum(len(result_set) for result_set in previous['FAKE0001']['result_sets']) == 2
+
+
+def test_session_ids_differ():
+    assert new_session_id() != new_session_id()
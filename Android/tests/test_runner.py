@@ -0,0 +1,27 @@
+import pytest
+import adb_perf_runner
+
+
+class Collector:
+    def __init__(self):
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+def test_collectors_stop_when_the_attempt_fails(monkeypatch):
+    monkeypatch.setattr(adb_perf_runner, 'retry_call_adb', lambda *args, **kwargs: b'')
+    monkeypatch.setattr(adb_perf_runner.time, 'sleep', lambda s: None)
+
+    def lost(adb_cmd, sleep_s):
+        raise adb_perf_runner.AdbStreamError('connection reset')
+    monkeypatch.setattr(adb_perf_runner, 'measure_startup', lost)
+    frames, sampler = Collector(), Collector()
+    with pytest.raises(adb_perf_runner.AdbStreamError):
+        adb_perf_runner.run_attempt(['adb'], 'com.perf.bench', 'a.apk', 10, True, None, frames, sampler)
+    assert not frames.running
+    assert not sampler.running
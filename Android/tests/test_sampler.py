@@ -0,0 +1,40 @@
+import threading
+import utils.sampler
+from utils.sampler import SECTION_MARKER, SystemSampler
+
+
+def fake_output(busy, total):
+    return ('cpu  {0} 0 0 {1} 0 0 0 0 0 0\n'.format(busy, total - busy) + SECTION_MARKER +
+            '\n1800000\n2400000\n' + SECTION_MARKER + '\nVmRSS:\t  204800 kB\nThreads:\t42\n' +
+            SECTION_MARKER + '\n/sys/class/kgsl/kgsl-3d0/gpu_busy_percentage 30 %\n').encode('utf-8')
+
+
+def sampler_threads():
+    return [thread for thread in threading.enumerate() if thread.name.endswith('-sampler')]
+
+
+def test_samples_are_summed_up(monkeypatch):
+    outputs = iter([fake_output(100, 1000), fake_output(600, 2000)])
+    monkeypatch.setattr(utils.sampler, 'call_adb', lambda adb_cmd, args, **kwargs: next(outputs))
+    sampler = SystemSampler(['adb'], 'com.perf.bench', interval=3600)
+    sampler.sample()
+    sampler.sample()
+    summary = sampler.summary()
+    assert summary['samples'] == 2
+    assert summary['cpu_load']['mean'] == 0.5
+    assert summary['app_rss_mb']['max'] == 200.0
+    assert summary['cpu_freq_max_mhz']['max'] == 2400.0
+
+
+def test_a_restart_never_leaves_two_threads(monkeypatch):
+    monkeypatch.setattr(utils.sampler, 'call_adb', lambda adb_cmd, args, **kwargs: fake_output(100, 1000))
+    sampler = SystemSampler(['adb'], 'com.perf.bench', interval=0.01)
+    sampler.start()
+    # the attempt was never stopped
+    sampler.start()
+    assert len(sampler_threads()) == 1
+    sampler.stop()
+    assert sampler_threads() == []
+    # a stopped sampler stays stopped
+    assert sampler.stop()['samples'] > 0
+    assert sampler_threads() == []
@@ -0,0 +1,52 @@
+from utils.devices import build_task_matrix
+from utils.results_db import ResultsDB
+from utils.schedule import estimate_run, format_estimate
+
+
+def test_durations_of_earlier_tests(tmp_path):
+    db = ResultsDB(str(tmp_path))
+    run_id = db.start_run('adb_perf_runner', 'com.perf.bench', 'FAKE0001', None, '100')
+    for i_apk, apk in enumerate(['a.apk', 'b.apk', 'a.apk']):
+        db.add_test(run_id, 0, i_apk % 2, apk, '100', '16.5')
+    with db._conn:
+        db._conn.execute("UPDATE runs SET started = '2026-10-18T10:00:00'")
+        for cycle_id, finished in [(1, '2026-10-18T10:01:00'), (2, '2026-10-18T10:01:30'),
+                                   (3, '2026-10-18T10:02:10')]:
+            db._conn.execute('UPDATE cycles SET finished = ? WHERE id = ?', (finished, cycle_id))
+    assert db.get_test_durations('com.perf.bench') == {'a.apk' : [60.0, 40.0], 'b.apk' : [30.0]}
+    assert db.get_test_durations('com.other') == {}
+    db.close()
+
+
+def test_expected_time_comes_from_the_mean_of_earlier_tests():
+    tasks = build_task_matrix(4, 2)
+    apks = ['a.apk', 'b.apk']
+    maximum = estimate_run(tasks, apks, 1, 300)
+    assert maximum['expected_s'] is None
+    assert 'expected' not in format_estimate(maximum, 'interleaved')
+    # 100000s is no test, it was a resumed run
+    estimate = estimate_run(tasks, apks, 1, 300, durations={'a.apk' : [40.0, 60.0, 100000.0], 'b.apk' : [30.0]})
+    assert estimate['observed'] == 3
+    assert estimate['expected_s'] == 4 * 50.0 + 4 * 30.0
+    assert estimate['wall_s'] == maximum['wall_s']
+    text = format_estimate(estimate, 'interleaved')
+    assert 'expected 0h05m20s (mean of 3 earlier tests)' in text
+    assert 'at most' in text
+
+
+def test_apks_without_history_count_with_their_maximum():
+    tasks = build_task_matrix(1, 2)
+    estimate = estimate_run(tasks, ['a.apk', 'b.apk'], 1, 300, durations={'a.apk' : [40.0]})
+    maximum = estimate_run(build_task_matrix(1, 1), ['b.apk'], 1, 300)
+    assert estimate['expected_s'] == 40.0 + maximum['wall_s']
+
+
+def test_estimate_follows_the_device_that_is_free_first():
+    # a slow and a fast apk on two devices: the second device is done with
+    # the fast apk long before the first, so it also runs the second slow
+    # test, not the first device after its slow one
+    tasks = build_task_matrix(2, 2)
+    estimate = estimate_run(tasks, ['a.apk', 'b.apk'], 2, 300, durations={'a.apk' : [100.0], 'b.apk' : [10.0]})
+    assert estimate['expected_s'] == 110.0
+    single = estimate_run(tasks, ['a.apk', 'b.apk'], 1, 300, durations={'a.apk' : [100.0], 'b.apk' : [10.0]})
+    assert single['expected_s'] == 220.0
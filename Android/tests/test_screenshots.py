@@ -0,0 +1,48 @@
+import os
+import pytest
+from utils import screenshots
+from utils.fake_device import FakeConfig, FakeDevice, solid_png
+
+
+def test_capture_points():
+    assert screenshots.parse_points('5, 20,result') == [5.0, 20.0, 'result']
+    with pytest.raises(ValueError):
+        screenshots.parse_points('-1')
+    assert [screenshots.point_label(p) for p in [5.0, 'result']] == ['5s', 'result']
+
+
+def test_same_frame_is_stored_once(tmp_path):
+    store = screenshots.ScreenshotStore(str(tmp_path), width=90)
+    png = solid_png(1080, 2340, (200, 10, 10))
+    first = store.add(png).result()
+    second = store.add(png).result()
+    other = store.add(solid_png(1080, 2340, (10, 200, 10))).result()
+    store.close()
+    assert first == second
+    assert other['sha256'] != first['sha256']
+    assert (store.captured, store.stored) == (3, 2)
+    path = os.path.join(str(tmp_path), first['path'])
+    assert os.path.getsize(path) == first['bytes']
+    if screenshots.Image is not None:
+        # shrunk to the width of the store
+        with screenshots.Image.open(path) as image:
+            assert image.width == 90
+
+
+def test_points_of_an_attempt(tmp_path, monkeypatch):
+    device = FakeDevice('FAKE0001', FakeConfig())
+    monkeypatch.setattr(screenshots, 'call_adb', lambda adb_cmd, args, **kwargs: device.shell(' '.join(args[1:]))[0])
+    store = screenshots.ScreenshotStore(str(tmp_path))
+    shots = screenshots.TestScreenshots(['adb'], store, [0.01, 600.0, screenshots.RESULT_POINT])
+    shots.start()
+    # the first attempt got no result, the 600s timer must not fire later
+    shots.finish(False)
+    shots.start()
+    shots.finish(True)
+    refs = shots.collect()
+    store.close()
+    taken = sorted((ref['attempt'], ref['point']) for ref in refs)
+    assert (2, 'result') in taken
+    assert all(point != '600s' for attempt, point in taken)
+    assert (1, 'result') not in taken
+    assert shots.collect() == []
@@ -0,0 +1,51 @@
+import json
+from utils.fake_snipeit_server import FakeSnipeItServer, fake_records
+from utils.snipeit import SnipeItCache
+
+SERIAL = 'R58M1234ABCD'
+
+
+def make_cache(tmp_path, server, ttl=3600):
+    return SnipeItCache(str(tmp_path / 'snipeit_cache.json'), 'Bearer key', server.url, ttl=ttl, timeout=2)
+
+
+def test_cached_serial_is_not_looked_up_again(tmp_path):
+    server = FakeSnipeItServer(fake_records([SERIAL])).start()
+    cache = make_cache(tmp_path, server)
+    assert cache.lookup(SERIAL) == ('Fake Phone CD', 'AT-ABCD')
+    assert cache.lookup(SERIAL) == ('Fake Phone CD', 'AT-ABCD')
+    cache.close()
+    # a later run answers from the file
+    cache = make_cache(tmp_path, server)
+    assert cache.lookup(SERIAL) == ('Fake Phone CD', 'AT-ABCD')
+    cache.close()
+    server.stop()
+    assert server.requests == 1
+
+
+def test_expired_entry_is_refreshed_in_the_background(tmp_path):
+    server = FakeSnipeItServer(fake_records([SERIAL])).start()
+    cache = make_cache(tmp_path, server, ttl=0)
+    cache.lookup(SERIAL)
+    server.records[SERIAL] = ('Renamed Phone', 'AT-0001')
+    # answered right away with what is known, the new name comes later
+    assert cache.lookup(SERIAL) == ('Fake Phone CD', 'AT-ABCD')
+    cache.close()
+    server.stop()
+    assert server.requests == 2
+    with open(cache.path) as in_f:
+        assert json.load(in_f)[SERIAL]['name'] == 'Renamed Phone'
+
+
+def test_stale_entry_is_kept_when_snipeit_is_down(tmp_path):
+    server = FakeSnipeItServer(fake_records([SERIAL])).start()
+    cache = make_cache(tmp_path, server, ttl=0)
+    cache.lookup(SERIAL)
+    server.online = False
+    assert cache.lookup(SERIAL) == ('Fake Phone CD', 'AT-ABCD')
+    cache.close()
+    server.stop()
+    assert server.requests == 2
+    cache = make_cache(tmp_path, server, ttl=0)
+    assert cache.lookup(SERIAL) == ('Fake Phone CD', 'AT-ABCD')
+    cache.close()
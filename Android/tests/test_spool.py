@@ -0,0 +1,120 @@
+import json
+import os
+from utils.fake_es_server import FakeElasticServer
+from utils.kibana import BulkSink, scene_doc_id
+from utils.spool import Spool, drain_spool, replay_spools
+
+
+def document(serial):
+    return {'device_serial' : serial, 'date_of_test' : '2026-10-18T10:00:00Z', 'data' : [], 'error_log' : []}
+
+
+def make_sink(tmp_path, index_url):
+    spool = Spool(str(tmp_path / 'spool.jsonl'))
+    return BulkSink(index_url, spool, flush_interval=3600), spool
+
+
+def test_bulk_results_end_up_in_their_documents(tmp_path):
+    server = FakeElasticServer().start()
+    sink, spool = make_sink(tmp_path, server.url + '/perf')
+    doc_id = sink.add_scene_result('Test_01', 'a.apk', '16.5', document('FAKE0001'))
+    sink.add_scene_result('Test_01', 'a.apk', '17.5', document('FAKE0001'))
+    sink.add_scene_result('Test_01', 'a.apk', 'Skipped', document('FAKE0001'))
+    sink.close()
+    server.stop()
+    doc = server.docs[('perf', doc_id)]
+    assert doc['data'] == [16.5, 17.5]
+    assert doc['error_log'] == ['Skipped']
+    # everything was sent, the journal is gone
+    assert not os.path.exists(spool.path)
+    assert not os.path.exists(spool.rejected_path)
+
+
+def test_rejected_items_go_to_the_rejected_journal(tmp_path):
+    server = FakeElasticServer().start()
+    index_url = server.url + '/perf'
+    server.reject_ids.add(scene_doc_id(index_url, 'Test_02', '2026-10-18T10:00:00Z', 'a.apk', 'FAKE0001'))
+    sink, spool = make_sink(tmp_path, index_url)
+    kept = sink.add_scene_result('Test_01', 'a.apk', '16.5', document('FAKE0001'))
+    rejected = sink.add_scene_result('Test_02', 'a.apk', '33.0', document('FAKE0001'))
+    sink.close()
+    server.stop()
+    assert ('perf', kept) in server.docs
+    assert ('perf', rejected) not in server.docs
+    with open(spool.rejected_path) as in_f:
+        entries = [json.loads(line) for line in in_f]
+    assert len(entries) == 1
+    assert 'mapper_parsing_exception' in entries[0]['reason']
+    # only the failed action, ready to be sent again on its own
+    action, body = [json.loads(line) for line in entries[0]['record']['body'].splitlines()]
+    assert action['update']['_id'] == rejected
+    assert body['script']['params']['value'] == 33.0
+
+
+def test_unreachable_server_keeps_results_for_replay(tmp_path):
+    server = FakeElasticServer().start()
+    port = server.server_address[1]
+    index_url = server.url + '/perf'
+    server.stop()
+    sink, spool = make_sink(tmp_path, index_url)
+    doc_id = sink.add_scene_result('Test_01', 'a.apk', '16.5', document('FAKE0001'))
+    sink.add_scene_result('Test_01', 'a.apk', '17.5', document('FAKE0002'))
+    sink.close()
+    assert not drain_spool(spool, timeout=1)
+    assert spool.pending_count() == 2
+
+    # the server is back where the records point to
+    server = FakeElasticServer(port).start()
+    assert replay_spools(str(tmp_path))
+    server.stop()
+    assert server.docs[('perf', doc_id)]['data'] == [16.5]
+    assert len(server.docs) == 2
+    assert not os.path.exists(spool.path)
+
+
+def test_outage_answers_are_retried_not_rejected(tmp_path):
+    server = FakeElasticServer().start()
+    server.online = False
+    spool = Spool(str(tmp_path / 'spool.jsonl'))
+    sink = BulkSink(server.url + '/perf', spool, flush_interval=3600)
+    sink.add_scene_result('Test_01', 'a.apk', '16.5', document('FAKE0001'))
+    assert not drain_spool(spool, timeout=1)
+    server.online = True
+    sink.close()
+    server.stop()
+    assert len(server.docs) == 1
+    assert not os.path.exists(spool.rejected_path)
+
+
+def test_pushed_back_items_are_sent_again(tmp_path):
+    server = FakeElasticServer().start()
+    index_url = server.url + '/perf'
+    busy = scene_doc_id(index_url, 'Test_01', '2026-10-18T10:00:00Z', 'a.apk', 'FAKE0001')
+    server.busy_ids.add(busy)
+    spool = Spool(str(tmp_path / 'spool.jsonl'))
+    sink = BulkSink(index_url, spool, flush_interval=3600)
+    sink.add_scene_result('Test_01', 'a.apk', '16.5', document('FAKE0001'))
+    sink.add_scene_result('Test_01', 'a.apk', '17.5', document('FAKE0001'))
+    sink.add_scene_result('Test_02', 'a.apk', '33.0', document('FAKE0001'))
+    # the upsert got a 429, the update after it would miss its document
+    assert not drain_spool(spool, timeout=1)
+    assert spool.pending_count() == 2
+    sink.close()
+    server.stop()
+    assert server.docs[('perf', busy)]['data'] == [16.5, 17.5]
+    assert len(server.docs) == 2
+    assert not os.path.exists(spool.rejected_path)
+
+
+def test_too_large_batches_are_split(tmp_path):
+    server = FakeElasticServer().start()
+    spool = Spool(str(tmp_path / 'spool.jsonl'))
+    sink = BulkSink(server.url + '/perf', spool, flush_interval=3600)
+    for i in range(8):
+        sink.add_scene_result('Test_{0:02d}'.format(i), 'a.apk', '16.5', document('FAKE0001'))
+    # room for about two records per request
+    server.max_body = 2 * len(Spool(spool.path).read_pending(1)[0][0]['body']) + 10
+    sink.close()
+    server.stop()
+    assert len(server.docs) == 8
+    assert not os.path.exists(spool.rejected_path)
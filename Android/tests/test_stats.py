@@ -0,0 +1,48 @@
+import math
+from utils.metrics import parse_result_scenes
+from utils.results_db import numeric
+from utils.stats import parse_value, summarize, format_summary
+
+# the result of a scene based test as the README shows it
+README_PAYLOAD = 'Scene name: Test_01 | Frame time: 21.52ms'
+
+
+def test_parse_value_plain():
+    assert parse_value('16.510') == 16.51
+    assert parse_value(' 21.52ms') == 21.52
+    assert math.isnan(parse_value('Test #1 Skipped after 3 attempts'))
+
+
+def test_parse_value_takes_value_after_last_colon():
+    assert parse_value(README_PAYLOAD) == 21.52
+
+
+def test_readme_payload_scenes():
+    scenes = parse_result_scenes(README_PAYLOAD + ' ---- Scene name: Test_02 | Frame time: 30.1ms')
+    assert scenes == [('Test_01', '21.52ms'), ('Test_02', '30.1ms')]
+    assert [parse_value(value) for name, value in scenes] == [21.52, 30.1]
+    assert numeric(scenes[0][1]) == 21.52
+    assert numeric('Test #1 Skipped after 3 attempts') is None
+
+
+def test_summary_of_readme_payloads():
+    results = ['Scene name: Test_01 | Frame time: {0}ms'.format(v) for v in (21.5, 22.5, 23.5)]
+    s = summarize(results)
+    assert s['n'] == 3
+    assert abs(s['mean'] - 22.5) < 1e-9
+    text = format_summary(['a.apk'], [results], parse_result_scenes)
+    assert 'Scene: Test_01' in text
+    assert 'mean=22.500' in text
+
+
+def test_few_values_keep_outliers():
+    s = summarize(['16.772', '16.821', '16.765'])
+    assert s['n'] == 3
+    assert s['outliers'] == 0
+
+
+def test_outliers_removed_from_enough_values():
+    values = ['16.7', '16.8', '16.75', '16.72', '16.78', '16.74', '16.76', '16.71', '30.0']
+    s = summarize(values)
+    assert s['outliers'] == 1
+    assert summarize(values, reject_outliers=False)['n'] == 9
@@ -0,0 +1,44 @@
+import utils.thermal
+from utils.thermal import SECTION_MARKER, gate_reasons, parse_device_state, wait_for_device
+
+
+def dumpsys(temperature, level=80, status=3, thermal_status=0):
+    return ('Current Battery Service state:\n'
+            '  AC powered: false\n  USB powered: false\n'
+            '  status: {0}\n  level: {1}\n  temperature: {2}\n'.format(status, level, int(temperature * 10)) +
+            SECTION_MARKER + '\n'
+            'IsStatusOverride: false\nThermal Status: {0}\n'
+            'Cached temperatures:\n'
+            '\tTemperature{{mValue=99.0, mType=0, mName=cpu0, mStatus=0}}\n'
+            'Current temperatures from HAL:\n'
+            '\tTemperature{{mValue=41.5, mType=0, mName=cpu0, mStatus=0}}\n'
+            '\tTemperature{{mValue=44.0, mType=0, mName=cpu1, mStatus=0}}\n'
+            '\tTemperature{{mValue=33.0, mType=3, mName=skin, mStatus=0}}\n'.format(thermal_status))
+
+
+def test_battery_and_thermal_state():
+    state = parse_device_state(dumpsys(36.5, level=80, status=2, thermal_status=1))
+    assert state.level == 80
+    assert state.battery_temperature == 36.5
+    assert state.status == 'charging'
+    assert state.thermal_status == 1
+    # the live values, not the cached ones
+    assert state.max_temperature('cpu') == 44.0
+    assert state.max_temperature('skin') == 33.0
+    assert state.level_line() == 'level: 80'
+
+
+def test_gate_waits_until_the_device_cooled_down(monkeypatch):
+    outputs = iter([dumpsys(41.0), dumpsys(38.5), dumpsys(34.0)])
+    monkeypatch.setattr(utils.thermal, 'call_adb',
+                        lambda adb_cmd, args, **kwargs: next(outputs).encode('utf-8'))
+    state = wait_for_device(['adb'], max_temp=35, poll=0)
+    assert state.battery_temperature == 34.0
+
+
+def test_discharging_battery_is_not_waited_for(capsys):
+    state = parse_device_state(dumpsys(30.0, level=10, status=3))
+    assert gate_reasons(state, min_battery=20) == []
+    assert 'not charging' in capsys.readouterr().out
+    state = parse_device_state(dumpsys(30.0, level=10, status=2))
+    assert gate_reasons(state, min_battery=20) == ['battery charging at 10%']
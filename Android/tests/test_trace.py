@@ -0,0 +1,47 @@
+import json
+import threading
+import pytest
+from utils.trace import Tracer
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span('install'):
+        pass
+    assert tracer.events == []
+
+
+def test_spans_of_every_thread_are_written(tmp_path):
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span('test', cycle=0, apk='a.apk'):
+        with tracer.span('install'):
+            pass
+
+    def device():
+        with tracer.span('install'):
+            pass
+    thread = threading.Thread(target=device, name='device-FAKE0002')
+    thread.start()
+    thread.join()
+    with pytest.raises(RuntimeError):
+        with tracer.span('am start'):
+            raise RuntimeError('device offline')
+
+    summary = tracer.summary()
+    assert summary[('phase', 'install')][0] == 2
+    assert summary[('phase', 'test')][0] == 1
+    failed = [event for event in tracer.events if event['name'] == 'am start'][0]
+    assert failed['args'] == {'error' : 'RuntimeError'}
+    assert 'install' in tracer.format_summary()
+
+    path = str(tmp_path / 'trace.json')
+    tracer.write(path)
+    with open(path) as in_f:
+        trace = json.load(in_f)
+    names = [event['args']['name'] for event in trace['traceEvents'] if event['ph'] == 'M']
+    assert sorted(names) == sorted([threading.current_thread().name, 'device-FAKE0002'])
+    spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    test_span = [event for event in spans if event['name'] == 'test'][0]
+    assert test_span['args'] == {'cycle' : 0, 'apk' : 'a.apk'}
+    assert all(event['dur'] >= 0 for event in spans)
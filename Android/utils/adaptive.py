@@ -0,0 +1,123 @@
+import math
+import queue
+import random
+import threading
+from utils.stats import summarize, parse_value
+
+MIN_RUNS = 5
+
+
+def ci_relative_width(summary):
+    if summary['n'] < 2 or summary.get('mean', 0) == 0:
+        return None
+    return (summary['ci_high'] - summary['ci_low']) / abs(summary['mean'])
+
+
+class AdaptiveTasks:
+    # Used in place of the task queue. Hands out (cycle, apk) cells round
+    # robin over the apks that still need runs, an apk leaves the rotation once
+    # the confidence interval of every metric it reports is narrower than
+    # target_width (relative to the mean) or it reached max_runs. In blocked
+    # order an apk keeps running until it is done, randomized-balanced picks
+    # randomly among the apks with the fewest runs.
+    # Phones differ too much to pool their results, so every device converges
+    # on its own: all the counts are kept per (device, apk) and a device gets
+    # its cells through for_device().
+    def __init__(self, apk_count, min_runs, max_runs, target_width, scene_parser=None,
+                 order='interleaved', seed=0):
+        if min_runs < MIN_RUNS:
+            print('--adaptive needs at least {0} runs per apk, using {0} instead of --run {1}'.format(
+                MIN_RUNS, min_runs))
+        self.min_runs = max(min_runs, MIN_RUNS)
+        self.max_runs = max(max_runs, self.min_runs)
+        self.target_width = target_width
+        self.scene_parser = scene_parser
+        self.apk_count = apk_count
+        # all keyed by (device, apk)
+        self.scheduled = {}
+        self.payloads = {}
+        self.completed = {}
+        self.converged = {}
+        self.order = order
+        self.seed = seed
+        self._rngs = {}
+        self._given_back = {}
+        self._lock = threading.Lock()
+
+    def for_device(self, device):
+        return AdaptiveDeviceTasks(self, device)
+
+    def get_nowait(self, device=None):
+        with self._lock:
+            given_back = self._given_back.get(device)
+            if given_back:
+                return given_back.pop(0)
+            candidates = [i for i in range(self.apk_count)
+                          if not self.converged.get((device, i), False) and
+                          self.scheduled.get((device, i), 0) < self.max_runs]
+            if len(candidates) == 0:
+                raise queue.Empty()
+            if self.order == 'blocked':
+                i_apk = candidates[0]
+            elif self.order == 'randomized-balanced':
+                fewest = min(self.scheduled.get((device, i), 0) for i in candidates)
+                rng = self._rngs.setdefault(device, random.Random(self.seed))
+                i_apk = rng.choice([i for i in candidates if self.scheduled.get((device, i), 0) == fewest])
+            else:
+                i_apk = min(candidates, key=lambda i: (self.scheduled.get((device, i), 0), i))
+            cycle = self.scheduled.get((device, i_apk), 0)
+            self.scheduled[(device, i_apk)] = cycle + 1
+            return cycle, i_apk
+
+    def put(self, task, device=None):
+        # a cell the device didn't finish, handed out to it again before any
+        # new one
+        with self._lock:
+            self._given_back.setdefault(device, []).append(task)
+
+    def add_completed(self, i_apk, result, device=None):
+        # a result of a resumed session, counts as scheduled and finished
+        with self._lock:
+            self.scheduled[(device, i_apk)] = self.scheduled.get((device, i_apk), 0) + 1
+        return self.add_result(i_apk, result, device)
+
+    def add_result(self, i_apk, result, device=None):
+        key = (device, i_apk)
+        scenes = self.scene_parser(result) if self.scene_parser is not None else None
+        if not scenes:
+            scenes = [(None, result)]
+        # a skipped or unparsable result has nothing to converge on, if kept it
+        # would start a group without values that never converges
+        scenes = [(scene_name, payload) for scene_name, payload in scenes
+                  if not math.isnan(parse_value(payload))]
+        with self._lock:
+            self.completed[key] = self.completed.get(key, 0) + 1
+            payloads = self.payloads.setdefault(key, {})
+            for scene_name, payload in scenes:
+                payloads.setdefault(scene_name, []).append(payload)
+            converged = self.converged.get(key, False)
+            if self.completed[key] < self.min_runs or converged:
+                return converged
+            # no outlier rejection, a dropped slow run must not make the
+            # interval look narrower than it is
+            widths = [ci_relative_width(summarize(values, reject_outliers=False))
+                      for values in payloads.values()]
+            if len(widths) > 0 and all(w is not None and w <= self.target_width for w in widths):
+                self.converged[key] = True
+                print(('' if device is None else str(device) + ' ') + 'Apk #' + str(i_apk) +
+                      ' converged after ' + str(self.completed[key]) +
+                      ' runs (CI width ' + ', '.join('{0:.2%}'.format(w) for w in widths) + ')')
+            return self.converged.get(key, False)
+
+
+class AdaptiveDeviceTasks:
+    # The cells of one device, what run_on_devices hands its worker
+    def __init__(self, tasks, device):
+        self.tasks = tasks
+        self.device = device
+
+    def get_nowait(self):
+        return self.tasks.get_nowait(self.device)
+
+    def put(self, task):
+        self.tasks.put(task, self.device)
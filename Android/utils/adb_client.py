@@ -0,0 +1,267 @@
+import os
+import socket
+import struct
+import threading
+import traceback
+from utils.command import call_program
+from utils.command import ProgramError
+from utils.trace import span
+
+DEFAULT_PORT = 5037
+
+# shell protocol v2 packet ids
+ID_STDOUT = 1
+ID_STDERR = 2
+ID_EXIT = 3
+ID_CLOSE_STDIN = 4
+
+# Only commands that run on the device are sent through the server socket,
+# everything else (install, pull, ...) still spawns adb.
+NATIVE_COMMANDS = ('shell', 'logcat', 'exec-out')
+# shell commands that must not run twice, the rest (getprop, dumpsys,
+# pm clear, sync, logcat -d, ...) are simply run again when a stream breaks
+NOT_IDEMPOTENT = ('am start', 'am startservice', 'am broadcast', 'input', 'pm install', 'monkey')
+
+
+class AdbError(Exception):
+    pass
+
+
+class AdbStreamError(AdbError):
+    # The device took the request and the connection broke afterwards, so
+    # the command may have run. Running it again could do it twice.
+    pass
+
+
+class AdbServiceError(AdbError):
+    # The device is there but refused the service, f.e. shell,v2 on a
+    # device older than Android 7
+    pass
+
+
+def encode_request(payload):
+    data = payload.encode('utf-8')
+    return '{0:04x}'.format(len(data)).encode('ascii') + data
+
+
+def read_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise AdbError('Connection closed by adb server')
+        data += chunk
+    return data
+
+
+def read_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+class AdbClient:
+    # Talks to the adb server over its local socket instead of forking an adb
+    # process per command. A service takes over its socket until the command
+    # exits, so the pool hands out a bounded number of short-lived connections
+    # rather than keeping sockets open between commands.
+    def __init__(self, host='127.0.0.1', port=None, timeout=5, max_connections=8):
+        if port is None:
+            port = int(os.environ.get('ANDROID_ADB_SERVER_PORT', DEFAULT_PORT))
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        # services like `logcat -d` or `sync` can take longer than connecting
+        sock.settimeout(None)
+        return sock
+
+    def _request(self, sock, payload):
+        sock.sendall(encode_request(payload))
+        status = read_exact(sock, 4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            size = int(read_exact(sock, 4), 16)
+            raise AdbError(read_exact(sock, size).decode('utf-8', errors='ignore'))
+        raise AdbError('Unexpected adb server response ' + repr(status))
+
+    def host_command(self, payload):
+        with self._slots:
+            sock = self._connect()
+            try:
+                self._request(sock, payload)
+                size = int(read_exact(sock, 4), 16)
+                return read_exact(sock, size)
+            finally:
+                sock.close()
+
+    def _open_service(self, serial, service):
+        sock = self._connect()
+        try:
+            if serial is None:
+                self._request(sock, 'host:transport-any')
+            else:
+                self._request(sock, 'host:transport:' + serial)
+            try:
+                self._request(sock, service)
+            except AdbError as e:
+                raise AdbServiceError(str(e)) from e
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def read_service(self, serial, service):
+        # everything a raw stream service sends until it closes
+        with self._slots:
+            sock = self._open_service(serial, service)
+            try:
+                return read_all(sock)
+            except OSError as e:
+                raise AdbStreamError(str(e)) from e
+            finally:
+                sock.close()
+
+    def exec_out(self, serial, command):
+        return self.read_service(serial, 'exec:' + command)
+
+    def shell_packets(self, serial, command):
+        # yields (packet id, data) as they arrive, the last one is ID_EXIT
+        with self._slots:
+            sock = self._open_service(serial, 'shell,v2,raw:' + command)
+            try:
+                sock.sendall(struct.pack('<BI', ID_CLOSE_STDIN, 0))
+                while True:
+                    packet_id, size = struct.unpack('<BI', read_exact(sock, 5))
+                    yield packet_id, read_exact(sock, size)
+                    if packet_id == ID_EXIT:
+                        return
+            except (OSError, AdbError) as e:
+                raise AdbStreamError(str(e)) from e
+            finally:
+                sock.close()
+
+    def shell(self, serial, command):
+        out = []
+        err = []
+        code = None
+        for packet_id, data in self.shell_packets(serial, command):
+            if packet_id == ID_STDOUT:
+                out.append(data)
+            elif packet_id == ID_STDERR:
+                err.append(data)
+            elif packet_id == ID_EXIT:
+                code = data[0]
+        return b''.join(out), b''.join(err), code
+
+
+_client = None
+_client_lock = threading.Lock()
+_client_enabled = True
+# serials (None for the only device) whose device has no shell protocol v2,
+# their shell commands spawn adb right away
+_no_shell_v2 = set()
+
+
+def set_client_enabled(enabled):
+    global _client_enabled
+    _client_enabled = enabled
+
+
+def get_client():
+    global _client
+    if not _client_enabled:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = AdbClient()
+        return _client
+
+
+def serial_from_adb_cmd(adb_cmd):
+    # returns (supported, serial), only plain `adb` and `adb -s <serial>`
+    # can be mapped onto a transport
+    options = adb_cmd[1:]
+    if len(options) == 0:
+        return True, None
+    if len(options) == 2 and options[0] == '-s':
+        return True, options[1]
+    return False, None
+
+
+def span_name(args):
+    # 'adb shell pm', 'adb install', ... groups the trace by what was run
+    name = 'adb ' + args[0]
+    if args[0] in ('shell', 'exec-out') and len(args) > 1:
+        name += ' ' + args[1].split()[0]
+    return name
+
+
+def is_idempotent(args):
+    if args[0] not in ('shell', 'exec-out'):
+        return True
+    command = ' '.join(args[1:])
+    return not any(command == prefix or command.startswith(prefix + ' ') for prefix in NOT_IDEMPOTENT)
+
+
+def call_adb(adb_cmd, args, check_returncode=True, **kwargs):
+    with span(span_name(args), 'adb', command=' '.join(args)):
+        return _call_adb(adb_cmd, args, check_returncode=check_returncode, **kwargs)
+
+
+def _call_adb(adb_cmd, args, check_returncode=True, rerun=None, **kwargs):
+    # rerun: whether the command may run again when the connection breaks
+    # after the device took it, by default all but NOT_IDEMPOTENT may
+    client = get_client()
+    supported, serial = serial_from_adb_cmd(adb_cmd)
+    if args[0] != 'exec-out' and serial in _no_shell_v2:
+        client = None
+    if client is not None and supported and args[0] in NATIVE_COMMANDS:
+        if args[0] in ('shell', 'exec-out'):
+            command = ' '.join(args[1:])
+        else:
+            command = ' '.join(args)
+        try:
+            with span('adb server', 'process'):
+                if args[0] == 'exec-out':
+                    # raw stream, binary safe but without an exit code
+                    out, code = client.exec_out(serial, command), 0
+                else:
+                    out, _, code = client.shell(serial, command)
+        except AdbStreamError:
+            # the device may have run it, only commands that can run twice
+            # go through adb again
+            if not (is_idempotent(args) if rerun is None else rerun):
+                raise
+        except AdbServiceError:
+            if args[0] != 'exec-out':
+                # no shell protocol v2, adb falls back to the old protocol
+                _no_shell_v2.add(serial)
+        except (OSError, AdbError):
+            # no server running yet, spawning adb below starts it
+            pass
+        else:
+            if check_returncode and code != 0:
+                raise ProgramError(adb_cmd + args, code)
+            return out
+    return call_program(adb_cmd + args, check_returncode=check_returncode, **kwargs)
+
+
+def retry_call_adb(adb_cmd, args, retry_count, **kwargs):
+    exc = None
+    for retry in range(retry_count):
+        try:
+            with span(span_name(args), 'adb', command=' '.join(args), attempt=retry + 1):
+                return _call_adb(adb_cmd, args, **kwargs)
+        except ProgramError as e:
+            exc = e
+            traceback.print_exc()
+            print('Got exception while running command, retrying...')
+    raise exc
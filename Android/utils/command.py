@@ -5,6 +5,7 @@ import time
 import signal
 import subprocess
 import traceback
+from utils.trace import span
 
 
 def wait_for_process_exit(pr, timeout):
@@ -63,7 +64,8 @@ def retry_call_program(args, retry_count, **kwargs):
     exc = None
     for retry in range(retry_count):
         try:
-            return call_program(args, **kwargs)
+            with span('retry ' + os.path.basename(args[0]), 'retry', attempt=retry + 1):
+                return call_program(args, **kwargs)
         except ProgramError as e:
             exc = e
             traceback.print_exc()
@@ -80,7 +82,8 @@ class ProgramError(Exception):
 
 
 def call_program(args, stdin=None, cwd=None, check_returncode=True):
-    out, _, code = call_program_with_code(args, stdin=stdin, cwd=cwd)
+    with span(os.path.basename(args[0]), 'process'):
+        out, _, code = call_program_with_code(args, stdin=stdin, cwd=cwd)
     #print(out)
     if check_returncode and code != 0:
         raise ProgramError(args, code)
@@ -0,0 +1,148 @@
+import queue
+import threading
+import traceback
+from utils.adb_client import AdbError
+from utils.adb_client import get_client
+from utils.command import ProgramError, call_program
+
+
+def parse_adb_devices(out):
+    devices = []
+    for line in out.splitlines():
+        fields = line.split()
+        # skip the "List of devices attached" header and offline/unauthorized entries
+        if len(fields) < 2 or fields[1] != 'device':
+            continue
+        devices.append(fields[0])
+    return devices
+
+
+def list_devices(adb_path):
+    client = get_client()
+    out = None
+    if client is not None:
+        try:
+            out = client.host_command('host:devices')
+        except (OSError, AdbError):
+            pass
+    if out is None:
+        out = call_program([adb_path, 'devices'])
+    return parse_adb_devices(out.decode('utf-8', errors='ignore'))
+
+
+def default_serial(adb_path):
+    # transport serial of the device adb talks to without -s, to name its
+    # results. None unless exactly one device is attached.
+    try:
+        devices = list_devices(adb_path)
+    except (OSError, ProgramError):
+        return None
+    return devices[0] if len(devices) == 1 else None
+
+
+def resolve_devices(adb_path, spec):
+    if spec == 'all':
+        devices = list_devices(adb_path)
+    else:
+        devices = [serial.strip() for serial in spec.split(',') if serial.strip()]
+    if len(devices) == 0:
+        raise Exception('No devices found for --devices ' + spec)
+    return devices
+
+
+def build_task_matrix(run_count, apk_count):
+    return [(cycle, i_apk) for cycle in range(run_count)
+            for i_apk in range(apk_count)]
+
+
+def remaining_tasks(tasks, completed):
+    # cells of a resumed session that did not finish yet
+    return [task for task in tasks if task not in completed]
+
+
+def next_task(task_queue):
+    try:
+        return task_queue.get_nowait()
+    except queue.Empty:
+        return None
+
+
+def make_task_queue(tasks):
+    task_queue = queue.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    return task_queue
+
+
+class DeviceTasks:
+    # The task queue as one device sees it. Remembers the cell the device is
+    # on and, in `results`, what the worker finished so far, so neither is
+    # lost when the device fails halfway.
+    def __init__(self, task_queue, requeued, lock):
+        self.task_queue = task_queue
+        self.current = None
+        self.results = None
+        self._requeued = requeued
+        self._lock = lock
+
+    def get_nowait(self):
+        self.current = None
+        task = self.task_queue.get_nowait()
+        with self._lock:
+            if task in self._requeued:
+                self._requeued.remove(task)
+        self.current = task
+        return task
+
+    def give_back(self):
+        # the cell goes back to the devices that are still running
+        if self.current is None:
+            return
+        with self._lock:
+            self._requeued.append(self.current)
+        self.task_queue.put(self.current)
+        self.current = None
+
+
+def run_on_devices(devices, task_queue, worker):
+    # Every device gets its own thread, all of them pull (cycle, apk) cells
+    # from the same queue so a slow phone simply ends up running fewer cells.
+    # Anything with get_nowait() raising queue.Empty and put() works as the
+    # queue. A queue with for_device(device_id) gives every device cells of
+    # its own instead (AdaptiveTasks). A worker that wants to keep its results
+    # when it fails sets them as `results` of the DeviceTasks it gets.
+    results = {}
+    requeued = []
+    lock = threading.Lock()
+
+    def run(device_id):
+        if hasattr(task_queue, 'for_device'):
+            tasks = DeviceTasks(task_queue.for_device(device_id), requeued, lock)
+        else:
+            tasks = DeviceTasks(task_queue, requeued, lock)
+        try:
+            results[device_id] = worker(device_id, tasks)
+        except Exception:
+            traceback.print_exc()
+            print('Device', device_id, 'stopped because of an error')
+            if tasks.current is not None:
+                print('Device', device_id, 'gives cycle {0} apk #{1} back to the other devices'.format(*tasks.current))
+            tasks.give_back()
+            if tasks.results is not None:
+                results[device_id] = tasks.results
+
+    if len(devices) == 1:
+        run(devices[0])
+    else:
+        threads = []
+        for device_id in devices:
+            thread = threading.Thread(target=run, args=(device_id,),
+                                      name='device-' + str(device_id))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    # given back after every other device had finished
+    for cycle, i_apk in requeued:
+        print('Cycle {0} apk #{1} was not run, its device failed'.format(cycle, i_apk))
+    return results
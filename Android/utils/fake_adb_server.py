@@ -0,0 +1,133 @@
+import select
+import socketserver
+import struct
+import threading
+from utils.adb_client import ID_STDOUT, ID_STDERR, ID_EXIT, AdbError, encode_request, read_exact
+from utils.fake_device import FakeDevice, FakeConfig, parse_logcat_args
+
+# not a real adb service, fake_adb.py uses it for `adb install`
+INSTALL_SERVICE = 'fake-install:'
+
+
+def okay(sock, payload=None):
+    sock.sendall(b'OKAY')
+    if payload is not None:
+        sock.sendall(encode_request(payload))
+
+
+def fail(sock, message):
+    sock.sendall(b'FAIL' + encode_request(message))
+
+
+def read_request(sock):
+    size = int(read_exact(sock, 4), 16)
+    return read_exact(sock, size).decode('utf-8')
+
+
+def packet(packet_id, data):
+    return struct.pack('<BI', packet_id, len(data)) + data
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        device = None
+        try:
+            while True:
+                request = read_request(sock)
+                if request == 'host:devices' or request == 'host:devices-l':
+                    okay(sock, ''.join(serial + '\tdevice\n' for serial in self.server.devices))
+                    return
+                if request == 'host:version':
+                    okay(sock, '0029')
+                    return
+                if request == 'host:transport-any':
+                    if len(self.server.devices) != 1:
+                        fail(sock, 'more than one device/emulator' if self.server.devices else 'no devices/emulators found')
+                        return
+                    device = list(self.server.devices.values())[0]
+                    okay(sock)
+                    continue
+                if request.startswith('host:transport:'):
+                    device = self.server.devices.get(request[len('host:transport:'):])
+                    if device is None:
+                        fail(sock, "device '" + request[len('host:transport:'):] + "' not found")
+                        return
+                    okay(sock)
+                    continue
+                if device is None:
+                    fail(sock, 'unknown host service')
+                    return
+                self.device_service(sock, device, request)
+                return
+        except (OSError, ValueError, AdbError):
+            pass
+
+    def device_service(self, sock, device, request):
+        if request.startswith('shell,v2,raw:'):
+            okay(sock)
+            self.shell_v2(sock, device, request[len('shell,v2,raw:'):])
+        elif request.startswith('shell:') or request.startswith('exec:'):
+            okay(sock)
+            out, _ = device.shell(request.split(':', 1)[1])
+            sock.sendall(out)
+        elif request.startswith(INSTALL_SERVICE):
+            okay(sock)
+            sock.sendall(device.install(request[len(INSTALL_SERVICE):]).encode('utf-8'))
+        else:
+            fail(sock, 'unknown service ' + request)
+
+    def shell_v2(self, sock, device, command):
+        argv = command.split()
+        if argv[:1] == ['logcat'] and parse_logcat_args(argv[1:])['stream']:
+            # streams until the client hangs up
+            closed = threading.Event()
+
+            def write(data):
+                try:
+                    sock.sendall(packet(ID_STDOUT, data))
+                except OSError:
+                    closed.set()
+
+            def stopped():
+                # the client only ever sends close stdin, anything else is a hang up
+                if not closed.is_set() and select.select([sock], [], [], 0)[0]:
+                    try:
+                        if not sock.recv(64):
+                            closed.set()
+                    except OSError:
+                        closed.set()
+                return closed.is_set()
+            device.follow_log(parse_logcat_args(argv[1:]), write, stopped)
+            return
+        out, code = device.shell(command)
+        if code == 127:
+            sock.sendall(packet(ID_STDERR, out))
+        else:
+            sock.sendall(packet(ID_STDOUT, out))
+        sock.sendall(packet(ID_EXIT, bytes([code])))
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    # Speaks the adb host protocol for a set of simulated devices, so both
+    # the runners' adb client and fake_adb.py talk to it like to adb.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, serials, config=None, port=0):
+        super().__init__(('127.0.0.1', port), FakeAdbHandler)
+        config = config or FakeConfig()
+        self.devices = dict((serial, FakeDevice(serial, config)) for serial in serials)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True, name='fake-adb-server')
+        thread.start()
+        return self
+
+
+def fake_serials(count):
+    return ['FAKE{0:04d}'.format(i + 1) for i in range(count)]
@@ -0,0 +1,560 @@
+import collections
+import datetime
+import fnmatch
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import shlex
+import struct
+import threading
+import time
+import zlib
+
+ACTIVITY = 'com.unity3d.player.UnityPlayerActivity'
+FRAME_PERIOD_NS = 16666667
+CPU_COUNT = 8
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 2340
+
+_PIDOF = re.compile(r'\$\(pidof(?: -s)? ([^)\s]+)\)')
+
+
+@functools.lru_cache(maxsize=32)
+def solid_png(width, height, color):
+    # an RGBA png like `screencap -p` sends, one color is enough for a fake
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    row = b'\x00' + bytes(color + (255,)) * width
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * height, 6)) +
+            chunk(b'IEND', b''))
+
+
+def format_logcat_line(stamp, pid, priority, tag, message, epoch=False):
+    # `logcat -v threadtime`, the default format, or `-v epoch`
+    if epoch:
+        millis = int(stamp * 1000)
+        return '{0:>14} {1:5d} {2:5d} {3} {4:<8}: {5}\n'.format(
+            '{0}.{1:03d}'.format(millis // 1000, millis % 1000), pid, pid, priority, tag, message)
+    moment = datetime.datetime.fromtimestamp(stamp)
+    return '{0}.{1:03d} {2:5d} {3:5d} {4} {5:<8}: {6}\n'.format(
+        moment.strftime('%m-%d %H:%M:%S'), moment.microsecond // 1000,
+        pid, pid, priority, tag, message)
+
+
+# text is the free form "ZZRES>>16.5", json and key=value log structured
+# results (utils/metrics.py) with several metrics per scene
+RESULT_FORMATS = ['text', 'json', 'key=value']
+
+
+class FakeConfig:
+    # How the simulated devices behave, every time is in seconds
+    def __init__(self, run_time=2.0, fail_rate=0.0, scenes=0, chatter=200,
+                 install_mb_per_s=40.0, install_overhead=1.0, log_lines=200000, seed=0,
+                 result_format='text', sdk=30):
+        self.run_time = run_time
+        self.fail_rate = fail_rate
+        # 0 logs a plain "ZZRES>>16.5", otherwise that many scene results
+        self.scenes = scenes
+        # engine log lines per second while the app runs
+        self.chatter = chatter
+        self.install_mb_per_s = install_mb_per_s
+        self.install_overhead = install_overhead
+        self.log_lines = log_lines
+        self.seed = seed
+        self.result_format = result_format
+        # below 24 logcat knows neither -v epoch nor -t <time> and, like the
+        # legacy shell, still exits with 0
+        self.sdk = sdk
+
+
+def package_of(apk_path):
+    # fake apks start with "package=<name>", anything else is the default
+    try:
+        with open(apk_path, 'rb') as apk_file:
+            head = apk_file.read(256)
+    except OSError:
+        return None
+    if head.startswith(b'package='):
+        return head.split(b'\n', 1)[0][len(b'package='):].decode('ascii')
+    return 'com.unity.fake'
+
+
+def apk_baseline(apk_path):
+    # every apk gets its own "performance", f.e. 16-20ms frame time
+    digest = hashlib.sha1(os.path.basename(apk_path).encode('utf-8')).digest()
+    return 16.0 + digest[0] / 64.0
+
+
+class FakeApp:
+    # A running Unity player, logs its start up, engine chatter and after
+    # run_time the ZZRES>> result unless it was picked to fail.
+    def __init__(self, device, package, apk_path, pid):
+        self.device = device
+        self.package = package
+        self.apk_path = apk_path
+        self.pid = pid
+        # Android 12+ gives the layers of every launch a new #id
+        self.layer_id = pid % 10000
+        self.layer = 'SurfaceView[{0}/{1}](BLAST)#{2}'.format(package, ACTIVITY, self.layer_id)
+        self.started = time.time()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='fake-app-' + device.serial)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def result(self):
+        rng = self.device.rng
+        baseline = apk_baseline(self.apk_path)
+        scenes = self.device.config.scenes
+        if self.device.config.result_format != 'text':
+            return self.structured_results(rng, baseline, max(scenes, 1))
+        if scenes == 0:
+            return '{0:.3f}'.format(rng.gauss(baseline, 0.3))
+        return ' ---- '.join('Scene name: Test_{0:02d} | Frame time: {1:.3f}ms'.format(
+            i + 1, rng.gauss(baseline + i, 0.3)) for i in range(scenes))
+
+    def structured_results(self, rng, baseline, scenes):
+        # one line per scene, json ends with an end record and key=value
+        # leaves it to the quiet period
+        lines = []
+        for i in range(scenes):
+            metrics = [('frame_time_ms', round(rng.gauss(baseline + i, 0.3), 3)),
+                       ('load_time_ms', int(rng.gauss(800 + 50 * i, 20))),
+                       ('memory_mb', round(rng.gauss(512 + 8 * i, 2), 1))]
+            scene = 'Test_{0:02d}'.format(i + 1)
+            if self.device.config.result_format == 'json':
+                lines.append(json.dumps(dict([('scene', scene)] + metrics)))
+            else:
+                lines.append(' '.join(['scene=' + scene] + ['{0}={1}'.format(k, v) for k, v in metrics]))
+        if self.device.config.result_format == 'json':
+            lines.append(json.dumps({'end' : True}))
+        return lines
+
+    def _run(self):
+        log = self.device.log_line
+        config = self.device.config
+        log('I', 'ActivityManager', 'Start proc ' + str(self.pid) + ':' + self.package +
+            '/u0a123 for activity ' + self.package + '/' + ACTIVITY, pid=1000)
+        log('I', 'Unity', 'SystemInfo CPU = ARM64 FP ASIMD AES, Cores = 8, Memory = 7680mb', self.pid)
+        log('I', 'Unity', "Built from '2020.3/staging' branch, Version '2020.3.1f1 (77a89f25062f)', "
+            "Build type 'Release', Scripting Backend 'il2cpp', CPU 'arm64-v8a', Stripping 'Disabled'",
+            self.pid)
+        log('I', 'Unity', 'Vulkan API version 1.1.128', self.pid)
+        log('I', 'Unity', 'Graphics API = Vulkan', self.pid)
+        log('I', 'Unity', 'APP_STARTED', self.pid)
+        fails = self.device.rng.random() < config.fail_rate
+        result_at = self.started + config.run_time
+        interval = 1.0 / config.chatter if config.chatter > 0 else 0.1
+        frame = 0
+        while not self.stop_event.wait(interval):
+            frame += 1
+            if config.chatter > 0:
+                log('D', 'Unity', 'Frame ' + str(frame) + ' gfx jobs done, batches 412, tris 183224', self.pid)
+            if result_at is not None and time.time() >= result_at:
+                result_at = None
+                if not fails:
+                    result = self.result()
+                    for line in result if isinstance(result, list) else [result]:
+                        log('I', 'Unity', 'ZZRES>>' + line, self.pid)
+
+    def frame_presents(self, count):
+        # present times of the last `count` frames, every 100th one janks
+        now = time.monotonic_ns()
+        start = now - int((time.time() - self.started) * 1e9)
+        presents = []
+        t = start
+        i = 0
+        while t < now:
+            t += FRAME_PERIOD_NS * (2 if i % 100 == 99 else 1)
+            presents.append(t)
+            i += 1
+        return presents[-count:]
+
+
+class FakeDevice:
+    # One simulated phone. Commands arrive as the shell command line adb
+    # would run on the device and answer with (stdout bytes, exit code).
+    def __init__(self, serial, config):
+        self.serial = serial
+        self.config = config
+        self.rng = random.Random('{0}-{1}'.format(config.seed, serial))
+        self.lock = threading.Condition()
+        # (time, pid, priority, tag, message), `seq` counts every line ever logged
+        self.log = collections.deque(maxlen=config.log_lines)
+        self.seq = 0
+        self.packages = {}
+        self.files = {}
+        self.app = None
+        self.next_pid = 12000
+        self.install_count = 0
+        self.app_seconds = 0.0
+        self.props = {
+            'ro.boot.serialno' : serial,
+            'ro.serialno' : serial,
+            'ro.product.model' : 'Fake ' + serial,
+            'ro.product.manufacturer' : 'Unity',
+            'ro.build.version.release' : '11',
+            'ro.build.version.sdk' : str(config.sdk),
+            'ro.product.cpu.abi' : 'arm64-v8a',
+            'ro.product.cpu.abilist' : 'arm64-v8a,armeabi-v7a,armeabi',
+            'ro.product.device' : 'fake',
+            'ro.build.fingerprint' : 'Unity/fake/fake:11/RQ3A.211001.001/1:user/release-keys',
+            'ro.soc.manufacturer' : 'Qualcomm',
+            'ro.soc.model' : 'SM8150',
+            'ro.board.platform' : 'msmnile',
+            'ro.hardware' : 'qcom',
+            'ro.hardware.egl' : 'adreno',
+        }
+        for cpu in range(CPU_COUNT):
+            self.files['/sys/devices/system/cpu/cpu{0}/cpufreq/scaling_cur_freq'.format(cpu)] = \
+                str(1804800 if cpu < 4 else 2419200)
+        self.booted = time.time()
+
+    # log
+
+    def log_line(self, priority, tag, message, pid=1000):
+        with self.lock:
+            self.log.append((time.time(), pid, priority, tag, message))
+            self.seq += 1
+            self.lock.notify_all()
+
+    def format_line(self, entry, epoch=False):
+        return format_logcat_line(*entry, epoch=epoch)
+
+    def log_entries(self, tags=None, since=None, tail=None):
+        with self.lock:
+            entries = list(self.log)
+        if tags:
+            entries = [entry for entry in entries if entry[3] in tags]
+        if since is not None:
+            entries = [entry for entry in entries if entry[0] >= since]
+        if tail is not None:
+            entries = entries[-tail:] if tail > 0 else []
+        return entries
+
+    def follow_log(self, options, write, stopped):
+        # the stream starts with the current buffer like `adb logcat` does,
+        # or the part of it picked with -T
+        tags = options['tags']
+        epoch = options['epoch']
+        with self.lock:
+            seq = self.seq
+            entries = self.log_entries(tags, options['since'], options['tail'])
+        for entry in entries:
+            write(self.format_line(entry, epoch).encode('utf-8'))
+        while not stopped():
+            with self.lock:
+                self.lock.wait(0.5)
+                new = min(self.seq - seq, len(self.log))
+                entries = [self.log[i] for i in range(len(self.log) - new, len(self.log))]
+                seq = self.seq
+            for entry in entries:
+                if not tags or entry[3] in tags:
+                    write(self.format_line(entry, epoch).encode('utf-8'))
+
+    # package manager / activity manager
+
+    def install(self, apk_path):
+        size = os.path.getsize(apk_path)
+        time.sleep(self.config.install_overhead + size / 1e6 / self.config.install_mb_per_s)
+        package = package_of(apk_path)
+        with self.lock:
+            self.install_count += 1
+            path = '/data/app/{0}-{1}/base.apk'.format(package, self.install_count)
+            self.packages[package] = (path, os.path.abspath(apk_path))
+        self.log_line('I', 'PackageManager', 'Installed ' + package + ' at ' + path)
+        return 'Performing Streamed Install\nSuccess\n'
+
+    def stop_app(self, package):
+        with self.lock:
+            app = self.app
+            if app is None or app.package != package:
+                return
+            self.app = None
+            self.app_seconds += time.time() - app.started
+        app.stop()
+        self.log_line('I', 'ActivityManager', 'Force stopping ' + package)
+
+    def start_app(self, component):
+        package = component.split('/')[0]
+        if package not in self.packages:
+            return 'Error: Activity class {' + component + '} does not exist.\n', 1
+        self.stop_app(package)
+        with self.lock:
+            self.next_pid += 1
+            app = FakeApp(self, package, self.packages[package][1], self.next_pid)
+            self.app = app
+        app.start()
+        return 'Starting: Intent { cmp=' + component + ' }\n', 0
+
+    def running_pid(self, package):
+        app = self.app
+        if app is not None and app.package == package:
+            return str(app.pid)
+        return ''
+
+    # state files
+
+    def battery_level(self):
+        with self.lock:
+            seconds = self.app_seconds
+            if self.app is not None:
+                seconds += time.time() - self.app.started
+        return max(100 - int(seconds / 120), 15)
+
+    def dumpsys(self, args):
+        service = args[0] if args else ''
+        if service == 'battery':
+            running = self.app is not None
+            return ('Current Battery Service state:\n  AC powered: false\n  USB powered: true\n'
+                    '  Wireless powered: false\n  status: 2\n  health: 2\n  present: true\n'
+                    '  level: {0}\n  scale: 100\n  voltage: 4200\n  temperature: {1}\n'
+                    '  technology: Li-ion\n').format(self.battery_level(), 330 if running else 300)
+        if service == 'thermalservice':
+            return ('IsStatusOverride: false\nThermal Status: 0\nCurrent temperatures from HAL:\n'
+                    '\tTemperature{mValue=38.5, mType=0, mName=cpu0, mStatus=0}\n'
+                    '\tTemperature{mValue=33.0, mType=2, mName=battery, mStatus=0}\n'
+                    '\tTemperature{mValue=31.2, mType=3, mName=skin, mStatus=0}\n')
+        if service == 'SurfaceFlinger':
+            app = self.app
+            if '--list' in args:
+                layers = 'StatusBar#0\nNavigationBar0#0\n'
+                if app is not None:
+                    layers += '{0}/{1}#{2}\n{3}\n'.format(app.package, ACTIVITY, app.layer_id - 1, app.layer)
+                return layers
+            if '--latency' in args:
+                lines = [str(FRAME_PERIOD_NS)]
+                # the layer of an earlier launch is gone, like on a real device
+                if app is not None and args[-1] == app.layer:
+                    for present in app.frame_presents(127):
+                        lines.append('{0}\t{1}\t{2}'.format(present - FRAME_PERIOD_NS, present, present))
+                return '\n'.join(lines) + '\n'
+            return ('Display 0 HWC layers:\n'
+                    'GLES: Qualcomm, Adreno (TM) 640, OpenGL ES 3.2 V@0502.0 (GIT@191610ae03, Ic907de5ed0)\n'
+                    '+  DisplayDevice{{0, internal, primary}}\n'
+                    '   refresh-rate              : {0:f} fps\n').format(1e9 / FRAME_PERIOD_NS)
+        if service == 'gfxinfo':
+            # Unity draws into a SurfaceView, hwui has no frames of its own
+            return 'Applications Graphics Acceleration Info:\n---PROFILEDATA---\n---PROFILEDATA---\n'
+        return ''
+
+    def read_file(self, path):
+        if path in self.files:
+            return self.files[path]
+        if path == '/proc/stat':
+            uptime = time.time() - self.booted
+            busy = int(self.app_seconds * 300 + uptime * 20)
+            if self.app is not None:
+                busy += int((time.time() - self.app.started) * 300)
+            return 'cpu  {0} 0 {1} {2} 10 0 5 0 0 0\n'.format(busy, busy // 4, int(uptime * 800))
+        m = re.match(r'/proc/(\d+)/status$', path)
+        if m is not None and self.app is not None and m.group(1) == str(self.app.pid):
+            return 'Name:\t{0}\nVmRSS:\t  412345 kB\nThreads:\t87\n'.format(self.app.package[-15:])
+        if path == '/proc/meminfo':
+            return 'MemTotal:        7654312 kB\nMemFree:          812340 kB\n'
+        return None
+
+    def screen_png(self):
+        # the launcher without an app, the same splash screen for every app
+        # during its first second and then a color of its own
+        app = self.app
+        if app is None:
+            color = (0, 0, 0)
+        elif time.time() - app.started < 1.0:
+            color = (34, 44, 54)
+        else:
+            color = tuple(hashlib.md5(app.apk_path.encode('utf-8')).digest()[:3])
+        return solid_png(SCREEN_WIDTH, SCREEN_HEIGHT, color)
+
+    # shell
+
+    def shell(self, command):
+        # -> (stdout, exit code), runs `a ; b && c | grep x > file` style lines
+        command = _PIDOF.sub(lambda m: self.running_pid(m.group(1)), command)
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=';|&<>')
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError:
+            return b'/system/bin/sh: syntax error\n', 2
+        out = []
+        code = 0
+        segment = []
+        for token in tokens + [';']:
+            if token in (';', '&&', '||'):
+                if segment:
+                    text, code = self.run_pipeline(segment)
+                    out.append(text)
+                segment = []
+                if token == '&&' and code != 0:
+                    break
+            else:
+                segment.append(token)
+        # screencap -p writes a binary png
+        return b''.join(part if isinstance(part, bytes) else part.encode('utf-8') for part in out), code
+
+    def run_pipeline(self, tokens):
+        redirect = None
+        stages = [[]]
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token == '|':
+                stages.append([])
+            elif token in ('>', '>>'):
+                target = tokens[i + 1] if i + 1 < len(tokens) else None
+                if stages[-1] and stages[-1][-1] == '2':
+                    stages[-1].pop()
+                else:
+                    redirect = target
+                i += 1
+            else:
+                stages[-1].append(token)
+            i += 1
+        text, code = self.run_command(stages[0])
+        for stage in stages[1:]:
+            if stage and stage[0] == 'grep':
+                patterns = [stage[k + 1] for k in range(len(stage) - 1) if stage[k] == '-e'] or [stage[-1]]
+                lines = [line + '\n' for line in text.splitlines() if any(p in line for p in patterns)]
+                text, code = ''.join(lines), 0 if lines else 1
+        if redirect is not None:
+            self.files[redirect] = text
+            return '', code
+        return text, code
+
+    def run_command(self, argv):
+        if not argv:
+            return '', 0
+        name, args = argv[0], argv[1:]
+        if name == 'getprop':
+            if args:
+                return self.props.get(args[0], '') + '\n', 0
+            return ''.join('[{0}]: [{1}]\n'.format(k, v) for k, v in self.props.items()), 0
+        if name == 'dumpsys':
+            return self.dumpsys(args), 0
+        if name == 'echo':
+            return ' '.join(args) + '\n', 0
+        if name == 'cat':
+            out = []
+            code = 0
+            for pattern in args:
+                paths = sorted(path for path in self.files if fnmatch.fnmatch(path, pattern)) \
+                    if '*' in pattern else [pattern]
+                for path in paths:
+                    content = self.read_file(path)
+                    if content is None:
+                        code = 1
+                    else:
+                        out.append(content if content.endswith('\n') else content + '\n')
+            return ''.join(out), code
+        if name == 'head':
+            count = int(args[args.index('-n') + 1]) if '-n' in args else 10
+            content = self.read_file(args[-1]) if args else None
+            if content is None:
+                return '', 1
+            return ''.join(content.splitlines(True)[:count]), 0
+        if name == 'rm':
+            for path in args:
+                self.files.pop(path, None)
+            return '', 0
+        if name == 'pm':
+            sub = args[0] if args else ''
+            package = args[-1] if len(args) > 1 else ''
+            if sub == 'clear':
+                self.stop_app(package)
+                return 'Success\n', 0
+            if sub == 'path':
+                if package in self.packages:
+                    return 'package:' + self.packages[package][0] + '\n', 0
+                return '', 1
+            if sub == 'uninstall':
+                self.stop_app(package)
+                return ('Success\n', 0) if self.packages.pop(package, None) else ('Failure [DELETE_FAILED_INTERNAL_ERROR]\n', 1)
+            if sub == 'list':
+                return ''.join('package:' + p + '\n' for p in self.packages), 0
+            return '', 0
+        if name == 'am':
+            if args[:1] == ['start'] and '-n' in args:
+                return self.start_app(args[args.index('-n') + 1])
+            if args[:1] == ['force-stop'] and len(args) > 1:
+                self.stop_app(args[1])
+            return '', 0
+        if name == 'pidof':
+            pid = self.running_pid(args[-1]) if args else ''
+            return (pid + '\n', 0) if pid else ('', 1)
+        if name == 'logcat':
+            return self.logcat(args)
+        if name == 'screencap':
+            if args and not args[-1].startswith('-'):
+                return '', 0
+            return self.screen_png(), 0
+        if name == 'wm':
+            if args[:1] == ['size']:
+                return 'Physical size: {0}x{1}\n'.format(SCREEN_WIDTH, SCREEN_HEIGHT), 0
+            if args[:1] == ['density']:
+                return 'Physical density: 440\n', 0
+            return '', 0
+        if name in ('sync', 'input', 'for', 'do', 'done', '[', 'sleep', 'settings', 'true'):
+            return '', 0
+        return '/system/bin/sh: ' + name + ': inaccessible or not found\n', 127
+
+    def logcat(self, args):
+        # only the non streaming forms, streams are handled by the server
+        options = parse_logcat_args(args)
+        if options['clear']:
+            with self.lock:
+                self.log.clear()
+            return '', 0
+        if self.config.sdk < 24 and (options['epoch'] or options['since'] is not None):
+            return ('Unrecognized Option\nUsage: logcat [options] [filterspecs]\n'
+                    'options include:\n  -s              Set default filter to silent.\n'), 0
+        if options['dump']:
+            entries = self.log_entries(options['tags'], options['since'], options['tail'])
+            return ''.join(self.format_line(entry, options['epoch']) for entry in entries), 0
+        return '', 0
+
+
+def parse_logcat_args(args):
+    options = {'dump' : False, 'clear' : False, 'tags' : [], 'stream' : True,
+               'epoch' : False, 'since' : None, 'tail' : None}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-d':
+            options['dump'] = True
+        elif arg == '-c':
+            options['clear'] = True
+        elif arg in ('-t', '-T') and i + 1 < len(args):
+            # a count of lines or, in the epoch format, a time
+            i += 1
+            if args[i].isdigit():
+                options['tail'] = int(args[i])
+            else:
+                options['since'] = float(args[i])
+            if arg == '-t':
+                options['dump'] = True
+        elif arg in ('-G', '-v', '-b'):
+            i += 1
+            if arg == '-G':
+                options['stream'] = False
+            if arg == '-v' and i < len(args) and args[i] == 'epoch':
+                options['epoch'] = True
+        elif arg == '-s':
+            pass
+        elif not arg.startswith('-'):
+            options['tags'].append(arg.split(':')[0])
+        i += 1
+    if options['dump'] or options['clear']:
+        options['stream'] = False
+    return options
@@ -0,0 +1,126 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+
+class FakeElasticHandler(http.server.BaseHTTPRequestHandler):
+    def do_PUT(self):
+        # index creation
+        self.server.requests += 1
+        self.read_body()
+        if not self.server.online:
+            self.reply(503, {'error' : {'type' : 'unavailable_shards_exception'}, 'status' : 503})
+        else:
+            self.reply(200, {'acknowledged' : True})
+
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        body = self.read_body()
+        path = urllib.parse.urlparse(self.path).path.strip('/').split('/')
+        if not server.online:
+            self.reply(503, {'error' : {'type' : 'unavailable_shards_exception'}, 'status' : 503})
+        elif len(path) != 2 or path[1] != '_bulk':
+            self.reply(404, {'error' : {'type' : 'not_found'}, 'status' : 404})
+        elif server.max_body is not None and len(body) > server.max_body:
+            self.reply(413, {'error' : {'type' : 'request_entity_too_large'}, 'status' : 413})
+        else:
+            try:
+                items = server.bulk(path[0], body)
+            except ValueError as e:
+                self.reply(400, {'error' : {'type' : 'parse_exception', 'reason' : str(e)}, 'status' : 400})
+                return
+            self.reply(200, {'took' : 1, 'items' : items,
+                             'errors' : any('error' in item[action] for item in items for action in item)})
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_script(source, params, doc):
+    # the few painless scripts BulkSink sends
+    if 'error_log.add' in source:
+        doc.setdefault('error_log', []).append(params['value'])
+    elif 'data.add' in source:
+        doc.setdefault('data', []).append(params['value'])
+    elif 'metrics' in source:
+        doc.setdefault('metrics', {}).setdefault(params['metric'], []).append(params['value'])
+    else:
+        raise ValueError('unknown script ' + source)
+
+
+class FakeElasticServer(http.server.ThreadingHTTPServer):
+    # Answers _bulk update requests like Elasticsearch and keeps the
+    # documents in `docs` ({(index, id): source}). Ids in `reject_ids` fail
+    # as single items of an otherwise accepted bulk, ids in `busy_ids` are
+    # pushed back with a 429 once. Bodies over `max_body` bytes get a 413,
+    # `online = False` makes every request fail like an outage and
+    # `requests` counts them.
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), FakeElasticHandler)
+        self.docs = {}
+        self.reject_ids = set()
+        self.busy_ids = set()
+        self.max_body = None
+        self.online = True
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def bulk(self, index, body):
+        lines = [json.loads(line) for line in body.split('\n') if line.strip()]
+        items = []
+        with self._lock:
+            for i in range(0, len(lines), 2):
+                action = lines[i].get('update')
+                if action is None or i + 1 >= len(lines):
+                    raise ValueError('only update actions with a body are supported')
+                items.append({'update' : self.update(index, action['_id'], lines[i + 1])})
+        return items
+
+    def update(self, index, doc_id, request):
+        item = {'_index' : index, '_id' : doc_id}
+        if doc_id in self.busy_ids:
+            self.busy_ids.discard(doc_id)
+            return dict(item, status=429, error={'type' : 'es_rejected_execution_exception',
+                                                 'reason' : 'rejected execution, queue capacity 200'})
+        if doc_id in self.reject_ids:
+            return dict(item, status=400, error={'type' : 'mapper_parsing_exception',
+                                                 'reason' : 'failed to parse field [data]'})
+        doc = self.docs.get((index, doc_id))
+        created = doc is None
+        if created:
+            if 'upsert' not in request:
+                return dict(item, status=404, error={'type' : 'document_missing_exception',
+                                                     'reason' : '[{0}]: document missing'.format(doc_id)})
+            doc = json.loads(json.dumps(request['upsert']))
+        script = request['script']
+        run_script(script['source'], script['params'], doc)
+        self.docs[(index, doc_id)] = doc
+        return dict(item, status=201 if created else 200, result='created' if created else 'updated')
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True, name='fake-es-server')
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
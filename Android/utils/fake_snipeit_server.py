@@ -0,0 +1,68 @@
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+
+class FakeSnipeItHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.delay > 0:
+            time.sleep(server.delay)
+        url = urllib.parse.urlparse(self.path)
+        if not server.online:
+            self.reply(503, {'status' : 'error', 'messages' : 'Service Unavailable'})
+        elif not self.headers.get('Authorization'):
+            self.reply(401, {'status' : 'error', 'messages' : 'Unauthorized.'})
+        elif url.path != '/api/v1/hardware':
+            self.reply(404, {'status' : 'error', 'messages' : 'Not found'})
+        else:
+            search = urllib.parse.parse_qs(url.query).get('search', [''])[0]
+            rows = [{'id' : i + 1, 'name' : name, 'asset_tag' : tag, 'serial' : serial}
+                    for i, (serial, (name, tag)) in enumerate(sorted(server.records.items()))
+                    if search and search in serial]
+            self.reply(200, {'total' : len(rows), 'rows' : rows})
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSnipeItServer(http.server.ThreadingHTTPServer):
+    # Answers the Snipe-it hardware search from `records` ({serial: (name,
+    # asset tag)}). `online = False` makes it fail like an outage, `delay`
+    # slows every answer down and `requests` counts them.
+    daemon_threads = True
+
+    def __init__(self, records, port=0, delay=0.0):
+        super().__init__(('127.0.0.1', port), FakeSnipeItHandler)
+        self.records = dict(records)
+        self.delay = delay
+        self.online = True
+        self.requests = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/api/v1/hardware'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True, name='fake-snipeit-server')
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def fake_records(serials):
+    return dict((serial, ('Fake Phone ' + serial[-2:], 'AT-' + serial[-4:])) for serial in serials)
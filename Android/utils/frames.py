@@ -0,0 +1,193 @@
+import array
+import json
+import threading
+import numpy as np
+from utils.adb_client import call_adb
+
+PENDING_FENCE = 9223372036854775807
+DEFAULT_REFRESH_NS = 16666667
+FRAME_MODES = ['surfaceflinger', 'gfxinfo']
+
+
+def find_layer(layers_out, app_name):
+    # Unity draws into a SurfaceView, prefer it over the activity window. On
+    # Android 12+ the buffers go to its (BLAST) child layer.
+    candidates = [line.strip() for line in layers_out.splitlines() if app_name in line]
+    surface_views = [layer for layer in candidates if layer.startswith('SurfaceView')]
+    for layer in surface_views:
+        if 'BLAST' in layer:
+            return layer
+    if len(surface_views) > 0:
+        return surface_views[0]
+    if len(candidates) > 0:
+        return candidates[0]
+    return None
+
+
+def parse_surfaceflinger_latency(out):
+    # first line is the refresh period, then "desired actual ready" present
+    # times per frame, returns (refresh_ns, actual present times)
+    lines = out.splitlines()
+    refresh = DEFAULT_REFRESH_NS
+    presents = []
+    if len(lines) > 0 and lines[0].strip().isdigit():
+        refresh = int(lines[0]) or DEFAULT_REFRESH_NS
+        lines = lines[1:]
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        actual = int(fields[1])
+        if actual == 0 or actual == PENDING_FENCE:
+            continue
+        presents.append(actual)
+    return refresh, presents
+
+
+def parse_gfxinfo_framestats(out):
+    # rows of the ---PROFILEDATA--- csv, returns (intended vsync, completed)
+    frames = []
+    in_data = False
+    columns = None
+    for line in out.splitlines():
+        line = line.strip()
+        if line == '---PROFILEDATA---':
+            in_data = not in_data
+            columns = None
+            continue
+        if not in_data or not line:
+            continue
+        fields = line.rstrip(',').split(',')
+        if columns is None:
+            columns = fields
+            continue
+        row = dict(zip(columns, fields))
+        # frames with flags set are not regular frames (f.e. first frame after resize)
+        if row.get('Flags') != '0':
+            continue
+        frames.append((int(row['IntendedVsync']), int(row['FrameCompleted'])))
+    return frames
+
+
+class FrameCollector:
+    # Samples frame timing from the host while a test runs. Both sources only
+    # keep the last ~120 frames, so they are dumped every `interval` seconds
+    # and frames already seen are skipped by timestamp.
+    def __init__(self, adb_cmd, app_name, mode='surfaceflinger', interval=1.0):
+        self.adb_cmd = adb_cmd
+        self.app_name = app_name
+        self.mode = mode
+        self.interval = interval
+        self.refresh_ns = DEFAULT_REFRESH_NS
+        self.layer = None
+        # frame start and end in ns
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self._last = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            # an attempt that was never stopped must not sample into this one
+            self.stop()
+        # every launch has a layer of its own, the name has a per launch #id
+        self.layer = None
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self._last = 0
+        # a fresh event per thread, clearing a shared one would wake up a
+        # thread that is still being stopped
+        self._stop = threading.Event()
+        if self.mode == 'gfxinfo':
+            call_adb(self.adb_cmd, ['shell', 'dumpsys', 'gfxinfo', self.app_name, 'reset'],
+                     check_returncode=False)
+        else:
+            call_adb(self.adb_cmd, ['shell', 'dumpsys', 'SurfaceFlinger', '--latency-clear'],
+                     check_returncode=False)
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True,
+                                        name=threading.current_thread().name + '-frames')
+        self._thread.start()
+        return self
+
+    def _run(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print('Frame sampling failed', e)
+
+    def sample(self):
+        if self.mode == 'gfxinfo':
+            out = call_adb(self.adb_cmd, ['shell', 'dumpsys', 'gfxinfo', self.app_name, 'framestats'],
+                           check_returncode=False).decode('utf-8', errors='ignore')
+            for start, end in parse_gfxinfo_framestats(out):
+                if start > self._last:
+                    self.starts.append(start)
+                    self.ends.append(end)
+                    self._last = start
+            return
+        if self.layer is None:
+            # the layer only exists once the activity is up
+            layers = call_adb(self.adb_cmd, ['shell', 'dumpsys', 'SurfaceFlinger', '--list'],
+                              check_returncode=False).decode('utf-8', errors='ignore')
+            self.layer = find_layer(layers, self.app_name)
+            if self.layer is None:
+                return
+        out = call_adb(self.adb_cmd, ['shell', 'dumpsys', 'SurfaceFlinger', '--latency',
+                                      '"' + self.layer + '"'],
+                       check_returncode=False).decode('utf-8', errors='ignore')
+        self.refresh_ns, presents = parse_surfaceflinger_latency(out)
+        for present in presents:
+            if present > self._last:
+                # a frame lasts from the previous present to this one
+                if self._last != 0:
+                    self.starts.append(self._last)
+                    self.ends.append(present)
+                self._last = present
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is None:
+            # the attempt failed before the app was started
+            return self.summary()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.sample()
+        except Exception as e:
+            print('Frame sampling failed', e)
+        return self.summary()
+
+    def frame_times_ms(self):
+        starts = np.frombuffer(self.starts, dtype=np.int64) if len(self.starts) else np.empty(0, np.int64)
+        ends = np.frombuffer(self.ends, dtype=np.int64) if len(self.ends) else np.empty(0, np.int64)
+        return (ends - starts) / 1e6
+
+    def summary(self):
+        times = self.frame_times_ms()
+        if len(times) == 0:
+            return {'frames' : 0}
+        refresh_ms = self.refresh_ns / 1e6
+        p50, p90, p95, p99 = np.percentile(times, [50, 90, 95, 99])
+        duration_s = (self.ends[-1] - self.starts[0]) / 1e9
+        return {
+            'source' : self.mode,
+            'frames' : int(len(times)),
+            'fps' : round(len(times) / duration_s, 2) if duration_s > 0 else None,
+            'mean_ms' : round(float(times.mean()), 3),
+            'p50_ms' : round(float(p50), 3),
+            'p90_ms' : round(float(p90), 3),
+            'p95_ms' : round(float(p95), 3),
+            'p99_ms' : round(float(p99), 3),
+            'max_ms' : round(float(times.max()), 3),
+            # missed at least one vsync / missed three or more
+            'jank' : int((times > refresh_ms * 1.5).sum()),
+            'big_jank' : int((times > refresh_ms * 3).sum()),
+        }
+
+
+def format_frame_summary(summary):
+    if summary is None or summary.get('frames', 0) == 0:
+        return 'no frames captured'
+    return json.dumps(summary)
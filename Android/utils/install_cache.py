@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+from utils.adb_client import call_adb
+from utils.adb_client import retry_call_adb
+
+MARKER_DIR = '/data/local/tmp'
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as in_f:
+        for chunk in iter(lambda: in_f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def marker_path(app_name):
+    return MARKER_DIR + '/perf_runner_' + app_name + '.install'
+
+
+def parse_install_state(out):
+    paths = []
+    marker = ''
+    for line in out.splitlines():
+        line = line.strip()
+        if line.startswith('package:'):
+            paths.append(line[len('package:'):])
+        elif line:
+            marker = line
+    return ','.join(paths), marker
+
+
+class InstallCache:
+    # After every install a marker with the apk hash and the install path
+    # reported by `pm path` is left on the device. If both still match on the
+    # next run the install can be skipped. The install path changes on every
+    # install, so an apk installed by anything else invalidates the marker.
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def apk_hash(self, apk_path):
+        stat = os.stat(apk_path)
+        key = (os.path.abspath(apk_path), stat.st_size, stat.st_mtime)
+        with self._lock:
+            if key not in self._hashes:
+                self._hashes[key] = hash_file(apk_path)
+            return self._hashes[key]
+
+    def get_install_state(self, adb_cmd, app_name):
+        out = call_adb(adb_cmd, ['shell', 'pm', 'path', app_name, ';',
+                                 'cat', marker_path(app_name), '2>/dev/null'],
+                       check_returncode=False)
+        return parse_install_state(out.decode('utf-8', errors='ignore'))
+
+    def is_installed(self, adb_cmd, app_name, apk_path):
+        install_path, marker = self.get_install_state(adb_cmd, app_name)
+        if not install_path:
+            return False
+        return marker == self.apk_hash(apk_path) + ' ' + install_path
+
+    def mark_installed(self, adb_cmd, app_name, apk_path):
+        install_path, _ = self.get_install_state(adb_cmd, app_name)
+        marker = self.apk_hash(apk_path) + ' ' + install_path
+        retry_call_adb(adb_cmd, ['shell', 'echo', marker, '>',
+                                 marker_path(app_name)], retry_count = 3)
+
+    def install(self, adb_cmd, app_name, apk_path):
+        if self.is_installed(adb_cmd, app_name, apk_path):
+            print('Same apk is already installed, skipping install')
+            return False
+        retry_call_adb(adb_cmd, ['install', '-r', '-d', apk_path], retry_count = 3)
+        self.mark_installed(adb_cmd, app_name, apk_path)
+        return True
@@ -0,0 +1,101 @@
+import atexit
+import hashlib
+import json
+import math
+import threading
+from utils.spool import make_record
+from utils.spool import SpoolSender
+from utils.stats import parse_value
+
+
+def scene_doc_id(index_url, scene_name, date_of_test, apk_name, device_serial):
+    key = '\n'.join([index_url, scene_name, date_of_test, apk_name, str(device_serial)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def build_scene_update(doc_id, payload, upsert=None):
+    value = parse_value(payload)
+    if math.isnan(value):
+        value = payload
+        source = 'ctx._source.error_log.add(params.value);'
+    else:
+        source = 'ctx._source.data.add(params.value);'
+    body = {
+        'script' : {
+            'source' : source,
+            'params' : {'value' : value}
+        }
+    }
+    if upsert is not None:
+        # document is created with the first result, so no search or
+        # separate _doc request is needed to find where the result goes
+        body['scripted_upsert'] = True
+        body['upsert'] = upsert
+    return [{'update' : {'_id' : doc_id, 'retry_on_conflict' : 5}}, body]
+
+
+def build_metric_update(doc_id, metric, value, upsert=None):
+    # typed values of structured results, kept per metric name in `metrics`
+    body = {
+        'script' : {
+            'source' : 'if (ctx._source.metrics == null) { ctx._source.metrics = [:]; } '
+                       'if (!ctx._source.metrics.containsKey(params.metric)) { ctx._source.metrics[params.metric] = []; } '
+                       'ctx._source.metrics[params.metric].add(params.value);',
+            'params' : {'metric' : metric, 'value' : value}
+        }
+    }
+    if upsert is not None:
+        body['scripted_upsert'] = True
+        body['upsert'] = upsert
+    return [{'update' : {'_id' : doc_id, 'retry_on_conflict' : 5}}, body]
+
+
+class BulkSink:
+    # Buffers scene results and sends them with the _bulk API. Documents get
+    # an id derived from (scene_name, date_of_test, apk_name, device_serial),
+    # every device of a run gets documents of its own. The ids of
+    # documents this process already created are kept so later results for
+    # the same scene are sent as plain updates. Results go to the spool
+    # first and are sent by its background thread.
+    def __init__(self, kibana_url, spool, max_actions=100, flush_interval=30):
+        self.kibana_url = kibana_url
+        self.spool = spool
+        self.max_actions = max_actions
+        self._doc_ids = {}
+        self._lock = threading.Lock()
+        self.sender = SpoolSender(spool, batch_size=max_actions, flush_interval=flush_interval)
+        atexit.register(self.close)
+
+    def add_scene_result(self, scene_name, apk_name, payload, document):
+        return self._add(scene_name, apk_name, document,
+                         lambda doc_id, upsert: build_scene_update(doc_id, payload, upsert))
+
+    def add_metric_result(self, scene_name, apk_name, metric, value, document):
+        # goes to the same document as the scene results of that scene
+        return self._add(scene_name, apk_name, document,
+                         lambda doc_id, upsert: build_metric_update(doc_id, metric, value, upsert))
+
+    def _add(self, scene_name, apk_name, document, build_update):
+        key = (scene_name, document['date_of_test'], apk_name, document['device_serial'])
+        with self._lock:
+            doc_id = self._doc_ids.get(key)
+            upsert = None
+            if doc_id is None:
+                doc_id = scene_doc_id(self.kibana_url, *key)
+                self._doc_ids[key] = doc_id
+                upsert = document
+            actions = build_update(doc_id, upsert)
+            body = ''.join(json.dumps(action) + '\n' for action in actions)
+            # appended under the lock so the upsert is always journaled
+            # before any later update of the same document
+            self.spool.append(make_record('POST', self.kibana_url + '/_bulk', body,
+                                          'application/x-ndjson'))
+        if self.spool.pending_count() >= self.max_actions:
+            self.sender.notify()
+        return doc_id
+
+    def flush(self):
+        self.sender.notify()
+
+    def close(self):
+        self.sender.close()
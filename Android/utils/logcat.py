@@ -0,0 +1,276 @@
+import collections
+import concurrent.futures
+import re
+import subprocess
+import threading
+import time
+from utils.adb_client import call_adb
+from utils.command import ProgramError
+from utils.metrics import RESULT_SETTLE_S, is_structured, is_end, combine_payloads
+from utils.profile import cached_sdk
+
+RESULT_IDENT = 'ZZRES>>'
+LOGCAT_FILTERS = ['Unity', 'ActivityManager', 'PackageManager',
+                  'dalvikvm', 'DEBUG']
+APP_STARTED_IDENT = 'APP_STARTED'
+# lines LogcatReader keeps, and fetches on its first poll
+LOG_BUFFER_LINES = 5000
+# first sdk level (Android 7) whose logcat has -v epoch and -t <time>
+EPOCH_MIN_SDK = 24
+
+# Almost every logcat line is engine chatter, so one combined search decides
+# whether a line needs looking at before any of the specific patterns run.
+_INTERESTING = re.compile(r'CPU =|Built from|Vulkan API version|OpenGL ES|'
+                          r'Graphics API = |Build type|' +
+                          re.escape(APP_STARTED_IDENT) + '|' +
+                          re.escape(RESULT_IDENT))
+_ARCH = re.compile(r'CPU = ([^ ]*)')
+_SCRIPTING = re.compile(r"Scripting Backend[^']*'([^']*)'")
+_VERSION = re.compile(r"Version[^']*'([^'(]*)\(([^)']*)\)")
+_CONTEXT_LEVEL = re.compile(r'Context level[^<]*<([^>]*)>')
+_BUILD_TYPE = re.compile(r"Build type[^']*'([^']*)'")
+_GRAPHICS = re.compile(r'Graphics API = (.*)')
+_EPOCH_STAMP = re.compile(r'\d+\.\d+$')
+# the first `-v epoch` line of a reply, usually right at its start
+_EPOCH_LINE = re.compile(r'^\s*\d+\.\d+ ', re.M)
+_UNSUPPORTED = re.compile(r'Usage: logcat|Unrecognized Option|[Ii]nvalid|[Uu]nknown option')
+
+
+class LogcatParser:
+    # Single pass parser for the Unity player log. It keeps the position of
+    # the last dump it has seen so polling only parses lines added since.
+    def __init__(self, ident=RESULT_IDENT):
+        self.ident = ident
+        self.architecture = 'UNKNOWN'
+        self.scripting_backend = 'UNKNOWN'
+        self.build_type = 'UNKNOWN'
+        self.version = 'UNKNOWN'
+        self.changeset = 'UNKNOWN'
+        self.graphics_API = 'UNKNOWN'
+        self.started = threading.Event()
+        self.results = []
+        self._offset = 0
+        self._tail = ''
+
+    def feed_line(self, line):
+        if _INTERESTING.search(line) is None:
+            return
+        idx = line.find(self.ident)
+        if idx != -1:
+            self.results.append(line[idx + len(self.ident):])
+        m = _ARCH.search(line)
+        if m is not None:
+            self.architecture = m.group(1)
+        if line.find('Built from') > -1:
+            m = _SCRIPTING.search(line)
+            if m is not None:
+                self.scripting_backend = m.group(1)
+            m = _VERSION.search(line)
+            if m is not None:
+                self.version = m.group(1)
+                self.changeset = m.group(2)
+        if line.find('Vulkan API version') > -1:
+            self.graphics_API = 'Vulkan'
+        if line.find('OpenGL ES') > -1:
+            m = _CONTEXT_LEVEL.search(line)
+            if m is not None:
+                self.graphics_API = m.group(1)
+        m = _BUILD_TYPE.search(line)
+        if m is not None:
+            self.build_type = m.group(1)
+        m = _GRAPHICS.search(line)
+        if m is not None:
+            self.graphics_API = m.group(1)
+        if line.find(APP_STARTED_IDENT) > -1:
+            self.started.set()
+
+    def feed_dump(self, text):
+        # `logcat -d` always returns the whole buffer, skip what was parsed
+        # last time unless the buffer was cleared or wrapped in the meantime
+        if (self._offset > len(text) or
+                not text.startswith(self._tail, self._offset - len(self._tail))):
+            self.results = []
+            self._offset = 0
+            self._tail = ''
+        end = text.rfind('\n') + 1
+        if end <= self._offset:
+            return
+        for line in text[self._offset:end].splitlines():
+            self.feed_line(line)
+        self._tail = text[max(end - 256, 0):end]
+        self._offset = end
+
+    def first_result(self):
+        if len(self.results) == 0:
+            return None
+        return self.results[0]
+
+    def result(self):
+        # a plain result is the first ZZRES>> line, structured ones are all
+        # collected into one payload
+        first = self.first_result()
+        if first is None or not is_structured(first):
+            return first
+        return combine_payloads(self.results)
+
+    def results_ended(self):
+        return any(is_end(payload) for payload in self.results)
+
+    def attributes(self):
+        return (self.architecture, self.scripting_backend, self.build_type,
+                self.version, self.changeset, self.graphics_API.strip(),
+                self.started.is_set())
+
+
+def _is_log_line(line):
+    # `-v epoch` lines start with seconds.millis
+    parts = line.split(None, 1)
+    return len(parts) > 0 and _EPOCH_STAMP.match(parts[0]) is not None
+
+
+class LogcatReader:
+    # Polls `logcat -d` for the lines logged since the last poll only, so a
+    # poll costs the new log volume instead of the whole ring buffer. With
+    # `-v epoch` every line starts with its time, which goes back to logcat
+    # as `-t <time>`. Lines logged in the same millisecond as the last one
+    # come again and are dropped. New lines go through `parser` and into
+    # the bounded `lines`.
+    def __init__(self, adb_cmd, filters=LOGCAT_FILTERS, ident=RESULT_IDENT,
+                 max_lines=LOG_BUFFER_LINES, sdk=None):
+        self.adb_cmd = adb_cmd
+        self.filters = filters
+        self.max_lines = max_lines
+        self.parser = LogcatParser(ident)
+        self.lines = collections.deque(maxlen=max_lines)
+        if sdk is None:
+            sdk = cached_sdk(adb_cmd)
+        # logcat older than Android 7 knows neither -t <time> nor epoch
+        self.incremental = sdk is None or sdk >= EPOCH_MIN_SDK
+        self._since = None
+        # lines of the last millisecond seen, usually just one
+        self._boundary = []
+
+    def _fetch(self):
+        if not self.incremental:
+            return None
+        since = self._since if self._since is not None else str(self.max_lines)
+        args = ['logcat', '-d', '-v', 'epoch', '-t', since]
+        if len(self.filters) > 0:
+            args += ['-s'] + self.filters
+        try:
+            text = call_adb(self.adb_cmd, args).decode('utf-8', errors='ignore')
+        except ProgramError:
+            text = None
+        else:
+            # the legacy shell of old devices exits with 0 even when logcat
+            # rejects the options, only its usage text tells. Looking for a
+            # log line first spares searching all of a long reply.
+            if _EPOCH_LINE.search(text) is not None or _UNSUPPORTED.search(text) is None:
+                return text
+        print('logcat -t not supported, falling back to full dumps')
+        self.incremental = False
+        return None
+
+    def poll(self):
+        # -> amount of new lines
+        text = self._fetch()
+        if text is None:
+            args = ['logcat', '-d']
+            if len(self.filters) > 0:
+                args += ['-s'] + self.filters
+            self.parser.feed_dump(call_adb(self.adb_cmd, args).decode('utf-8', errors='ignore'))
+            return 0
+        new = 0
+        seen = list(self._boundary)
+        for line in text.splitlines():
+            if not _is_log_line(line):
+                # "--------- beginning of main" and other non log lines
+                continue
+            stamp = line.split(None, 1)[0]
+            if stamp == self._since:
+                if line in seen:
+                    seen.remove(line)
+                    continue
+                self._boundary.append(line)
+            else:
+                self._since = stamp
+                self._boundary = [line]
+            self.lines.append(line)
+            self.parser.feed_line(line)
+            new += 1
+        return new
+
+
+class LogcatFollower:
+    # Keeps one `adb logcat` stream open for the duration of a test and
+    # resolves `result` as soon as the first ZZRES>> line is read, or for
+    # structured results with their end record (utils/metrics.py). Every line
+    # also goes through `parser`, so build attributes come from the same stream.
+    def __init__(self, adb_cmd, filters=LOGCAT_FILTERS, ident=RESULT_IDENT):
+        self.adb_cmd = adb_cmd
+        self.filters = filters
+        self.parser = LogcatParser(ident)
+        self.result = concurrent.futures.Future()
+        self._process = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_result = None
+
+    def start(self):
+        args = self.adb_cmd + ['logcat']
+        if len(self.filters) > 0:
+            args += ['-s'] + self.filters
+        self._process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL)
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+        return self
+
+    def _read(self):
+        for raw in self._process.stdout:
+            line = raw.decode('utf-8', errors='ignore').rstrip('\r\n')
+            self.on_line(line)
+        # stream closed without a result (adb restarted, device unplugged
+        # or we were stopped), callers fall back to a full dump
+        self._resolve(self.parser.result() if self._last_result is not None else None)
+
+    def _resolve(self, result):
+        with self._lock:
+            if not self.result.done():
+                self.result.set_result(result)
+
+    def on_line(self, line):
+        count = len(self.parser.results)
+        self.parser.feed_line(line)
+        if self.result.done() or len(self.parser.results) == count:
+            return
+        if not is_structured(self.parser.first_result()):
+            self._resolve(self.parser.first_result())
+            return
+        self._last_result = time.time()
+        if self.parser.results_ended():
+            self._resolve(self.parser.result())
+
+    def wait(self, timeout):
+        end = time.time() + timeout
+        while True:
+            try:
+                return self.result.result(timeout=max(min(RESULT_SETTLE_S / 4, end - time.time()), 0))
+            except concurrent.futures.TimeoutError:
+                pass
+            # structured results without an end record are done once the
+            # app stopped logging them for a while
+            last = self._last_result
+            if last is not None and (time.time() - last >= RESULT_SETTLE_S or time.time() >= end):
+                self._resolve(self.parser.result())
+            elif time.time() >= end:
+                return None
+
+    def stop(self):
+        if self._process is None or self._process.poll() is not None:
+            return
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
@@ -0,0 +1,146 @@
+import json
+import re
+import shlex
+from utils.stats import NUMBER, parse_value
+
+# Structured ZZRES>> payloads carry several metrics per launch, as JSON
+#   ZZRES>>{"scene": "Test_01", "frame_time_ms": 16.5, "load_time_ms": 812}
+#   ZZRES>>[{"scene": "Test_01", "metric": "memory_mb", "value": 512}, ...]
+# or as key=value records, several of them separated by ';'
+#   ZZRES>>scene=Test_01 frame_time_ms=16.5 load_time_ms=812; scene=Test_02 ...
+# An app can log them over several lines and ends with an `end` record
+# (`{"end": true}` or `end=1`), without one the lines logged until
+# RESULT_SETTLE_S passes quietly count.
+RESULT_SETTLE_S = 2.0
+END_KEY = 'end'
+SCENE_KEY = 'scene'
+# joins scene and metric into one name for the summaries
+LABEL_SEPARATOR = ' | '
+
+_KEY_VALUE = re.compile(r'\s*[A-Za-z_][\w.]*=')
+_INT = re.compile(r'[-+]?\d+$')
+
+
+def is_structured(payload):
+    if payload is None:
+        return False
+    payload = str(payload).lstrip()
+    return payload.startswith('{') or payload.startswith('[') or _KEY_VALUE.match(payload) is not None
+
+
+def parse_field(text):
+    # "812" -> 812, "16.5" -> 16.5, "true" -> True, anything else stays text
+    text = text.strip()
+    if _INT.match(text):
+        return int(text)
+    if NUMBER.fullmatch(text):
+        return parse_value(text)
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    return text
+
+
+def _object_records(obj):
+    scene = obj.get(SCENE_KEY)
+    if 'metric' in obj and 'value' in obj:
+        return [(scene, str(obj['metric']), obj['value'])]
+    return [(scene, str(key), value) for key, value in obj.items()
+            if key not in (SCENE_KEY, END_KEY)]
+
+
+def _json_records(payload):
+    data = json.loads(payload)
+    if isinstance(data, dict):
+        data = [data]
+    records = []
+    for obj in data:
+        if isinstance(obj, dict):
+            records.extend(_object_records(obj))
+    return records
+
+
+def _key_value_records(payload):
+    records = []
+    for record in payload.split(';'):
+        obj = {}
+        for token in shlex.split(record):
+            if '=' in token:
+                key, value = token.split('=', 1)
+                obj[key] = value if key == SCENE_KEY else parse_field(value)
+        records.extend(_object_records(obj))
+    return records
+
+
+def parse_records(payload):
+    # -> [(scene, metric, value)] of one payload, scene is None for metrics
+    # of the whole run. A payload that doesn't parse gives no records.
+    payload = str(payload).strip()
+    try:
+        if payload.startswith('{') or payload.startswith('['):
+            return _json_records(payload)
+        return _key_value_records(payload)
+    except ValueError:
+        return []
+
+
+def is_end(payload):
+    payload = str(payload).strip()
+    try:
+        if payload.startswith('{'):
+            return json.loads(payload).get(END_KEY) is True
+    except ValueError:
+        return False
+    return re.search(r'(?:^|[\s;])' + END_KEY + r'=(?:1|true)\b', payload) is not None
+
+
+def combine_payloads(payloads):
+    # the structured payloads of a run -> one canonical json payload
+    records = []
+    for payload in payloads:
+        if is_structured(payload):
+            records.extend(parse_records(payload))
+    return json.dumps([{'scene' : scene, 'metric' : metric, 'value' : value}
+                       for scene, metric, value in records])
+
+
+def metric_label(scene, metric):
+    if scene is None:
+        return metric
+    return str(scene) + LABEL_SEPARATOR + metric
+
+
+def records_to_scenes(records):
+    # -> [(label, value)] like the scene parsers return, so summaries and
+    # --adaptive treat every scene and metric as a result of its own
+    return [(metric_label(scene, metric), value) for scene, metric, value in records]
+
+
+def parse_metric_scenes(result):
+    # scene parser for structured results, None for plain ones
+    if not is_structured(result):
+        return None
+    return records_to_scenes(parse_records(result))
+
+
+def parse_text_scenes(result):
+    # "Scene name: A | Frame time: 16.5ms ---- Scene name: B | ..." ->
+    # [('A', '16.5ms'), ('B', ...)], None for results in any other form
+    result = str(result)
+    if 'Skipped' in result or '|' not in result:
+        return None
+    scenes = []
+    for entry in result.split('----'):
+        if entry.strip() == '':
+            continue
+        elements = entry.split('|')
+        if len(elements) < 2 or ':' not in elements[0] or ':' not in elements[1]:
+            return None
+        scenes.append((elements[0].split(':', 1)[1].strip(), elements[1].split(':', 1)[1].strip()))
+    return scenes or None
+
+
+def parse_result_scenes(result):
+    # scene parser for every kind of result, None for a plain value
+    if is_structured(result):
+        return parse_metric_scenes(result)
+    return parse_text_scenes(result)
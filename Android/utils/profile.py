@@ -0,0 +1,183 @@
+import json
+import re
+import threading
+from utils.adb_client import call_adb, serial_from_adb_cmd
+from utils.thermal import SECTION_MARKER, parse_device_state, read_device_state
+
+BATTERY_MARKER = '----BATTERY----'
+DISPLAY_MARKER = '----DISPLAY----'
+# props, battery, thermal and display state in one shell round trip, the
+# battery and thermal part is what thermal.STATE_COMMAND reads
+PROFILE_COMMAND = ['shell', 'getprop', ';', 'echo', BATTERY_MARKER, ';',
+                   'dumpsys', 'battery', ';', 'echo', SECTION_MARKER, ';',
+                   'dumpsys', 'thermalservice', ';', 'echo', DISPLAY_MARKER, ';',
+                   'wm', 'size', ';', 'wm', 'density', ';',
+                   'dumpsys', 'SurfaceFlinger', '|', 'grep', '-e', 'GLES', '-e', 'refresh-rate', ';',
+                   'head', '-n', '1', '/proc/meminfo']
+
+_PROP = re.compile(r'^\[([^\]]+)\]: \[(.*)\]$')
+_SIZE = re.compile(r'(Physical|Override) size:\s*(\d+)x(\d+)')
+_DENSITY = re.compile(r'(Physical|Override) density:\s*(\d+)')
+_GLES = re.compile(r'GLES:\s*([^,]+),\s*([^,]+),\s*(OpenGL ES [\d.]+)')
+_REFRESH = re.compile(r'refresh-rate\s*:\s*([\d.]+)')
+_MEM_TOTAL = re.compile(r'MemTotal:\s*(\d+) kB')
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def _first_prop(props, *names):
+    for name in names:
+        if props.get(name):
+            return props[name]
+    return None
+
+
+def _display_value(matches):
+    # an override (wm size 720x1280) is what apps actually get
+    matches = dict((m.group(1), m.groups()[1:]) for m in matches)
+    return matches.get('Override', matches.get('Physical'))
+
+
+class DeviceProfile:
+    # What a device is, read once per serial, and `state`, the battery and
+    # thermal DeviceState that gets refreshed before every test.
+    def __init__(self, props):
+        self.props = props
+        self.serial = _first_prop(props, 'ro.serialno', 'ro.boot.serialno')
+        self.manufacturer = props.get('ro.product.manufacturer')
+        self.model = props.get('ro.product.model')
+        self.device = props.get('ro.product.device')
+        self.android_version = props.get('ro.build.version.release')
+        sdk = props.get('ro.build.version.sdk', '')
+        self.sdk = int(sdk) if sdk.isdigit() else None
+        self.abi = props.get('ro.product.cpu.abi')
+        self.abi_list = [abi for abi in props.get('ro.product.cpu.abilist', '').split(',') if abi]
+        self.fingerprint = props.get('ro.build.fingerprint')
+        self.soc = _first_prop(props, 'ro.soc.model', 'ro.board.platform', 'ro.hardware')
+        self.soc_manufacturer = props.get('ro.soc.manufacturer')
+        self.gpu = props.get('ro.hardware.egl')
+        self.gpu_vendor = None
+        self.gles_version = None
+        self.width = None
+        self.height = None
+        self.density = None
+        self.refresh_rate = None
+        self.ram_mb = None
+        self.state = None
+
+    def refresh(self, adb_cmd):
+        # only the battery and thermal part changes while a device runs tests
+        self.state = read_device_state(adb_cmd)
+        return self.state
+
+    def describe(self):
+        parts = [' '.join(str(part) for part in (self.manufacturer, self.model) if part)]
+        if self.android_version is not None:
+            parts.append('Android {0} (sdk {1})'.format(self.android_version, self.sdk))
+        if self.abi is not None:
+            parts.append(self.abi)
+        if self.soc is not None:
+            parts.append('SoC ' + ' '.join(part for part in (self.soc_manufacturer, self.soc) if part))
+        if self.gpu is not None:
+            parts.append('GPU ' + self.gpu)
+        if self.width is not None:
+            display = '{0}x{1}'.format(self.width, self.height)
+            if self.density is not None:
+                display += ' {0}dpi'.format(self.density)
+            if self.refresh_rate is not None:
+                display += ' @ {0:g}Hz'.format(self.refresh_rate)
+            parts.append(display)
+        if self.ram_mb is not None:
+            parts.append('{0} MB RAM'.format(self.ram_mb))
+        return ', '.join(parts)
+
+    def to_dict(self):
+        return {
+            'serial' : self.serial,
+            'manufacturer' : self.manufacturer,
+            'model' : self.model,
+            'device' : self.device,
+            'android_version' : self.android_version,
+            'sdk' : self.sdk,
+            'abi' : self.abi,
+            'abi_list' : self.abi_list,
+            'fingerprint' : self.fingerprint,
+            'soc' : self.soc,
+            'soc_manufacturer' : self.soc_manufacturer,
+            'gpu' : self.gpu,
+            'gpu_vendor' : self.gpu_vendor,
+            'gles_version' : self.gles_version,
+            'width' : self.width,
+            'height' : self.height,
+            'density' : self.density,
+            'refresh_rate' : self.refresh_rate,
+            'ram_mb' : self.ram_mb,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def __str__(self):
+        return self.describe()
+
+
+def parse_profile(out):
+    props_part, _, rest = out.partition(BATTERY_MARKER)
+    state_part, _, display = rest.partition(DISPLAY_MARKER)
+    props = {}
+    for line in props_part.splitlines():
+        m = _PROP.match(line.strip())
+        if m is not None:
+            props[m.group(1)] = m.group(2)
+    profile = DeviceProfile(props)
+    profile.state = parse_device_state(state_part)
+    size = _display_value(_SIZE.finditer(display))
+    if size is not None:
+        profile.width, profile.height = int(size[0]), int(size[1])
+    density = _display_value(_DENSITY.finditer(display))
+    if density is not None:
+        profile.density = int(density[0])
+    m = _GLES.search(display)
+    if m is not None:
+        profile.gpu_vendor, profile.gpu, profile.gles_version = (part.strip() for part in m.groups())
+    m = _REFRESH.search(display)
+    if m is not None:
+        profile.refresh_rate = round(float(m.group(1)), 2)
+    m = _MEM_TOTAL.search(display)
+    if m is not None:
+        profile.ram_mb = int(m.group(1)) // 1024
+    return profile
+
+
+def read_profile(adb_cmd):
+    out = call_adb(adb_cmd, PROFILE_COMMAND)
+    return parse_profile(out.decode('utf-8', errors='ignore'))
+
+
+def get_profile(adb_cmd, serial=None):
+    # -> DeviceProfile of the device adb_cmd talks to. The full profile is
+    # read once per serial, later calls only refresh its state. Without a
+    # serial the props tell which device it is.
+    with _profiles_lock:
+        profile = _profiles.get(serial) if serial is not None else None
+    if profile is not None:
+        profile.refresh(adb_cmd)
+        return profile
+    profile = read_profile(adb_cmd)
+    if profile.serial is None:
+        profile.serial = serial
+    with _profiles_lock:
+        # None stands for the only device, as in `adb` without -s
+        _profiles[serial] = profile
+        if profile.serial is not None:
+            _profiles.setdefault(profile.serial, profile)
+    return profile
+
+
+def cached_sdk(adb_cmd):
+    # -> sdk level of the device adb_cmd talks to if get_profile read it
+    supported, serial = serial_from_adb_cmd(adb_cmd)
+    with _profiles_lock:
+        profile = _profiles.get(serial) if supported else None
+    return profile.sdk if profile is not None else None
@@ -0,0 +1,275 @@
+import datetime
+import math
+import os
+import sqlite3
+import threading
+from utils.stats import parse_value
+
+DB_NAME = 'results.db'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    finished TEXT,
+    script TEXT,
+    app_name TEXT,
+    device_id TEXT NOT NULL,
+    result_file TEXT,
+    battery_start TEXT,
+    battery_end TEXT,
+    session TEXT,
+    profile TEXT
+);
+CREATE TABLE IF NOT EXISTS apks (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    UNIQUE (name, path)
+);
+CREATE TABLE IF NOT EXISTS cycles (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    cycle INTEGER NOT NULL,
+    result_set INTEGER NOT NULL,
+    apk_id INTEGER NOT NULL REFERENCES apks(id),
+    battery_level TEXT,
+    device_state TEXT,
+    frames TEXT,
+    system TEXT,
+    screenshots TEXT,
+    finished TEXT
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS attributes (
+    cycle_id INTEGER PRIMARY KEY REFERENCES cycles(id),
+    architecture TEXT,
+    scripting_backend TEXT,
+    build_type TEXT,
+    unity_version TEXT,
+    changeset TEXT,
+    graphics_api TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    cycle_id INTEGER NOT NULL REFERENCES cycles(id),
+    scene_id INTEGER REFERENCES scenes(id),
+    metric TEXT,
+    raw TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS runs_device ON runs(device_id);
+CREATE INDEX IF NOT EXISTS cycles_run ON cycles(run_id);
+CREATE INDEX IF NOT EXISTS cycles_apk ON cycles(apk_id);
+CREATE INDEX IF NOT EXISTS attributes_changeset ON attributes(changeset);
+CREATE INDEX IF NOT EXISTS results_cycle ON results(cycle_id);
+CREATE INDEX IF NOT EXISTS results_scene ON results(scene_id);
+'''
+
+# columns added after the first version of the schema, (table, column, type)
+ADDED_COLUMNS = [
+    ('cycles', 'device_state', 'TEXT'),
+    ('cycles', 'frames', 'TEXT'),
+    ('cycles', 'system', 'TEXT'),
+    ('runs', 'session', 'TEXT'),
+    ('results', 'metric', 'TEXT'),
+    ('runs', 'profile', 'TEXT'),
+    ('cycles', 'screenshots', 'TEXT'),
+]
+
+ATTRIBUTE_COLUMNS = ['architecture', 'scripting_backend', 'build_type',
+                     'unity_version', 'changeset', 'graphics_api']
+
+
+def now():
+    return datetime.datetime.now().strftime(TIME_FORMAT)
+
+
+def numeric(value):
+    # "21.52ms" of a scene result still has a numeric value, NULL without one
+    value = parse_value(value)
+    return None if math.isnan(value) else value
+
+
+class ResultsDB:
+    # One sqlite database per results directory, shared by all device
+    # threads. Every finished test is written in a single transaction.
+    def __init__(self, results_path):
+        self.path = os.path.join(results_path, DB_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        with self._conn:
+            # after the migration, older databases have no session column before it
+            self._conn.execute('CREATE INDEX IF NOT EXISTS runs_session ON runs(session)')
+
+    def _migrate(self):
+        with self._conn:
+            for table, column, column_type in ADDED_COLUMNS:
+                columns = [row[1] for row in self._conn.execute('PRAGMA table_info(' + table + ')')]
+                if column not in columns:
+                    self._conn.execute('ALTER TABLE ' + table + ' ADD COLUMN ' + column + ' ' + column_type)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _get_or_create(self, table, columns, values):
+        where = ' AND '.join(column + ' = ?' for column in columns)
+        row = self._conn.execute('SELECT id FROM ' + table + ' WHERE ' + where,
+                                 values).fetchone()
+        if row is not None:
+            return row[0]
+        cur = self._conn.execute('INSERT INTO ' + table + ' (' + ', '.join(columns) +
+                                 ') VALUES (' + ', '.join('?' * len(columns)) + ')',
+                                 values)
+        return cur.lastrowid
+
+    def start_run(self, script, app_name, device_id, result_file, battery_start, session=None, profile=None):
+        # session groups the runs of all devices started by one invocation,
+        # profile is the json of the device's utils.profile.DeviceProfile
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                'INSERT INTO runs (started, script, app_name, device_id, result_file, battery_start, session, profile) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (now(), script, app_name, device_id, result_file, battery_start, session, profile))
+            return cur.lastrowid
+
+    def finish_run(self, run_id, battery_end):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE runs SET finished = ?, battery_end = ? WHERE id = ?',
+                               (now(), battery_end, run_id))
+
+    def add_test(self, run_id, cycle, result_set, apk_path, battery_level, result,
+                 scenes=None, attributes=None, device_state=None, frames=None,
+                 system=None, metrics=None, screenshots=None):
+        # scenes is a list of (scene_name, value) parsed from the result,
+        # metrics the (scene_name or None, metric, value) records of a
+        # structured result,
+        # attributes the build info tuple read from logcat, device_state the
+        # json of the battery/thermal state the test started with, frames the
+        # json of the frame timing summary and system the json of the
+        # cpu/memory/gpu sampler summary, screenshots the json of the
+        # references into the screenshot store
+        with self._lock, self._conn:
+            apk_id = self._get_or_create('apks', ['name', 'path'],
+                                         (os.path.basename(apk_path), apk_path))
+            cur = self._conn.execute(
+                'INSERT INTO cycles (run_id, cycle, result_set, apk_id, battery_level, device_state, frames, system, screenshots, finished) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, cycle, result_set, apk_id, battery_level, device_state, frames, system, screenshots, now()))
+            cycle_id = cur.lastrowid
+            if attributes is not None:
+                self._conn.execute(
+                    'INSERT INTO attributes (cycle_id, ' + ', '.join(ATTRIBUTE_COLUMNS) +
+                    ') VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (cycle_id,) + tuple(attributes[:len(ATTRIBUTE_COLUMNS)]))
+            rows = [(cycle_id, None, None, str(result), numeric(result))]
+            for scene_name, value in scenes or []:
+                scene_id = self._get_or_create('scenes', ['name'], (scene_name.strip(),))
+                rows.append((cycle_id, scene_id, None, value, numeric(value)))
+            for scene_name, metric, value in metrics or []:
+                scene_id = None
+                if scene_name is not None:
+                    scene_id = self._get_or_create('scenes', ['name'], (str(scene_name).strip(),))
+                rows.append((cycle_id, scene_id, metric, str(value), numeric(value)))
+            self._conn.executemany(
+                'INSERT INTO results (cycle_id, scene_id, metric, raw, value) VALUES (?, ?, ?, ?, ?)',
+                rows)
+            return cycle_id
+
+    def get_run(self, run_id):
+        rows = self.query('SELECT * FROM runs WHERE id = ?', (run_id,))
+        if len(rows) == 0:
+            return None
+        return rows[0]
+
+    def get_session_runs(self, session):
+        return self.query('SELECT * FROM runs WHERE session = ? ORDER BY id', (session,))
+
+    def get_tests(self, run_id):
+        return self.query(
+            'SELECT cycles.cycle, cycles.result_set, cycles.battery_level, cycles.frames, cycles.system, cycles.screenshots, '
+            'apks.name AS apk_name, results.raw AS result '
+            'FROM cycles JOIN apks ON apks.id = cycles.apk_id '
+            'JOIN results ON results.cycle_id = cycles.id AND results.scene_id IS NULL AND results.metric IS NULL '
+            'WHERE cycles.run_id = ? ORDER BY cycles.id', (run_id,))
+
+    def get_test_durations(self, app_name, runs=20):
+        # -> {apk name: [seconds]} of the tests in the latest runs of
+        # app_name, from the end of the previous test of the run (the start
+        # of the run for its first test) until the test was written
+        rows = self.query(
+            'SELECT cycles.run_id, runs.started, cycles.finished, apks.name AS apk_name FROM cycles '
+            'JOIN runs ON runs.id = cycles.run_id JOIN apks ON apks.id = cycles.apk_id '
+            'WHERE runs.id IN (SELECT id FROM runs WHERE app_name = ? ORDER BY id DESC LIMIT ?) '
+            'AND cycles.finished IS NOT NULL ORDER BY cycles.id', (app_name, runs))
+        durations = {}
+        previous = {}
+        for row in rows:
+            start = previous.get(row['run_id'], row['started'])
+            previous[row['run_id']] = row['finished']
+            seconds = (datetime.datetime.strptime(row['finished'], TIME_FORMAT) -
+                       datetime.datetime.strptime(start, TIME_FORMAT)).total_seconds()
+            durations.setdefault(row['apk_name'], []).append(seconds)
+        return durations
+
+    def get_apk_names(self, run_id):
+        rows = self.query(
+            'SELECT DISTINCT cycles.result_set, apks.name FROM cycles '
+            'JOIN apks ON apks.id = cycles.apk_id WHERE cycles.run_id = ?', (run_id,))
+        names = {}
+        for row in rows:
+            names[row[0]] = row[1]
+        return [names.get(i, 'UNKNOWN') for i in range(max(names.keys(), default=-1) + 1)]
+
+    def render_report(self, run_id, apk_names=None):
+        # Same layout as the result files have always had. apk_names keeps
+        # the order of the result sets, even for apks that never finished.
+        run = self.get_run(run_id)
+        tests = self.get_tests(run_id)
+        if apk_names is None:
+            apk_names = self.get_apk_names(run_id)
+        lines = ['BEGIN']
+        if run['profile'] is not None:
+            lines.append('Device: ' + run['profile'])
+        result_sets = [[] for name in apk_names]
+        cycle = None
+        for test in tests:
+            if test['cycle'] != cycle:
+                cycle = test['cycle']
+                lines.append('Cycle ' + str(cycle))
+            lines.append('Battery level before test # ' + str(test['result_set']) + ' is ' + str(test['battery_level']))
+            lines.append('Result set {0}: {1}'.format(test['result_set'], test['result']))
+            if test['frames'] is not None:
+                lines.append('Frames {0}: {1}'.format(test['result_set'], test['frames']))
+            if test['system'] is not None:
+                lines.append('System {0}: {1}'.format(test['result_set'], test['system']))
+            if test['screenshots'] is not None:
+                lines.append('Screenshots {0}: {1}'.format(test['result_set'], test['screenshots']))
+            result_sets[test['result_set']].append(test['result'])
+        for result_set in result_sets:
+            lines.extend(result_set)
+        lines.append('--------------------------------')
+        lines.append('Battery on start ' + str(run['battery_start']))
+        lines.append('Battery on finish ' + str(run['battery_end']))
+        for i, result_set in enumerate(result_sets):
+            lines.append('Result set {0}'.format(i))
+            lines.append('APK Name:' + apk_names[i])
+            lines.extend(result_set)
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, run_id, path, apk_names=None):
+        with open(path, 'w') as out_f:
+            out_f.write(self.render_report(run_id, apk_names))
@@ -0,0 +1,38 @@
+import os
+import uuid
+
+
+def new_session_id():
+    return uuid.uuid4().hex[:12]
+
+
+class ResumeError(Exception):
+    pass
+
+
+def load_session(db, session, apks):
+    # Every finished test is already committed to the results database, so
+    # that is the journal. Returns the (cycle, apk index) cells that finished
+    # and per device the run to continue with its rebuilt result sets.
+    runs = db.get_session_runs(session)
+    if len(runs) == 0:
+        raise ResumeError('No runs with session id ' + session + ' in ' + db.path)
+    apk_names = [os.path.basename(apk) for apk in apks]
+    completed = set()
+    previous = {}
+    for run in runs:
+        result_sets = [[] for apk in apks]
+        for test in db.get_tests(run['id']):
+            i_apk = test['result_set']
+            if i_apk >= len(apks) or apk_names[i_apk] != test['apk_name']:
+                raise ResumeError('Run ' + str(run['id']) + ' tested ' + test['apk_name'] +
+                                  ' as apk #' + str(i_apk) + ', resume with the same apks in the same order')
+            completed.add((test['cycle'], i_apk))
+            result_sets[i_apk].append(test['result'])
+        previous[run['device_id']] = {
+            'run_id' : run['id'],
+            'result_file' : run['result_file'],
+            'battery_start' : run['battery_start'],
+            'result_sets' : result_sets,
+        }
+    return completed, previous
@@ -0,0 +1,164 @@
+import array
+import re
+import threading
+import time
+import numpy as np
+from utils.adb_client import call_adb
+
+SECTION_MARKER = '----SAMPLE----'
+# qualcomm (kgsl) and mali nodes, whichever exist are read
+GPU_NODES = ['/sys/class/kgsl/kgsl-3d0/gpubusy',
+             '/sys/class/kgsl/kgsl-3d0/gpu_busy_percentage',
+             '/sys/class/misc/mali0/device/utilization',
+             '/sys/kernel/gpu/gpu_busy']
+METRICS = ['cpu_load', 'cpu_freq_mean_mhz', 'cpu_freq_max_mhz', 'app_rss_mb',
+           'app_threads', 'gpu_busy']
+
+_STATUS_FIELD = re.compile(r'^(VmRSS|Threads):\s*(\d+)', re.MULTILINE)
+
+
+def sample_command(app_name):
+    # everything for one tick in a single shell round trip
+    return ' ; '.join([
+        'head -n 1 /proc/stat',
+        'echo ' + SECTION_MARKER,
+        'cat /sys/devices/system/cpu/cpu*/cpufreq/scaling_cur_freq 2>/dev/null',
+        'echo ' + SECTION_MARKER,
+        'cat /proc/$(pidof -s ' + app_name + ')/status 2>/dev/null',
+        'echo ' + SECTION_MARKER,
+        'for f in ' + ' '.join(GPU_NODES) + '; do [ -r $f ] && echo $f $(cat $f); done',
+    ])
+
+
+def parse_gpu_busy(out):
+    # -> busy fraction 0-1 from the first node that made sense
+    for line in out.splitlines():
+        fields = line.replace('%', ' ').split()
+        if len(fields) < 2:
+            continue
+        try:
+            values = [int(value) for value in fields[1:]]
+        except ValueError:
+            continue
+        if fields[0].endswith('gpubusy'):
+            # "busy total" counters since the last read
+            if len(values) >= 2 and values[1] > 0:
+                return values[0] / values[1]
+            continue
+        return values[0] / 100.0
+    return None
+
+
+def parse_sample(out):
+    # -> (cpu ticks (busy, total), [core freqs in kHz], rss kB, threads, gpu busy)
+    sections = out.split(SECTION_MARKER)
+    sections += [''] * (4 - len(sections))
+    stat, freqs, status, gpu = sections[:4]
+    ticks = None
+    fields = stat.split()
+    if len(fields) > 5 and fields[0] == 'cpu':
+        values = [int(value) for value in fields[1:]]
+        total = sum(values[:8])
+        # idle + iowait
+        ticks = (total - values[3] - values[4], total)
+    core_freqs = [int(value) for value in freqs.split() if value.isdigit()]
+    rss, threads = None, None
+    for m in _STATUS_FIELD.finditer(status):
+        if m.group(1) == 'VmRSS':
+            rss = int(m.group(2))
+        else:
+            threads = int(m.group(2))
+    return ticks, core_freqs, rss, threads, parse_gpu_busy(gpu)
+
+
+class SystemSampler:
+    # Samples cpu load and frequencies, the memory of the app and gpu load
+    # while a test runs, one adb shell command per tick so the sampling
+    # itself barely shows up in the results. Every metric is a time series
+    # of doubles next to the sample times, nan where a value was unavailable.
+    def __init__(self, adb_cmd, app_name, interval=1.0):
+        self.adb_cmd = adb_cmd
+        self.app_name = app_name
+        self.interval = interval
+        self.command = sample_command(app_name)
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        self.times = array.array('d')
+        self.series = dict((metric, array.array('d')) for metric in METRICS)
+        self._last_ticks = None
+
+    def start(self):
+        if self._thread is not None:
+            # an attempt that was never stopped must not sample into this one
+            self.stop()
+        self.reset()
+        # every thread gets an event of its own, clearing a shared one would
+        # wake up a thread that is still being stopped
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True,
+                                        name=threading.current_thread().name + '-sampler')
+        self._thread.start()
+        return self
+
+    def _run(self, stop):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print('System sampling failed', e)
+            if stop.wait(self.interval):
+                break
+
+    def sample(self):
+        out = call_adb(self.adb_cmd, ['shell', self.command], check_returncode=False)
+        ticks, core_freqs, rss, threads, gpu_busy = parse_sample(out.decode('utf-8', errors='ignore'))
+        load = np.nan
+        if ticks is not None and self._last_ticks is not None and ticks[1] > self._last_ticks[1]:
+            load = (ticks[0] - self._last_ticks[0]) / (ticks[1] - self._last_ticks[1])
+        if ticks is not None:
+            self._last_ticks = ticks
+        values = {
+            'cpu_load' : load,
+            'cpu_freq_mean_mhz' : sum(core_freqs) / len(core_freqs) / 1000.0 if core_freqs else np.nan,
+            'cpu_freq_max_mhz' : max(core_freqs) / 1000.0 if core_freqs else np.nan,
+            'app_rss_mb' : rss / 1024.0 if rss is not None else np.nan,
+            'app_threads' : threads if threads is not None else np.nan,
+            'gpu_busy' : gpu_busy if gpu_busy is not None else np.nan,
+        }
+        self.times.append(time.time())
+        for metric in METRICS:
+            self.series[metric].append(values[metric])
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.summary()
+
+    def summary(self):
+        summary = {'samples' : len(self.times)}
+        for metric in METRICS:
+            values = np.frombuffer(self.series[metric], dtype=np.float64) if len(self.times) else np.empty(0)
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            summary[metric] = {
+                'mean' : round(float(values.mean()), 3),
+                'min' : round(float(values.min()), 3),
+                'max' : round(float(values.max()), 3),
+            }
+        return summary
+
+
+def format_system_summary(summary):
+    if summary is None or summary.get('samples', 0) == 0:
+        return 'no samples'
+    parts = ['samples=' + str(summary['samples'])]
+    for metric in METRICS:
+        if metric in summary:
+            parts.append('{0}={1[mean]}({1[min]}-{1[max]})'.format(metric, summary[metric]))
+    return ' '.join(parts)
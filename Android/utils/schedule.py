@@ -0,0 +1,108 @@
+import heapq
+import os
+import random
+from utils.devices import build_task_matrix
+
+ORDERS = ['interleaved', 'blocked', 'randomized-balanced']
+
+# rough costs of one test outside of waiting for the result: the two 5s
+# sleeps plus pm clear, sync, logcat -c and am start
+TEST_OVERHEAD_S = 12.0
+INSTALL_OVERHEAD_S = 6.0
+INSTALL_MB_PER_S = 25.0
+
+
+def order_tasks(run_count, apk_count, order='interleaved', seed=0):
+    # -> [(cycle, apk index)] in the order they should run. It is the order
+    # of the queue all devices share, each device only gets every so many
+    # cells of it when there is more than one.
+    if order == 'blocked':
+        # every cycle of an apk back to back, it is installed once
+        return [(cycle, i_apk) for i_apk in range(apk_count)
+                for cycle in range(run_count)]
+    if order == 'randomized-balanced':
+        # every cycle runs each apk once, the positions come from rotating a
+        # shuffled order so each apk is equally often first, second, ...
+        # and the cycles are shuffled so the rotation doesn't follow the
+        # device warming up
+        rng = random.Random(seed)
+        base = list(range(apk_count))
+        rng.shuffle(base)
+        shifts = [cycle % max(apk_count, 1) for cycle in range(run_count)]
+        rng.shuffle(shifts)
+        return [(cycle, base[(shift + position) % apk_count])
+                for cycle, shift in enumerate(shifts)
+                for position in range(apk_count)]
+    return build_task_matrix(run_count, apk_count)
+
+
+def simulate_dispatch(tasks, device_count, cost):
+    # Devices pull from the same queue, every cell goes to the device that
+    # is free first. cost(task, previous task of the device) -> seconds.
+    # -> (seconds until the last device is done, [tasks of every device])
+    free = [(0.0, device) for device in range(device_count)]
+    per_device = [[] for device in range(device_count)]
+    for task in tasks:
+        busy_until, device = heapq.heappop(free)
+        previous = per_device[device][-1] if len(per_device[device]) > 0 else None
+        per_device[device].append(task)
+        heapq.heappush(free, (busy_until + cost(task, previous), device))
+    return max(busy_until for busy_until, device in free), per_device
+
+
+def estimate_run(tasks, apks, device_count, sleep_s, reinstall=False, durations=None):
+    # The apk is only installed when it changes on a device unless every
+    # test reinstalls. wall_s is the maximum, every test waiting the whole
+    # sleep_s. expected_s takes the mean time earlier tests of an apk took
+    # instead (durations, {apk name: [seconds]} of
+    # ResultsDB.get_test_durations), None when no apk ran before.
+    device_count = max(device_count, 1)
+    sizes = [os.path.getsize(apk) / 1e6 if os.path.isfile(apk) else 0.0 for apk in apks]
+    install_costs = [INSTALL_OVERHEAD_S + size / INSTALL_MB_PER_S for size in sizes]
+    means = [None] * len(apks)
+    observed = 0
+    for i_apk, apk in enumerate(apks):
+        # longer than a test can take was a resumed run or a retried test
+        seen = [seconds for seconds in (durations or {}).get(os.path.basename(apk), [])
+                if 0 <= seconds <= TEST_OVERHEAD_S + sleep_s + install_costs[i_apk]]
+        if len(seen) > 0:
+            means[i_apk] = sum(seen) / len(seen)
+            observed += len(seen)
+
+    def installs(task, previous):
+        return reinstall or previous is None or previous[1] != task[1]
+
+    def longest(task, previous):
+        return TEST_OVERHEAD_S + sleep_s + (install_costs[task[1]] if installs(task, previous) else 0.0)
+
+    def expected(task, previous):
+        return longest(task, previous) if means[task[1]] is None else means[task[1]]
+
+    # which device gets a cell depends on how long the cells before it took,
+    # so both estimates dispatch on their own
+    wall, per_device = simulate_dispatch(tasks, device_count, longest)
+    expected_s = simulate_dispatch(tasks, device_count, expected)[0] if observed > 0 else None
+    return {
+        'tests' : len(tasks),
+        'installs' : sum(installs(task, device_tasks[i - 1] if i > 0 else None)
+                         for device_tasks in per_device for i, task in enumerate(device_tasks)),
+        'wall_s' : wall,
+        'expected_s' : expected_s,
+        'observed' : observed,
+    }
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}h{1:02d}m{2:02d}s'.format(hours, minutes, seconds)
+
+
+def format_estimate(estimate, order):
+    text = 'Order {0}: {1} tests, {2} installs'.format(order, estimate['tests'], estimate['installs'])
+    if estimate['expected_s'] is not None:
+        text += ', expected {0} (mean of {1} earlier tests)'.format(
+            format_duration(estimate['expected_s']), estimate['observed'])
+    # --sleep is the longest a test waits
+    return text + ', at most {0} (if every test waits the whole --sleep)'.format(
+        format_duration(estimate['wall_s']))
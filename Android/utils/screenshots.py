@@ -0,0 +1,188 @@
+import concurrent.futures
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from utils.adb_client import call_adb
+from utils.command import ProgramError
+from utils.trace import span
+try:
+    from PIL import Image
+except ImportError:
+    # without Pillow the screenshots are kept as the png the device sent
+    Image = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SCREENSHOT_DIR = 'screenshots'
+# a capture point is seconds after the app was started or RESULT_POINT, the
+# moment its result came in
+RESULT_POINT = 'result'
+DEFAULT_WIDTH = 360
+JPEG_QUALITY = 80
+
+
+def parse_points(text):
+    # "5,20,result" -> [5.0, 20.0, 'result'], for argparse
+    points = []
+    for part in text.split(','):
+        part = part.strip()
+        if part == RESULT_POINT:
+            points.append(part)
+        elif part:
+            seconds = float(part)
+            if seconds < 0:
+                raise ValueError(part)
+            points.append(seconds)
+    return points
+
+
+def point_label(point):
+    if point == RESULT_POINT:
+        return point
+    return '{0:g}s'.format(point)
+
+
+def capture_png(adb_cmd):
+    # straight from screencap's stdout into memory, nothing is written to
+    # /sdcard that would need pulling and removing
+    with span('screencap'):
+        png = call_adb(adb_cmd, ['exec-out', 'screencap', '-p'])
+    if not png.startswith(PNG_SIGNATURE):
+        return None
+    return png
+
+
+def shrink(png, width, quality):
+    # -> (data, extension), a jpeg at most `width` pixels wide
+    if Image is None:
+        return png, 'png'
+    with Image.open(io.BytesIO(png)) as image:
+        image = image.convert('RGB')
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                 Image.BILINEAR)
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality, optimize=True)
+    return out.getvalue(), 'jpg'
+
+
+class ScreenshotStore:
+    # Screenshots on disk under the sha256 of what is stored,
+    # <root>/ab/ab12....jpg, so a frame that shows up again (a loading
+    # screen, an app that hangs) is kept once. Captures and shrinking run in
+    # pools of their own, the test loop only waits for the references.
+    def __init__(self, root, width=DEFAULT_WIDTH, quality=JPEG_QUALITY, workers=2, capture_workers=4):
+        self.root = root
+        self.width = width
+        self.quality = quality
+        self.captured = 0
+        self.stored = 0
+        self._lock = threading.Lock()
+        # sha256 of a captured png -> future of its reference
+        self._seen = {}
+        self._capture_pool = concurrent.futures.ThreadPoolExecutor(max_workers=capture_workers,
+                                                                   thread_name_prefix='screencap')
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                           thread_name_prefix='screenshots')
+        if Image is None:
+            print('Pillow is not installed, screenshots are stored without shrinking them')
+
+    def capture(self, adb_cmd):
+        # -> future of the reference of what the device shows right now,
+        # None when it couldn't be taken
+        return self._capture_pool.submit(self._capture, adb_cmd)
+
+    def _capture(self, adb_cmd):
+        try:
+            png = capture_png(adb_cmd)
+        except ProgramError as e:
+            print('Screenshot failed:', e)
+            return None
+        if png is None:
+            return None
+        return self.add(png).result()
+
+    def add(self, png):
+        # -> future of the reference, a png seen before isn't shrunk again
+        digest = hashlib.sha256(png).hexdigest()
+        with self._lock:
+            self.captured += 1
+            future = self._seen.get(digest)
+            if future is None:
+                future = self._pool.submit(self._store, png)
+                self._seen[digest] = future
+            return future
+
+    def _store(self, png):
+        with span('store screenshot'):
+            data, extension = shrink(png, self.width, self.quality)
+        digest = hashlib.sha256(data).hexdigest()
+        name = digest[:2] + '/' + digest + '.' + extension
+        path = os.path.join(self.root, digest[:2], digest + '.' + extension)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written in one go so a crash never leaves half an image
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.shot')
+            with os.fdopen(fd, 'wb') as out_f:
+                out_f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.stored += 1
+        return {'sha256' : digest, 'path' : name, 'bytes' : len(data)}
+
+    def close(self):
+        self._capture_pool.shutdown(wait=True)
+        self._pool.shutdown(wait=True)
+
+
+class TestScreenshots:
+    # The captures of one test on one device. start() is called when the
+    # app was started and arms a timer per point, finish() takes the result
+    # point and drops the timers that didn't fire yet.
+    def __init__(self, adb_cmd, store, points):
+        self.adb_cmd = adb_cmd
+        self.store = store
+        self.points = points
+        self.attempt = 0
+        self._lock = threading.Lock()
+        self._timers = []
+        self._taken = []
+
+    def start(self):
+        self.attempt += 1
+        for point in self.points:
+            if point != RESULT_POINT:
+                timer = threading.Timer(point, self._take, (point, self.attempt))
+                timer.daemon = True
+                self._timers.append(timer)
+                timer.start()
+
+    def _take(self, point, attempt):
+        future = self.store.capture(self.adb_cmd)
+        with self._lock:
+            self._taken.append((point_label(point), attempt, future))
+
+    def finish(self, got_result):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        if got_result and RESULT_POINT in self.points:
+            self._take(RESULT_POINT, self.attempt)
+
+    def collect(self, timeout=30):
+        # -> [{'point', 'attempt', 'sha256', 'path', 'bytes'}] of the test,
+        # and starts over for the next one
+        with self._lock:
+            taken = self._taken
+            self._taken = []
+        self.attempt = 0
+        refs = []
+        for point, attempt, future in taken:
+            try:
+                ref = future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                ref = None
+            if ref is not None:
+                refs.append(dict(ref, point=point, attempt=attempt))
+        return refs
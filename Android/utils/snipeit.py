@@ -0,0 +1,139 @@
+import concurrent.futures
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+
+SNIPEIT_URL = 'https://snipe-it.hq.unity3d.com/api/v1/hardware'
+CACHE_NAME = 'snipeit_cache.json'
+# a serial keeps its name and asset tag, older entries are still used but
+# refreshed in the background
+CACHE_TTL_S = 7 * 24 * 3600
+UNKNOWN = ('Unknown', 'Unknown')
+
+
+def load_config(path='config.json'):
+    # -> (key, url) from config.json, the url only needs setting for a
+    # stand-in like utils/fake_snipeit_server.py
+    try:
+        with open(path) as json_file:
+            config_data = json.load(json_file)
+    except (OSError, ValueError) as e:
+        print('No Snipe-it config in', path, '(' + str(e) + '), device names will be Unknown')
+        return None, SNIPEIT_URL
+    return config_data.get('snipeItKey'), config_data.get('snipeItUrl', SNIPEIT_URL)
+
+
+def parse_hardware(data, serial):
+    # -> (name, asset tag) of the row for this serial, the search also
+    # matches other fields so an exact serial wins over the first row
+    rows = data.get('rows') or []
+    if len(rows) == 0:
+        return None
+    row = next((r for r in rows if r.get('serial') == serial), rows[0])
+    return row.get('name') or UNKNOWN[0], row.get('asset_tag') or UNKNOWN[1]
+
+
+class SnipeItCache:
+    # Device names and asset tags from Snipe-it, kept in a json file keyed
+    # by serial. Lookups answer from the file and only wait for the service
+    # when a serial was never seen, stale entries are refreshed in the
+    # background and kept when the service can't be reached.
+    def __init__(self, path, key, url=SNIPEIT_URL, ttl=CACHE_TTL_S, timeout=5, workers=4):
+        self.path = path
+        self.key = key
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        # reentrant, a done callback can run right away in _refresh
+        self._lock = threading.RLock()
+        self._entries = self._load()
+        self._pending = {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                           thread_name_prefix='snipeit')
+
+    def _load(self):
+        try:
+            with open(self.path) as in_f:
+                return json.load(in_f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # called with the lock held, replaced in one go so a crash never
+        # leaves half a file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snipeit')
+        with os.fdopen(fd, 'w') as out_f:
+            json.dump(self._entries, out_f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _fetch(self, serial):
+        headers = {'accept' : 'application/json', 'content-type' : 'application/json',
+                   'Authorization' : self.key}
+        try:
+            r = requests.get(self.url, params={'search' : serial}, headers=headers, timeout=self.timeout)
+            r.raise_for_status()
+            found = parse_hardware(r.json(), serial)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print('Failed to look up', serial, 'in Snipe-it:', e)
+            return None
+        if found is None:
+            print(serial, 'is not in Snipe-it')
+            found = UNKNOWN
+        entry = {'name' : found[0], 'tag' : found[1], 'fetched' : time.time()}
+        with self._lock:
+            self._entries[serial] = entry
+            self._save()
+        return entry
+
+    def _refresh(self, serial):
+        # -> future of the entry, one request per serial at a time
+        with self._lock:
+            future = self._pending.get(serial)
+            if future is None:
+                future = self._pool.submit(self._fetch, serial)
+                self._pending[serial] = future
+                future.add_done_callback(lambda f: self._done(serial, f))
+            return future
+
+    def _done(self, serial, future):
+        with self._lock:
+            if self._pending.get(serial) is future:
+                del self._pending[serial]
+
+    def _is_fresh(self, entry):
+        return time.time() - entry['fetched'] < self.ttl
+
+    def prefetch(self, serials):
+        # looks up every serial without a fresh entry at once and waits for
+        # them, so the device threads start with their names at hand
+        if self.key is None:
+            return
+        with self._lock:
+            todo = [s for s in serials if s is not None and
+                    (s not in self._entries or not self._is_fresh(self._entries[s]))]
+        futures = [self._refresh(serial) for serial in todo]
+        concurrent.futures.wait(futures, timeout=self.timeout * 2)
+
+    def lookup(self, serial):
+        # -> (name, asset tag)
+        if serial is None or self.key is None:
+            return UNKNOWN
+        with self._lock:
+            entry = self._entries.get(serial)
+        if entry is None:
+            try:
+                entry = self._refresh(serial).result(timeout=self.timeout * 2)
+            except concurrent.futures.TimeoutError:
+                entry = None
+            if entry is None:
+                return UNKNOWN
+        elif not self._is_fresh(entry):
+            self._refresh(serial)
+        return entry['name'], entry['tag']
+
+    def close(self):
+        self._pool.shutdown(wait=True)
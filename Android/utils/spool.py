@@ -0,0 +1,270 @@
+import glob
+import json
+import os
+import threading
+import requests
+
+SENT_SUFFIX = '.sent'
+REJECTED_SUFFIX = '.rejected'
+
+
+def make_record(method, url, body, content_type='application/json'):
+    if not isinstance(body, str):
+        body = json.dumps(body, default=str)
+    return {'method' : method, 'url' : url, 'body' : body, 'content_type' : content_type}
+
+
+class Spool:
+    # Append-only JSONL journal of HTTP requests that still have to reach
+    # Elasticsearch. The byte offset of the first unsent record is kept next
+    # to it in <path>.sent, so a crash or a dead server never loses results.
+    def __init__(self, path):
+        self.path = path
+        self.sent_path = path + SENT_SUFFIX
+        self.rejected_path = path + REJECTED_SUFFIX
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as out_f:
+                out_f.write(line)
+                out_f.flush()
+                os.fsync(out_f.fileno())
+            if self._pending is not None:
+                self._pending += 1
+
+    def sent_offset(self):
+        try:
+            with open(self.sent_path, 'r') as in_f:
+                return int(in_f.read().strip() or 0)
+        except (EnvironmentError, ValueError):
+            return 0
+
+    def read_pending(self, limit):
+        # returns (record, offset after the record) pairs
+        entries = []
+        if not os.path.isfile(self.path):
+            return entries
+        offset = self.sent_offset()
+        with open(self.path, 'rb') as in_f:
+            in_f.seek(offset)
+            while len(entries) < limit:
+                line = in_f.readline()
+                # a half written last line is picked up once it is complete
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                entries.append((json.loads(line.decode('utf-8')), offset))
+        return entries
+
+    def mark_sent(self, offset, count):
+        tmp_path = self.sent_path + '.tmp'
+        with open(tmp_path, 'w') as out_f:
+            out_f.write(str(offset))
+            out_f.flush()
+            os.fsync(out_f.fileno())
+        os.replace(tmp_path, self.sent_path)
+        with self._lock:
+            if self._pending is not None:
+                self._pending = max(self._pending - count, 0)
+
+    def reject(self, record, reason):
+        print('Elasticsearch rejected request to', record['url'], reason)
+        with open(self.rejected_path, 'a') as out_f:
+            out_f.write(json.dumps({'record' : record, 'reason' : reason}) + '\n')
+
+    def pending_count(self):
+        with self._lock:
+            if self._pending is None:
+                self._pending = 0
+                if os.path.isfile(self.path):
+                    with open(self.path, 'rb') as in_f:
+                        in_f.seek(self.sent_offset())
+                        self._pending = sum(1 for line in in_f if line.endswith(b'\n'))
+            return self._pending
+
+    def remove_if_done(self):
+        with self._lock:
+            if not os.path.isfile(self.path):
+                return True
+            if self.sent_offset() < os.path.getsize(self.path):
+                return False
+            for path in [self.path, self.sent_path]:
+                if os.path.isfile(path):
+                    os.remove(path)
+            self._pending = None
+            return True
+
+
+def merge_records(entries):
+    # consecutive _bulk requests to the same url are sent as one ndjson body,
+    # returns (record, number of records merged, offset after the last one)
+    merged = []
+    for record, offset in entries:
+        if (len(merged) > 0 and record['url'].endswith('/_bulk') and
+                merged[-1][0]['url'] == record['url']):
+            last, count, _ = merged[-1]
+            merged[-1] = (dict(last, body=last['body'] + record['body']), count + 1, offset)
+        else:
+            merged.append((record, 1, offset))
+    return merged
+
+
+def send_record(record, timeout):
+    headers = {'Content-Type' : record.get('content_type', 'application/json')}
+    return requests.request(record.get('method', 'POST'), record['url'],
+                            data = record['body'].encode('utf-8'),
+                            headers = headers, timeout = timeout)
+
+
+def split_bulk_actions(body):
+    # ndjson _bulk body -> the lines of every action, its source line
+    # included (delete is the only action without one)
+    actions = []
+    lines = [line for line in body.split('\n') if line.strip()]
+    i = 0
+    while i < len(lines):
+        size = 1 if 'delete' in json.loads(lines[i]) else 2
+        actions.append(''.join(line + '\n' for line in lines[i:i + size]))
+        i += size
+    return actions
+
+
+def is_retryable(status):
+    # the server is overloaded or failing, the same request may pass later
+    return status in (408, 429) or status >= 500
+
+
+def handle_bulk_errors(spool, record, r):
+    # _bulk answers 200 even if some of its actions failed. Those the server
+    # pushed back on (429, 5xx) go to the end of the spool again, together
+    # with every later action on the same document so an update never
+    # overtakes its upsert. The rest failed for good and go to the rejected
+    # journal one by one, as a _bulk request of their own.
+    # -> amount of actions spooled again
+    try:
+        json_r = r.json()
+    except ValueError:
+        return 0
+    if not json_r.get('errors'):
+        return 0
+    actions = split_bulk_actions(record['body'])
+    retried_ids = set()
+    retried = 0
+    for i, item in enumerate(json_r.get('items', [])):
+        for action in item.values():
+            error = action.get('error')
+            if error is None or i >= len(actions):
+                continue
+            status = action.get('status') or 0
+            if is_retryable(status) or action.get('_id') in retried_ids:
+                retried_ids.add(action.get('_id'))
+                spool.append(dict(record, body=actions[i]))
+                retried += 1
+            else:
+                reason = '{0} ({1}): {2}'.format(error.get('type'), status, error.get('reason'))
+                spool.reject(dict(record, body=actions[i]), reason)
+    return retried
+
+
+def drain_spool(spool, batch_size=100, timeout=30):
+    # returns True when everything was sent, False if the server could not
+    # be reached or pushed back and the remaining records have to be
+    # retried later
+    while True:
+        entries = spool.read_pending(batch_size)
+        if len(entries) == 0:
+            return True
+        for record, count, offset in merge_records(entries):
+            try:
+                r = send_record(record, timeout)
+            except requests.exceptions.RequestException as e:
+                print('Unable to reach Elasticsearch, keeping results in', spool.path, e)
+                return False
+            if is_retryable(r.status_code):
+                print('Elasticsearch is not accepting requests (' + str(r.status_code) + '), keeping results in', spool.path)
+                return False
+            if r.status_code == 413 and count > 1:
+                # too big as one request, the same records go again in
+                # smaller merged batches
+                batch_size = max(count // 2, 1)
+                break
+            retried = 0
+            if not r.ok:
+                spool.reject(record, r.text)
+            elif record['url'].endswith('/_bulk'):
+                retried = handle_bulk_errors(spool, record, r)
+            spool.mark_sent(offset, count)
+            if retried > 0:
+                print('Elasticsearch pushed back on', retried, 'documents, keeping them in', spool.path)
+                return False
+
+
+class SpoolSender:
+    # Background thread draining a spool, so the device loop only ever waits
+    # for a local file append. Retries back off up to max_backoff seconds.
+    def __init__(self, spool, batch_size=100, flush_interval=30, timeout=30, max_backoff=300):
+        self.spool = spool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self._failing = False
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        # while the server is down only the backoff timer triggers a retry
+        if not self._failing:
+            self._wake.set()
+
+    def _run(self):
+        backoff = self.flush_interval
+        while not self._closed.is_set():
+            self._wake.wait(backoff)
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            if drain_spool(self.spool, self.batch_size, self.timeout):
+                self._failing = False
+                backoff = self.flush_interval
+            else:
+                self._failing = True
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        if drain_spool(self.spool, self.batch_size, self.timeout):
+            self.spool.remove_if_done()
+        else:
+            print('Results that were not sent are kept in', self.spool.path, 'use --replay-spool to send them')
+
+
+def spool_path(spool_dir, name):
+    if (os.path.isdir(spool_dir)) is False:
+        os.makedirs(spool_dir, exist_ok=True)
+    return os.path.join(spool_dir, name + '_' + str(os.getpid()) + '.jsonl')
+
+
+def replay_spools(spool_dir, timeout=30):
+    paths = sorted(glob.glob(os.path.join(spool_dir, '*.jsonl')))
+    if len(paths) == 0:
+        print('Nothing to replay in', spool_dir)
+        return True
+    done = True
+    for path in paths:
+        spool = Spool(path)
+        print('Replaying', spool.pending_count(), 'requests from', path)
+        if drain_spool(spool, timeout=timeout):
+            spool.remove_if_done()
+        else:
+            done = False
+    return done
@@ -0,0 +1,198 @@
+import itertools
+import math
+import re
+import numpy as np
+
+# the one number format of results, parse_value() reads it everywhere
+NUMBER = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?')
+
+MAD_THRESHOLD = 3.5
+# with fewer values the median and MAD say too little to call one an outlier
+MAD_MIN_VALUES = 8
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+ALPHA = 0.05
+
+
+def parse_value(payload):
+    # "16.510", " 21.52ms" -> float, anything without a number -> nan. In
+    # "Scene name: Test_01 | Frame time: 21.52ms" the value is what follows
+    # the last ':', not the 01 of the scene name.
+    if payload is None:
+        return math.nan
+    if isinstance(payload, (int, float)):
+        return float(payload)
+    payload = str(payload)
+    m = NUMBER.search(payload.rpartition(':')[2])
+    if m is None or 'Skipped' in payload:
+        return math.nan
+    return float(m.group(0))
+
+
+def to_array(payloads):
+    values = np.array([parse_value(p) for p in payloads], dtype=float)
+    return values[~np.isnan(values)]
+
+
+def mad_filter(values, threshold=MAD_THRESHOLD):
+    # modified z-score (Iglewicz and Hoaglin), robust to the outliers it removes
+    if len(values) < MAD_MIN_VALUES:
+        return values, 0
+    median = np.median(values)
+    mad = np.median(np.abs(values - median))
+    if mad == 0:
+        return values, 0
+    keep = np.abs(0.6745 * (values - median) / mad) <= threshold
+    return values[keep], int(len(values) - keep.sum())
+
+
+def bootstrap_ci(values, rng, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE):
+    if len(values) < 2:
+        return math.nan, math.nan
+    idx = rng.integers(0, len(values), size=(samples, len(values)))
+    means = values[idx].mean(axis=1)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def summarize(payloads, rng=None, reject_outliers=True):
+    if rng is None:
+        # fixed seed so the same results always give the same report
+        rng = np.random.default_rng(0)
+    raw = to_array(payloads)
+    if reject_outliers:
+        values, outliers = mad_filter(raw)
+    else:
+        values, outliers = raw, 0
+    summary = {
+        'n' : len(values),
+        'failed' : len(payloads) - len(raw),
+        'outliers' : outliers,
+        'values' : values,
+    }
+    if len(values) == 0:
+        return summary
+    p90, p95 = np.percentile(values, [90, 95])
+    ci_low, ci_high = bootstrap_ci(values, rng)
+    summary.update({
+        'mean' : float(values.mean()),
+        'median' : float(np.median(values)),
+        'p90' : float(p90),
+        'p95' : float(p95),
+        'std' : float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+        'ci_low' : ci_low,
+        'ci_high' : ci_high,
+    })
+    return summary
+
+
+def rankdata(values):
+    # 1-based ranks, ties get the average of the ranks they span
+    order = np.argsort(values, kind='mergesort')
+    _, first, counts = np.unique(values[order], return_index=True, return_counts=True)
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(first + (counts + 1) / 2.0, counts)
+    return ranks, counts
+
+
+def mann_whitney_u(a, b):
+    # two sided test with tie and continuity correction, normal approximation
+    n1, n2 = len(a), len(b)
+    ranks, counts = rankdata(np.concatenate([a, b]))
+    u1 = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    ties = float((counts ** 3 - counts).sum())
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return float(u1), 1.0
+    z = (abs(u1 - n1 * n2 / 2.0) - 0.5) / sigma
+    return float(u1), min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def cliffs_delta(a, b):
+    # share of pairs where a > b minus share where a < b, in [-1, 1]
+    return float(np.sign(a[:, None] - b[None, :]).mean())
+
+
+def hedges_g(a, b):
+    n1, n2 = len(a), len(b)
+    pooled = ((n1 - 1) * a.var(ddof=1) + (n2 - 1) * b.var(ddof=1)) / (n1 + n2 - 2)
+    if pooled == 0:
+        return math.nan
+    correction = 1 - 3 / (4.0 * (n1 + n2) - 9)
+    return float((b.mean() - a.mean()) / math.sqrt(pooled) * correction)
+
+
+def compare(a, b):
+    if len(a) < 2 or len(b) < 2:
+        return None
+    u, p_value = mann_whitney_u(a, b)
+    return {
+        'diff' : float(b.mean() - a.mean()),
+        'relative' : float((b.mean() - a.mean()) / a.mean() * 100) if a.mean() != 0 else math.nan,
+        'hedges_g' : hedges_g(a, b),
+        'cliffs_delta' : cliffs_delta(b, a),
+        'u' : u,
+        'p_value' : p_value,
+        'significant' : p_value < ALPHA,
+    }
+
+
+def group_results(apk_names, result_sets, scene_parser=None):
+    # -> {scene: {apk_name: [payloads]}}, scene is None for plain results
+    groups = {}
+    for apk_name, result_set in zip(apk_names, result_sets):
+        for result in result_set:
+            scenes = scene_parser(result) if scene_parser is not None else None
+            if not scenes:
+                scenes = [(None, result)]
+            for scene_name, payload in scenes:
+                scene = scene_name.strip() if scene_name is not None else None
+                groups.setdefault(scene, {}).setdefault(apk_name, []).append(payload)
+    return groups
+
+
+def format_number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return '-'
+    return '{0:.3f}'.format(value)
+
+
+def format_summary(apk_names, result_sets, scene_parser=None):
+    lines = ['Summary (outliers removed with MAD > ' + str(MAD_THRESHOLD) +
+             ' from ' + str(MAD_MIN_VALUES) + ' runs on, ' + str(int(CONFIDENCE * 100)) + '% bootstrap CI of the mean)']
+    groups = group_results(apk_names, result_sets, scene_parser)
+    for scene, by_apk in groups.items():
+        if scene is not None:
+            lines.append('Scene: ' + scene)
+        summaries = {}
+        for apk_name in apk_names:
+            if apk_name not in by_apk:
+                continue
+            s = summarize(by_apk[apk_name])
+            summaries[apk_name] = s
+            if s['n'] == 0:
+                lines.append('  {0}: no numeric results ({1} failed)'.format(apk_name, s['failed']))
+                continue
+            lines.append('  {0}: n={1} mean={2} median={3} p90={4} p95={5} std={6} '
+                         'CI=[{7}, {8}] outliers={9} failed={10}'.format(
+                             apk_name, s['n'], format_number(s['mean']),
+                             format_number(s['median']), format_number(s['p90']),
+                             format_number(s['p95']), format_number(s['std']),
+                             format_number(s['ci_low']), format_number(s['ci_high']),
+                             s['outliers'], s['failed']))
+        for name_a, name_b in itertools.combinations(list(summaries.keys()), 2):
+            c = compare(summaries[name_a]['values'], summaries[name_b]['values'])
+            if c is None:
+                continue
+            verdict = 'no significant difference'
+            if c['significant']:
+                verdict = 'B is ' + ('higher' if c['diff'] > 0 else 'lower')
+            lines.append('  A/B {0} vs {1}: diff={2} ({3}%) hedges_g={4} cliffs_delta={5} '
+                         'U={6} p={7} -> {8}'.format(
+                             name_a, name_b, format_number(c['diff']),
+                             format_number(c['relative']), format_number(c['hedges_g']),
+                             format_number(c['cliffs_delta']), format_number(c['u']),
+                             format_number(c['p_value']), verdict))
+    return '\n'.join(lines) + '\n'
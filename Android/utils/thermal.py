@@ -0,0 +1,124 @@
+import json
+import re
+import time
+from utils.adb_client import call_adb
+
+SECTION_MARKER = '----THERMALSERVICE----'
+# one shell round trip for everything the gate looks at
+STATE_COMMAND = ['shell', 'dumpsys', 'battery', ';', 'echo', SECTION_MARKER, ';',
+                 'dumpsys', 'thermalservice']
+
+BATTERY_STATUS = {'1': 'unknown', '2': 'charging', '3': 'discharging',
+                  '4': 'not charging', '5': 'full'}
+TEMPERATURE_TYPES = {'0': 'cpu', '1': 'gpu', '2': 'battery', '3': 'skin'}
+
+_BATTERY_FIELD = re.compile(r'^\s*([A-Za-z ]+):\s*(.*)$')
+_THERMAL_STATUS = re.compile(r'Thermal Status:\s*(\d+)')
+_TEMPERATURE = re.compile(r'Temperature\{mValue=([-\d.]+), mType=(-?\d+), mName=([^,]*),')
+
+
+class DeviceState:
+    def __init__(self):
+        self.level = None
+        self.battery_temperature = None
+        self.status = 'unknown'
+        self.plugged = False
+        self.thermal_status = None
+        self.temperatures = {}
+
+    def max_temperature(self, kind):
+        values = [value for (name, value_kind), value in self.temperatures.items()
+                  if value_kind == kind]
+        if len(values) == 0:
+            return None
+        return max(values)
+
+    def level_line(self):
+        # same text `dumpsys battery | grep level` gave, the reports keep it
+        return 'level: ' + str(self.level)
+
+    def to_dict(self):
+        return {
+            'level' : self.level,
+            'battery_temperature' : self.battery_temperature,
+            'status' : self.status,
+            'plugged' : self.plugged,
+            'thermal_status' : self.thermal_status,
+            'cpu_temperature' : self.max_temperature('cpu'),
+            'skin_temperature' : self.max_temperature('skin'),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def __str__(self):
+        return ', '.join(key + '=' + str(value) for key, value in self.to_dict().items())
+
+
+def parse_device_state(out):
+    state = DeviceState()
+    battery, _, thermal = out.partition(SECTION_MARKER)
+    for line in battery.splitlines():
+        m = _BATTERY_FIELD.match(line)
+        if m is None:
+            continue
+        key, value = m.group(1).strip(), m.group(2).strip()
+        if key == 'level':
+            state.level = int(value)
+        elif key == 'temperature':
+            state.battery_temperature = int(value) / 10.0
+        elif key == 'status':
+            state.status = BATTERY_STATUS.get(value, value)
+        elif key.endswith('powered') and value == 'true':
+            state.plugged = True
+    m = _THERMAL_STATUS.search(thermal)
+    if m is not None:
+        state.thermal_status = int(m.group(1))
+    # prefer live HAL values over the cached ones when both are listed
+    section = thermal.partition('Current temperatures from HAL')
+    for m in _TEMPERATURE.finditer(section[2] or thermal):
+        kind = TEMPERATURE_TYPES.get(m.group(2), m.group(2))
+        state.temperatures[(m.group(3), kind)] = float(m.group(1))
+    return state
+
+
+def read_device_state(adb_cmd):
+    out = call_adb(adb_cmd, STATE_COMMAND, check_returncode=False)
+    return parse_device_state(out.decode('utf-8', errors='ignore'))
+
+
+def gate_reasons(state, max_temp=None, max_thermal_status=None, min_battery=None):
+    reasons = []
+    if max_temp is not None and state.battery_temperature is not None and \
+            state.battery_temperature > max_temp:
+        reasons.append('battery at ' + str(state.battery_temperature) + 'C')
+    if max_thermal_status is not None and state.thermal_status is not None and \
+            state.thermal_status > max_thermal_status:
+        reasons.append('thermal status ' + str(state.thermal_status))
+    if min_battery is not None and state.level is not None and state.level < min_battery:
+        if state.status == 'charging' or state.plugged:
+            reasons.append('battery charging at ' + str(state.level) + '%')
+        else:
+            print('Battery at ' + str(state.level) + '% and not charging, not waiting for it')
+    return reasons
+
+
+def wait_for_device(adb_cmd, max_temp=None, max_thermal_status=None, min_battery=None,
+                    timeout=30*60, poll=30):
+    # Blocks until the device is cool (and charged) enough to start a test,
+    # returns the state the test started with.
+    start = time.time()
+    state = read_device_state(adb_cmd)
+    reasons = gate_reasons(state, max_temp, max_thermal_status, min_battery)
+    while len(reasons) > 0:
+        if time.time() - start > timeout:
+            print('Device still not ready after', timeout, 's (' + ', '.join(reasons) + '), starting anyway')
+            break
+        print('Waiting for device: ' + ', '.join(reasons))
+        time.sleep(poll)
+        state = read_device_state(adb_cmd)
+        reasons = gate_reasons(state, max_temp, max_thermal_status, min_battery)
+    waited = time.time() - start
+    if waited >= 1:
+        print('Device ready after waiting {0:.0f}s'.format(waited))
+    return state
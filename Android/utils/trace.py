@@ -0,0 +1,97 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    # Records how long the runner spends in each phase as spans in the
+    # Chrome trace event format, open the written file in chrome://tracing
+    # or ui.perfetto.dev. Every device thread is its own track. Disabled
+    # unless enabled, span() is then close to free.
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self._start = time.perf_counter()
+
+    def add_span(self, name, category, start, end, args=None):
+        thread = threading.current_thread()
+        event = {
+            'name' : name,
+            'cat' : category,
+            'ph' : 'X',
+            'ts' : round((start - self._start) * 1e6, 1),
+            'dur' : round((end - start) * 1e6, 1),
+            'pid' : os.getpid(),
+            'tid' : thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category='phase', **args):
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            self.add_span(name, category, start, time.perf_counter(), args)
+
+    def to_chrome(self):
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        pid = os.getpid()
+        metadata = [{'name' : 'thread_name', 'ph' : 'M', 'pid' : pid, 'tid' : tid,
+                     'args' : {'name' : name}} for tid, name in threads.items()]
+        return {'traceEvents' : metadata + events, 'displayTimeUnit' : 'ms'}
+
+    def write(self, path):
+        with open(path, 'w') as out_f:
+            json.dump(self.to_chrome(), out_f)
+
+    def summary(self):
+        # -> {(category, name): [count, total s, max s]}
+        phases = {}
+        with self._lock:
+            for event in self.events:
+                phase = phases.setdefault((event['cat'], event['name']), [0, 0.0, 0.0])
+                phase[0] += 1
+                phase[1] += event['dur'] / 1e6
+                phase[2] = max(phase[2], event['dur'] / 1e6)
+        return phases
+
+    def format_summary(self):
+        phases = self.summary()
+        lines = ['Time per phase (count, total, mean, max in s)']
+        for (category, name), (count, total, longest) in sorted(
+                phases.items(), key=lambda item: -item[1][1]):
+            lines.append('  {0:<8} {1:<32} {2:>5} {3:>10.2f} {4:>8.2f} {5:>8.2f}'.format(
+                category, name, count, total, total / count, longest))
+        return '\n'.join(lines) + '\n'
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, category='phase', **args):
+    return _tracer.span(name, category, **args)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Stand-in for ios-deploy to try ios-runner.py without a device:
+#   FAKE_IOS_DEVICES=00008020-FAKE0001,00008020-FAKE0002 python ios-runner.py a b \
+#       --device 00008020-FAKE0001,00008020-FAKE0002 --ios-deploy ./fake_ios_deploy.py
+# It behaves like a Unity player that logs ZZRES>> after FAKE_IOS_RUN_TIME
+# seconds and then keeps running, like a real test app that never quits.
+#   FAKE_IOS_RUN_TIME     seconds until the result (default 2)
+#   FAKE_IOS_FAIL_RATE    share of runs that never log a result (default 0)
+#   FAKE_IOS_APP_TIME     seconds until the app exits by itself (default 600)
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+DEFAULT_DEVICES = '00008020-FAKE0001'
+
+
+def say(line):
+    print(line, flush=True)
+
+
+def devices():
+    return os.environ.get('FAKE_IOS_DEVICES', DEFAULT_DEVICES).split(',')
+
+
+def app_baseline(path):
+    # every app gets its own stable frame time between 14 and 20ms
+    digest = hashlib.md5(os.path.basename(os.path.normpath(path)).encode('utf-8')).digest()
+    return 14.0 + digest[0] / 255.0 * 6.0
+
+
+def detect():
+    say('[....] Waiting up to 5 seconds for iOS device to be connected')
+    for i, udid in enumerate(devices()):
+        say("[....] Found {0} (D321AP, iPhone XS, iphoneos, arm64e, 14.4, 18D52) a.k.a. 'Test iPhone {1}' "
+            "connected through USB.".format(udid, i + 1))
+    return 0
+
+
+def run(args):
+    udid = args.id or devices()[0]
+    if udid not in devices():
+        say('[....] Waiting up to 5 seconds for iOS device to be connected')
+        say('[ !! ] Timed out waiting for device.')
+        return 253
+    if not os.path.exists(args.bundle):
+        say("[ !! ] Can't access app path '{0}' : No such file or directory".format(args.bundle))
+        return 1
+    run_time = float(os.environ.get('FAKE_IOS_RUN_TIME', 2))
+    fail_rate = float(os.environ.get('FAKE_IOS_FAIL_RATE', 0))
+    app_time = float(os.environ.get('FAKE_IOS_APP_TIME', 600))
+    rng = random.Random()
+    say('[....] Using {0} (D321AP, iPhone XS, iphoneos, arm64e, 14.4, 18D52).'.format(udid))
+    if args.uninstall:
+        say('------ Uninstall phase ------')
+        say('[ OK ] Uninstalled package with bundle id com.perf.bench')
+    say('------ Install phase ------')
+    for percent in (5, 30, 60, 90, 100):
+        time.sleep(0.05)
+        say('[{0:3d}%] Copying {1} to device'.format(percent, args.bundle))
+    say('[100%] Installed package ' + args.bundle)
+    say('------ Debug phase ------')
+    say('Starting debug of {0} (D321AP, iPhone XS, iphoneos, arm64e, 14.4, 18D52) connected through USB...'.format(udid))
+    say('(lldb) run')
+    say('success')
+    say('Built from \'2020.3/staging\' branch, Version \'2020.3.1f1 (77a89f25062f)\', Build type \'Release\'')
+    fails = rng.random() < fail_rate
+    started = time.time()
+    frame = 0
+    while time.time() - started < app_time:
+        time.sleep(0.05)
+        frame += 1
+        say('Frame {0} gfx jobs done, batches 412, tris 183224'.format(frame))
+        if run_time is not None and time.time() - started >= run_time:
+            run_time = None
+            if not fails:
+                say('ZZRES>>{0:.3f}'.format(rng.gauss(app_baseline(args.bundle), 0.3)))
+    say('Process {0} exited with status = 0 (0x00000000)'.format(rng.randint(300, 900)))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fake_ios_deploy')
+    parser.add_argument('-c', '--detect', action='store_true')
+    parser.add_argument('-b', '--bundle', type=str, default=None)
+    parser.add_argument('-i', '--id', type=str, default=None)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-u', '--unbuffered', action='store_true')
+    parser.add_argument('-I', '--noninteractive', action='store_true')
+    parser.add_argument('-r', '--uninstall', action='store_true')
+    args = parser.parse_args()
+    if args.detect:
+        return detect()
+    if args.bundle is None:
+        say('Usage: fake_ios_deploy.py -c | -b <app> [-i <udid>] [-v] [-u] [-I]')
+        return 1
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
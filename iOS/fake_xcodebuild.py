@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Stand-in for xcodebuild to try the build cache of ios-runner.py:
+#   python ios-runner.py projA projB --xcodebuild ./fake_xcodebuild.py ...
+# Builds <ProductName>.app into CONFIGURATION_BUILD_DIR after
+# FAKE_XCODEBUILD_TIME seconds (default 2). Every build is appended to
+# FAKE_XCODEBUILD_LOG when set, so a test can count them. A project with a
+# file called BUILD_FAILS fails to build.
+
+import os
+import sys
+import time
+
+
+def main(argv):
+    project = None
+    build_dir = None
+    i = 0
+    while i < len(argv):
+        if argv[i] in ('-project', '-scheme', '-derivedDataPath', '-configuration'):
+            if argv[i] == '-project':
+                project = argv[i + 1]
+            i += 1
+        elif argv[i].startswith('CONFIGURATION_BUILD_DIR='):
+            build_dir = argv[i].split('=', 1)[1]
+        i += 1
+    if project is None or not os.path.isdir(project):
+        print('xcodebuild: error: project not found: {0}'.format(project))
+        return 66
+    source = os.path.dirname(os.path.abspath(project))
+    log = os.environ.get('FAKE_XCODEBUILD_LOG')
+    if log:
+        with open(log, 'a') as log_f:
+            log_f.write(source + '\n')
+    print('Build settings from command line:')
+    print('    CONFIGURATION_BUILD_DIR = {0}'.format(build_dir))
+    time.sleep(float(os.environ.get('FAKE_XCODEBUILD_TIME', 2)))
+    if os.path.exists(os.path.join(source, 'BUILD_FAILS')):
+        print('** BUILD FAILED **')
+        return 65
+    app = os.path.join(build_dir or os.getcwd(), 'ProductName.app')
+    os.makedirs(app, exist_ok=True)
+    with open(os.path.join(app, 'Info.plist'), 'w') as plist:
+        plist.write('<plist><dict><key>CFBundleIdentifier</key><string>com.perf.bench</string></dict></plist>\n')
+    with open(os.path.join(app, 'ProductName'), 'wb') as binary:
+        binary.write(os.urandom(1024))
+    print('** BUILD SUCCEEDED **')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,66 +1,195 @@
 import subprocess
 import argparse
+import concurrent.futures
+import glob
+import hashlib
+import queue
+import re
+import shutil
 import sys
+import tempfile
+import threading
 import time
 import os
 
-def run_on_ios(ios_device, path,sleep):
+IOS_DEPLOY = 'ios-deploy'
+XCODEBUILD = 'xcodebuild'
+RESULT_IDENT = 'ZZRES>>'
+BUILD_CACHE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'build_cache')
+# part of every fingerprint, a change here has to rebuild everything
+BUILD_SETTINGS = ['-scheme', 'Unity-iPhone', '-allowProvisioningUpdates']
+# build outputs and per user state inside a project, not inputs of the build
+SKIPPED_DIRS = ('build', 'DerivedData', 'xcuserdata')
+SKIPPED_FILES = ('.DS_Store',)
+
+def read_lines(stream, lines):
+    for raw in stream:
+        lines.put(raw.decode('utf-8', errors='ignore').rstrip('\r\n'))
+    lines.put(None)
+
+def stop_session(p):
+    if p.poll() is not None:
+        return
+    p.terminate()
     try:
-        p = subprocess.check_output(["ios-deploy",
-        "-b",  path,
-        "-i", ios_device,
-        "-v",
-        "-u",
-        "-I"])
-        out = str(p,'utf-8')
-        lines= out.splitlines()
-    except subprocess.CalledProcessError as e:
-       raise RuntimeError("command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))
-    time.sleep(sleep)
-    results = []
-    ident = 'ZZRES>>'
-    for line in lines:
-        idx = line.find(ident)
-        if idx == -1:
-            continue
-        results.append(line[idx + len(ident):])
-    if len(results) == 0:
-        return None
-    return results[0]
+        p.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.wait()
+
+def run_on_ios(ios_device, path, sleep, ios_deploy=IOS_DEPLOY):
+    # Streams the app output and ends the debug session as soon as the
+    # ZZRES>> line arrives, `sleep` is the longest it waits for it
+    args = [ios_deploy, "-b", path]
+    if ios_device is not None:
+        args += ["-i", ios_device]
+    args += ["-v", "-u", "-I"]
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    lines = queue.Queue()
+    reader = threading.Thread(target=read_lines, args=(p.stdout, lines), daemon=True)
+    reader.start()
+    end = time.time() + sleep
+    output = []
+    result = None
+    code = None
+    try:
+        while result is None:
+            try:
+                line = lines.get(timeout=max(end - time.time(), 0))
+            except queue.Empty:
+                print(ios_device, 'No result after', sleep, 'seconds')
+                break
+            if line is None:
+                # the output ended, give ios-deploy the chance to exit by itself
+                try:
+                    p.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    pass
+                break
+            output.append(line)
+            idx = line.find(RESULT_IDENT)
+            if idx != -1:
+                result = line[idx + len(RESULT_IDENT):]
+    finally:
+        # None when it is still running and gets stopped below
+        code = p.poll()
+        stop_session(p)
+    if result is None and code is not None and code != 0:
+        # ios-deploy gave up on its own (install failed, device locked, ...)
+        raise RuntimeError("command '{}' return with error (code {}): {}".format(
+            args, code, '\n'.join(output[-20:])))
+    return result
+
+def list_connected(ios_deploy=IOS_DEPLOY):
+    p = subprocess.check_output([ios_deploy, "-c"])
+    return str(p, 'utf-8')
 
-def check_connected(ios_device):
-    p = subprocess.check_output(["ios-deploy", "-c"])
-    out = str(p, 'utf-8')
-    lines = out.splitlines()
-    for line in lines:
+def check_connected(ios_device, listing):
+    for line in listing.splitlines():
         if ios_device in line:
             return True
-        else:
-            continue
-        return False
-
-def check_directory_and_build (path):
-    FNULL = open(os.devnull, 'w')
-    os.chdir(path)
-    for file in os.listdir(path):
-        if file.endswith(".app"):
-            return path+'/' + file
-    print("Haven't found .app file in directory specified. Building it...")
-    p = subprocess.check_output(["xcodebuild",
-    "-project", path+'/Unity-iPhone.xcodeproj',
-    "-scheme", "Unity-iPhone",
-    "CONFIGURATION_BUILD_DIR="+ path,
-    "-allowProvisioningUpdates"], stderr=FNULL)
-    out = str(p,'utf-8')
-    out = out.splitlines()
-
-    for x in out:
-        if "MkDir" in x:
-            pathToApp = x.split()
-            rez = pathToApp[1]
-            print(rez)
-    print("Finished building .app file")
-    return rez
+    return False
+
+def project_fingerprint(path):
+    # hash of the path and content of every input file of the project
+    digest = hashlib.sha256(' '.join(BUILD_SETTINGS).encode('utf-8'))
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in SKIPPED_DIRS and not d.endswith('.app'))
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            if name in SKIPPED_FILES or not os.path.isfile(file_path):
+                continue
+            digest.update(os.path.relpath(file_path, path).encode('utf-8') + b'\0')
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def cached_app(directory):
+    apps = sorted(glob.glob(os.path.join(directory, '*.app')))
+    if len(apps) == 0:
+        return None
+    return apps[0]
+
+def build_project(path, fingerprint, cache_dir, xcodebuild=XCODEBUILD):
+    # Builds into a fresh directory of its own, so builds can run side by
+    # side, and moves the output to cache_dir/<fingerprint> once it worked
+    target = os.path.join(cache_dir, fingerprint)
+    app = cached_app(target)
+    if app is not None:
+        print('{0} is unchanged, using the cached build {1}'.format(path, app))
+        return app
+    print('{0} changed, building it...'.format(path))
+    work_dir = tempfile.mkdtemp(prefix=fingerprint + '-', dir=cache_dir)
+    out_dir = os.path.join(work_dir, 'out')
+    log_path = os.path.join(work_dir, 'xcodebuild.log')
+    with open(log_path, 'wb') as log:
+        code = subprocess.call([xcodebuild,
+            "-project", os.path.join(os.path.abspath(path), 'Unity-iPhone.xcodeproj'),
+            "CONFIGURATION_BUILD_DIR=" + out_dir,
+            "-derivedDataPath", os.path.join(work_dir, 'DerivedData')] + BUILD_SETTINGS,
+            cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+    if code != 0:
+        raise RuntimeError('xcodebuild failed for {0} (code {1}), see {2}'.format(path, code, log_path))
+    if cached_app(out_dir) is None:
+        raise RuntimeError('xcodebuild did not build a .app for {0}, see {1}'.format(path, log_path))
+    try:
+        os.rename(out_dir, target)
+    except OSError as e:
+        # the same project was just cached by another run, or the cache
+        # can't be written to, then this build is used where it is
+        if cached_app(target) is None:
+            print('Could not cache the build of {0} ({1}), using {2}'.format(path, e, cached_app(out_dir)))
+            return cached_app(out_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print('Finished building {0}'.format(cached_app(target)))
+    return cached_app(target)
+
+def check_directory_and_build(paths, cache_dir=BUILD_CACHE, jobs=2, xcodebuild=XCODEBUILD):
+    # -> path of the .app of every project. A .app in the project folder is
+    # used as it is, the rest is built (at most `jobs` at once) unless a
+    # build of the same project content is cached already
+    # xcodebuild runs inside the build directory, a relative cache would
+    # point somewhere else from there
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    apps = [None] * len(paths)
+    for i, path in enumerate(paths):
+        for file in sorted(os.listdir(path)):
+            if file.endswith(".app"):
+                apps[i] = os.path.join(path, file)
+                break
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        todo = [i for i in range(len(paths)) if apps[i] is None]
+        fingerprints = dict(zip(todo, pool.map(project_fingerprint, [paths[i] for i in todo])))
+        # projects with the same content are built once
+        builds = {}
+        for i in todo:
+            if fingerprints[i] not in builds:
+                builds[fingerprints[i]] = pool.submit(build_project, paths[i], fingerprints[i], cache_dir, xcodebuild)
+        for i in todo:
+            apps[i] = builds[fingerprints[i]].result()
+    return apps
+
+def find_device(listing):
+    # udid of the first device ios-deploy -c found
+    m = re.search(r'Found (\S+)', listing)
+    return m.group(1) if m is not None else None
+
+def run_device(ios_device, tasks, paths_to_app, result_sets, args):
+    # one worker per device, they take (cycle, project) runs from the same queue
+    while True:
+        try:
+            i, i_proj = tasks.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            result = run_on_ios(ios_device, paths_to_app[i_proj], args.sleep, args.ios_deploy)
+        except RuntimeError as e:
+            print(ios_device, e)
+            result = None
+        print(ios_device, 'Result set {0}: {1}'.format(i_proj, result))
+        result_sets[i_proj].append(result)
 
 def main():
     parser = argparse.ArgumentParser(prog='ios-runner')
@@ -72,48 +201,70 @@ def main():
         help='Number of times to run app')
     parser.add_argument(
         '--device', type=str, default=None,
-        help='Device identifier (use `instruments -s devices` to find that)')
+        help='Device identifier (use `instruments -s devices` to find that). Comma separated identifiers run on every device at once')
     parser.add_argument(
         '--sleep', type=int, default=60*5,
-        help='Time to sleep before fetching results')
+        help='Maximum time to wait for the result of a run')
+    parser.add_argument(
+        '--ios-deploy', type=str, default=IOS_DEPLOY,
+        help='ios-deploy executable to use, f.e. fake_ios_deploy.py to try the script without a device')
+    parser.add_argument(
+        '--build-jobs', type=int, default=2,
+        help='How many Xcode projects are built at the same time')
+    parser.add_argument(
+        '--build-cache', type=str, default=BUILD_CACHE,
+        help='Folder with the builds of earlier runs, a project is only rebuilt when its files changed')
+    parser.add_argument(
+        '--xcodebuild', type=str, default=XCODEBUILD,
+        help='xcodebuild executable to use, f.e. fake_xcodebuild.py')
 
     args = parser.parse_args()
 
-    if not check_connected(args.device):
-        print("Device ID you've specified is not connected to your computer.")
-        sys.exit()
-
-    paths_to_app =[]
+    if args.device is None:
+        # the device ios-deploy would pick anyway, named so the summary can say
+        # which device the results are from
+        devices = [find_device(list_connected(args.ios_deploy))]
+    else:
+        devices = args.device.split(',')
+        listing = list_connected(args.ios_deploy)
+        for ios_device in devices:
+            if not check_connected(ios_device, listing):
+                print("Device ID you've specified is not connected to your computer:", ios_device)
+                sys.exit()
 
-    for i in args.path:
-        paths_to_app.append(check_directory_and_build(i))
+    paths_to_app = check_directory_and_build(args.path, args.build_cache, args.build_jobs, args.xcodebuild)
 
 
-    result_sets = []
+    # {udid: result sets}, every device keeps the results it produced
+    device_results = dict((ios_device, [[] for path in args.path]) for ios_device in devices)
     dir_names = []
 
-    for i in range(len(args.path)):
-            result_sets.append([])
-
     for x in args.path:
         rez = x.split('/')
         result = rez[-1]
         dir_names.append(result)
-    
+
+    tasks = queue.Queue()
     for i in range(args.run):
         for i_proj, proj in enumerate(args.path):
-            result = run_on_ios(args.device, paths_to_app[i_proj], args.sleep)
-            print('Result set {0}: {1}'.format(i_proj, result))
-            result_sets[i_proj].append(result)
-
-    print('--------------------------------')
+            tasks.put((i, i_proj))
+    workers = [threading.Thread(target=run_device, args=(ios_device, tasks, paths_to_app, device_results[ios_device], args),
+                                name=str(ios_device))
+               for ios_device in devices]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
-    for i, result_set in enumerate(result_sets):
-        print('Result set {0}'.format(i))
-        print('Project name: ', dir_names[i])
+    for ios_device, result_sets in device_results.items():
+        print('--------------------------------')
+        print('Device', ios_device)
+        for i, result_set in enumerate(result_sets):
+            print('Result set {0}'.format(i))
+            print('Project name: ', dir_names[i])
 
-        for r in result_set:
-            print(r)
+            for r in result_set:
+                print(r)
 
 if __name__ == '__main__':
     main()
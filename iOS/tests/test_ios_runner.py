@@ -0,0 +1,80 @@
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+import time
+
+IOS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_XCODEBUILD = os.path.join(IOS_DIR, 'fake_xcodebuild.py')
+FAKE_IOS_DEPLOY = os.path.join(IOS_DIR, 'fake_ios_deploy.py')
+
+# the script's name is no module name
+spec = importlib.util.spec_from_file_location('ios_runner', os.path.join(IOS_DIR, 'ios-runner.py'))
+ios_runner = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ios_runner)
+
+
+def make_project(path):
+    os.makedirs(os.path.join(path, 'Unity-iPhone.xcodeproj'))
+    with open(os.path.join(path, 'file.txt'), 'w') as out_f:
+        out_f.write('v1\n')
+    return str(path)
+
+
+def read_builds(log_path):
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path) as in_f:
+        return in_f.read().split()
+
+
+def test_unchanged_project_is_built_once(tmp_path, monkeypatch):
+    log_path = str(tmp_path / 'builds.log')
+    monkeypatch.setenv('FAKE_XCODEBUILD_LOG', log_path)
+    monkeypatch.setenv('FAKE_XCODEBUILD_TIME', '0')
+    project = make_project(tmp_path / 'projA')
+    cache_dir = str(tmp_path / 'build_cache')
+    first = ios_runner.check_directory_and_build([project], cache_dir, xcodebuild=FAKE_XCODEBUILD)
+    second = ios_runner.check_directory_and_build([project], cache_dir, xcodebuild=FAKE_XCODEBUILD)
+    assert first == second
+    assert first[0].startswith(cache_dir)
+    assert len(read_builds(log_path)) == 1
+
+    with open(os.path.join(project, 'file.txt'), 'w') as out_f:
+        out_f.write('v2\n')
+    third = ios_runner.check_directory_and_build([project], cache_dir, xcodebuild=FAKE_XCODEBUILD)
+    assert third != first
+    assert len(read_builds(log_path)) == 2
+
+
+def test_build_that_cannot_be_cached_is_used_where_it_is(tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_XCODEBUILD_TIME', '0')
+    project = make_project(tmp_path / 'projA')
+
+    def read_only(src, dst):
+        raise OSError(30, 'Read-only file system')
+    monkeypatch.setattr(ios_runner.os, 'rename', read_only)
+    apps = ios_runner.check_directory_and_build([project], str(tmp_path / 'build_cache'),
+                                                xcodebuild=FAKE_XCODEBUILD)
+    assert apps[0] is not None
+    assert os.path.isdir(apps[0])
+
+
+def test_devices_run_side_by_side_and_stop_at_the_result(tmp_path):
+    projects = [make_project(tmp_path / 'projA'), make_project(tmp_path / 'projB')]
+    env = dict(os.environ, FAKE_IOS_DEVICES='D1,D2', FAKE_IOS_RUN_TIME='2', FAKE_XCODEBUILD_TIME='0')
+    started = time.time()
+    out = subprocess.check_output(
+        [sys.executable, os.path.join(IOS_DIR, 'ios-runner.py')] + projects +
+        ['--run', '2', '--device', 'D1,D2', '--sleep', '60', '--ios-deploy', FAKE_IOS_DEPLOY,
+         '--xcodebuild', FAKE_XCODEBUILD, '--build-cache', str(tmp_path / 'build_cache')],
+        env=env, timeout=120).decode('utf-8')
+    elapsed = time.time() - started
+    results = re.findall(r'^(D[12]) Result set (\d): (\S+)$', out, re.MULTILINE)
+    assert len(results) == 4
+    # the fake app never quits, every run ended on its ZZRES>> line
+    assert all(14.0 <= float(value) <= 21.0 for device, i_proj, value in results)
+    assert set(device for device, i_proj, value in results) == {'D1', 'D2'}
+    # one after the other the four runs take at least 8s
+    assert elapsed < 4 * 2